@@ -2,6 +2,8 @@
 class Config:
   default_config_file = '/etc/cranky/cranky.conf'
   socket_file = '/run/cranky/cranky.socket'
+  trace_file = '/run/cranky/cranky-trace.json'
+  device_cache_file = '/var/lib/cranky/devices.json'
 
   dbus_object_path = '/io/littlecraft/Phony/Examples/Cranky'
   dbus_service_name = 'io.littlecraft.Phony.Examples.Cranky'
@@ -0,0 +1,150 @@
+from phony.base import ipc
+from phony.base import log
+from phony.base.control import ControlSocket
+from phony.base.log import ClassLogger
+
+class ControlInterface(ClassLogger):
+  """
+  crankyctl and monitoring scripts talk to cranky over a local
+  ControlSocket, without going through D-Bus.  'status' and 'state'
+  answer from memory, 'details' asks the bluetooth stack.
+
+  Subscribers are sent the headset's 'incoming_call', 'call_began',
+  'call_ended', 'device_connected' and 'radio_changed' events, and
+  'state_changed' as the hand crank telephone moves between states.
+  """
+
+  _control = None
+  _headset = None
+  _ringer = None
+  _hmi = None
+
+  def __init__(self, socket_file, headset, ringer, hmi):
+    ClassLogger.__init__(self)
+
+    self._headset = headset
+    self._ringer = ringer
+    self._hmi = hmi
+
+    self._control = ControlSocket(socket_file)
+
+    commands = {
+      'status': self.status,
+      'details': headset.get_status,
+      'state': hmi.get_state,
+      'voice': self._discard(headset.initiate_call),
+      'dial': self._discard(headset.dial),
+      'answer': self._discard(headset.answer_call),
+      'hangup': self._discard(headset.hangup_call),
+      'mute': self.mute,
+      'unmute': self.unmute,
+      'mic_volume': headset.set_microphone_capture_volume,
+      'speaker_volume': headset.set_volume,
+      'reset': self._discard(headset.reset),
+      'start_ringing': ringer.start_ringing,
+      'stop_ringing': ringer.stop_ringing,
+      'short_ring': ringer.short_ring,
+      'simulate_off_hook': hmi.simulate_off_hook,
+      'simulate_on_hook': hmi.simulate_on_hook,
+      'simulate_hand_crank_turned': hmi.simulate_hand_crank_turned,
+      'dump_trace': self.dump_trace,
+      'method_stats': self.method_stats,
+      'call_stats': self.call_stats,
+      'slow_calls': self.slow_calls,
+      'reconnect_stats': headset.reconnect_stats,
+      'subscriptions': ipc.subscription_counts,
+      'log_levels': self.log_levels
+    }
+
+    for command, handler in commands.iteritems():
+      self._control.register(command, handler)
+
+    headset.on_incoming_call(lambda path: self._control.publish('incoming_call', path))
+    headset.on_call_began(lambda path: self._control.publish('call_began', path))
+    headset.on_call_ended(lambda path: self._control.publish('call_ended', path))
+    headset.on_device_connected(lambda: self._control.publish('device_connected', self._headset.state()))
+    headset.on_radio_changed(self._radio_changed)
+    hmi.on_state_changed(self._state_changed)
+
+  def __enter__(self):
+    self._control.start()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self._control.stop()
+
+  def status(self):
+    status = self._headset.state()
+    status['state'] = self._hmi.get_state()
+    status['subscribers'] = self._control.subscriber_count()
+    return status
+
+  def mute(self):
+    self._headset.mute_speaker()
+    self._headset.mute_microphone()
+
+  def unmute(self):
+    self._headset.unmute_speaker()
+    self._headset.unmute_microphone()
+
+  def dump_trace(self, path = None):
+    recorder = log.flight_recorder()
+    if not recorder:
+      raise Exception('The flight recorder is not enabled')
+
+    if path:
+      return recorder.dump(path)
+    else:
+      return recorder.chrome_trace()
+
+  def method_stats(self, prefix = ''):
+    stats = log.method_stats()
+    if not stats:
+      raise Exception('Method stats are not being collected')
+
+    return stats.summary(prefix)
+
+  def call_stats(self, prefix = ''):
+    return self._call_stats().summary(prefix)
+
+  def slow_calls(self, threshold = None):
+    stats = self._call_stats()
+
+    if threshold is not None:
+      stats.set_slow_call_threshold(float(threshold))
+
+    return stats.slow_calls()
+
+  def log_levels(self, spec = None):
+    if spec:
+      log.set_levels(spec)
+
+    return log.levels()
+
+  def _radio_changed(self, soft_blocked, hard_blocked):
+    self._control.publish('radio_changed', {
+      'soft_blocked': soft_blocked,
+      'hard_blocked': hard_blocked
+    })
+
+  def _state_changed(self, previous, event, state):
+    self._control.publish('state_changed', {
+      'previous': previous,
+      'event': event,
+      'state': state
+    })
+
+  def _call_stats(self):
+    stats = ipc.call_stats()
+    if not stats:
+      raise Exception('D-Bus call stats are not being collected')
+    return stats
+
+  @staticmethod
+  def _discard(action):
+    # Headset actions return futures of the remote call, which aren't
+    # JSON serializable; failures are logged by the headset.
+    def invoke(*args, **kwargs):
+      action(*args, **kwargs)
+
+    return invoke
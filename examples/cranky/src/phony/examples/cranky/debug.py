@@ -2,6 +2,8 @@ import dbus
 
 from dbus import service
 from config import Config
+from phony.base import ipc
+from phony.base import log
 from phony.base.log import ClassLogger
 
 class DbusDebugInterface(ClassLogger, dbus.service.Object):
@@ -9,6 +11,7 @@ class DbusDebugInterface(ClassLogger, dbus.service.Object):
   OBJECT_PATH = Config.dbus_object_path
   SERVICE_NAME = Config.dbus_service_name
 
+  _bus_provider = None
   _bus = None
   _headset = None
   _ringer = None
@@ -21,6 +24,7 @@ class DbusDebugInterface(ClassLogger, dbus.service.Object):
     self._ringer = ringer
     self._hmi = hmi
 
+    self._bus_provider = bus_provider
     self._bus = bus_provider.session_bus()
 
     self._bus.request_name(self.SERVICE_NAME)
@@ -100,8 +104,81 @@ class DbusDebugInterface(ClassLogger, dbus.service.Object):
   def SimulateHandCrankTurned(self):
     self._hmi.simulate_hand_crank_turned()
 
+  @dbus.service.method(dbus_interface = SERVICE_NAME,
+    in_signature = 's', out_signature = 's')
+  def DumpFlightRecorder(self, path):
+    """
+    Writes the flight recorder to `path` as Chrome trace-event JSON and
+    returns the path.  If `path` is empty, the JSON itself is returned.
+    """
+    recorder = log.flight_recorder()
+    if not recorder:
+      raise Exception('The flight recorder is not enabled')
+
+    if path:
+      return recorder.dump(path)
+    else:
+      return recorder.chrome_trace()
+
+  @dbus.service.method(dbus_interface = SERVICE_NAME,
+    in_signature = 's', out_signature = 'a{sa{sd}}')
+  def GetMethodStats(self, prefix):
+    """
+    Latency (count, p50, p95, p99, max in ms) of each traced method whose
+    'Class.method' name starts with `prefix`
+    """
+    stats = log.method_stats()
+    if not stats:
+      raise Exception('Method stats are not being collected')
+
+    return stats.summary(prefix)
+
+  @dbus.service.method(dbus_interface = SERVICE_NAME,
+    in_signature = 's', out_signature = 'a{sa{sd}}')
+  def GetCallStats(self, prefix):
+    """
+    Latency (count, errors, reply_size, p50, p95, p99, max in ms) of each
+    remote D-Bus call whose 'interface.member' starts with `prefix`
+    """
+    return self._call_stats().summary(prefix)
+
+  @dbus.service.method(dbus_interface = SERVICE_NAME, out_signature = 'aa{ss}')
+  def GetSlowCalls(self):
+    """The most recent calls slower than the slow call threshold"""
+    return [dict((k, str(v)) for k, v in call.iteritems())
+      for call in self._call_stats().slow_calls()]
+
+  @dbus.service.method(dbus_interface = SERVICE_NAME, in_signature = 'd')
+  def SetSlowCallThreshold(self, seconds):
+    self._call_stats().set_slow_call_threshold(seconds)
+
+  @dbus.service.method(dbus_interface = SERVICE_NAME, out_signature = 'a{si}')
+  def GetSubscriptionCounts(self):
+    """Live D-Bus signal receivers, by owner"""
+    return ipc.subscription_counts()
+
+  @dbus.service.method(dbus_interface = SERVICE_NAME, in_signature = 's')
+  def SetLogLevels(self, spec):
+    """
+    Changes log levels by logger name prefix, without a restart.
+    i.e. 'phony.bluetooth.profiles.handsfree=DEBUG,phony.audio=NOTSET'
+    """
+    log.set_levels(spec)
+
+  @dbus.service.method(dbus_interface = SERVICE_NAME, out_signature = 'a{ss}')
+  def GetLogLevels(self):
+    return log.levels()
+
+  def _call_stats(self):
+    stats = ipc.call_stats()
+    if not stats:
+      raise Exception('D-Bus call stats are not being collected')
+    return stats
+
   def __enter__(self):
     return self
 
   def __exit__(self, exc_type, exc_value, traceback):
-    pass
+    self.remove_from_connection()
+    self._bus_provider.release(self._bus)
+    self._bus = None
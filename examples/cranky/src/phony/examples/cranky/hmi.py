@@ -1,5 +1,5 @@
 from fysom import Fysom
-from phony.base.log import ClassLogger
+from phony.base.log import ClassLogger, RateLimit
 
 class HandCrankTelephoneControls(ClassLogger):
   """
@@ -30,12 +30,15 @@ class HandCrankTelephoneControls(ClassLogger):
   _headset = None
 
   _state = None
+  _on_state_changed_listeners = None
 
   _magneto_pulse_count = 0
 
   def __init__(self, io_inputs, bell_ringer, headset):
     ClassLogger.__init__(self)
 
+    self._on_state_changed_listeners = []
+
     self._state = Fysom({
       'initial': 'idle',
       'events': [
@@ -116,6 +119,9 @@ class HandCrankTelephoneControls(ClassLogger):
   def _on_change_state(self, e):
     self.log().debug('** State: %s -> <%s> -> %s' % (e.src, e.event, e.dst))
 
+    for listener in self._on_state_changed_listeners:
+      listener(e.src, e.event, e.dst)
+
   def _on_idle(self, e):
     try:
       self._magneto_pulse_count = 0
@@ -187,6 +193,10 @@ class HandCrankTelephoneControls(ClassLogger):
   def _device_connected(self):
     self._ringer.short_ring()
 
+  def on_state_changed(self, listener):
+    """listener(previous_state, event, state)"""
+    self._on_state_changed_listeners.append(listener)
+
   #
   # Debugging
   #
@@ -217,6 +227,8 @@ class HandCrankTelephoneControls(ClassLogger):
   def _switch_hook_low(self):
     self._state.on_hook()
 
+  # Pulses arrive in bursts while the crank is being turned
+  @ClassLogger.TraceAs.event(rate_limit = RateLimit(per_second = 2, burst = 4))
   def _magneto_pulsed(self):
     self._state.hand_crank_turned()
 
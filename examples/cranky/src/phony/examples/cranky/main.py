@@ -10,17 +10,22 @@ import ConfigParser
 import hmi
 import debug
 import ringer
+import control
 
 import phony.headset
 import phony.base.ipc
+import phony.base.execute
 import phony.io.raspi
 import phony.audio.alsa
 import phony.bluetooth.adapters
+import phony.bluetooth.reconnect
 import phony.bluetooth.profiles.handsfree
 
 from config import Config
 from phony.base import log
 from phony.base.log import ClassLogger, ScopedLogger
+from phony.base.stats import CallStats, MethodStats
+from phony.base.recorder import FlightRecorder
 
 class DictionaryConfig(ConfigParser.ConfigParser):
   def __init__(self):
@@ -42,6 +47,8 @@ class DictionaryConfig(ConfigParser.ConfigParser):
 
 class ApplicationMain(ClassLogger):
   SOCKET_FILE = Config.socket_file
+  TRACE_FILE = Config.trace_file
+  DEVICE_CACHE_FILE = Config.device_cache_file
   CONFIG_FILE = Config.default_config_file
 
   input_layout = {
@@ -99,7 +106,15 @@ class ApplicationMain(ClassLogger):
   def configuration(self, args):
     merged = {
       'socket_file': self.SOCKET_FILE,
+      'trace_file': self.TRACE_FILE,
+      'device_cache_file': self.DEVICE_CACHE_FILE,
+      'flight_recorder_size': FlightRecorder.DEFAULT_CAPACITY,
+      'method_stats': True,
+      'call_stats': True,
+      'slow_call_threshold': CallStats.DEFAULT_SLOW_CALL_THRESHOLD,
       'log_level': 'DEFAULT',
+      'log_levels': '',
+      'call_timeout': phony.base.ipc.DEFAULT_CALL_TIMEOUT,
       'interface': None,
       'name': None,
       'pin': None,
@@ -141,13 +156,33 @@ class ApplicationMain(ClassLogger):
     parser.add_argument('--mic-capture-volume', type = int, help = 'While in-call, the volume (gain) of the microphone')
     parser.add_argument('--volume', type = int, help = 'The in-call volume')
     parser.add_argument('--log-level', help = 'Logging level: DEFAULT, CRITICAL, ERROR, WARNING, INFO, DEBUG')
+    parser.add_argument('--log-levels', help = 'Per subsystem logging levels, i.e. phony.bluetooth.profiles.handsfree=DEBUG,phony.audio=INFO')
     parser.add_argument('--config-file', help = 'Path to configuration file, defaulst to %s' % self.CONFIG_FILE)
-    parser.add_argument('--socket-file', help = 'Path to service socket file, defaults to %s' % self.SOCKET_FILE)
+    parser.add_argument('--socket-file', help = 'Path to the control socket, defaults to %s' % self.SOCKET_FILE)
+    parser.add_argument('--trace-file', help = 'Where the flight recorder is dumped on an unhandled exception, defaults to %s' % self.TRACE_FILE)
+    parser.add_argument('--device-cache-file', help = 'Where the phones to call back after a restart are kept, defaults to %s' % self.DEVICE_CACHE_FILE)
+    parser.add_argument('--flight-recorder-size', type = int, help = 'Number of trace events kept in memory (0 disables), defaults to %d' % FlightRecorder.DEFAULT_CAPACITY)
+    parser.add_argument('--call-timeout', type = float, help = 'Seconds to wait for bluetooth and telephony D-Bus calls, defaults to %s' % phony.base.ipc.DEFAULT_CALL_TIMEOUT)
+    parser.add_argument('--no-method-stats', dest = 'method_stats', action = 'store_const', const = False, help = 'Do not collect per-method latency histograms')
+    parser.add_argument('--no-call-stats', dest = 'call_stats', action = 'store_const', const = False, help = 'Do not collect D-Bus call latency histograms')
+    parser.add_argument('--slow-call-threshold', type = float, help = 'D-Bus calls slower than this (seconds) are logged, defaults to %s' % CallStats.DEFAULT_SLOW_CALL_THRESHOLD)
 
     config = self.configuration(parser.parse_args())
 
     level = log.Levels.parse(config.log_level)
     log.send_to_stdout(level = level)
+    log.set_levels(config.log_levels)
+
+    if config.flight_recorder_size > 0:
+      recorder = FlightRecorder(config.flight_recorder_size)
+      recorder.dump_on_unhandled_exception(config.trace_file)
+      log.record_to(recorder)
+
+    if config.method_stats:
+      log.collect_method_stats(MethodStats())
+
+    if config.call_stats:
+      phony.base.ipc.collect_call_stats(CallStats(config.slow_call_threshold))
 
     #
     # To enforce use of pincode, set `hciconfig <hci> sspmode 0`
@@ -157,10 +192,12 @@ class ApplicationMain(ClassLogger):
 
     session_bus_path = self.session_bus_path()
     bus = phony.base.ipc.BusProvider(session_bus_path)
+    device_cache = phony.bluetooth.reconnect.DeviceCache(config.device_cache_file)
 
-    with phony.base.ipc.OwnedSocketFile(bus, config.socket_file) as socket, \
-         phony.bluetooth.adapters.Bluez5(bus, config.interface) as adapter, \
-         phony.bluetooth.profiles.handsfree.Ofono(bus) as hfp, \
+    # Started first, so sudo and the interpreter start while everything else does
+    with phony.base.execute.helper, \
+         phony.bluetooth.adapters.Bluez5(bus, config.interface, config.call_timeout, device_cache = device_cache) as adapter, \
+         phony.bluetooth.profiles.handsfree.Ofono(bus, config.call_timeout) as hfp, \
          phony.audio.alsa.Alsa(config.audio_card_index) as audio, \
          phony.headset.HandsFreeHeadset(bus, adapter, hfp, audio) as hs:
 
@@ -174,7 +211,8 @@ class ApplicationMain(ClassLogger):
            phony.io.raspi.Outputs(self.output_layout) as io_outputs, \
            ringer.BellRinger(io_outputs) as bells, \
            hmi.HandCrankTelephoneControls(io_inputs, bells, hs) as controls, \
-           debug.DbusDebugInterface(bus, hs, bells, controls):
+           debug.DbusDebugInterface(bus, hs, bells, controls), \
+           control.ControlInterface(config.socket_file, hs, bells, controls):
 
         with ScopedLogger(self, 'main_loop'):
           self.main_loop().run()
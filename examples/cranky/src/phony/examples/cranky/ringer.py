@@ -1,7 +1,8 @@
 import time
-import threading
 
+from phony.base.clock import monotonic
 from phony.base.log import ClassLogger
+from phony.base.tasks import coroutine, sleep
 
 class RingSourceSelector(ClassLogger):
   """
@@ -55,6 +56,9 @@ class BellRinger(ClassLogger):
   The ringer_enable pin toggles power to a MC34063 30v boost
   converter which supplies the source voltage to the H-Bridge.
 
+  The cadence runs as a task on the main loop (see phony.base.tasks),
+  stopping the ringer cancels it.
+
   Reference:
   https://www.sparkfun.com/datasheets/Port-O-Rotary/Blue_Rotary-v07_Schematic.pdf
   """
@@ -67,11 +71,7 @@ class BellRinger(ClassLogger):
   _outputs = None
   _polarity = 0
 
-  _stop = None
-  _thread = None
-  _on_period = 0
-  _off_period = 0
-  _ring_duration = -1
+  _ringing = None
 
   _ring_source = None
 
@@ -81,7 +81,6 @@ class BellRinger(ClassLogger):
     self._ring_source = RingSourceSelector(io_outputs)
     self._ring_source.select_external(force = True)
 
-    self._stop = threading.Event()
     self._outputs = io_outputs
 
     # De-energize hbridge
@@ -92,51 +91,50 @@ class BellRinger(ClassLogger):
   @ClassLogger.TraceAs.event()
   def short_ring(self):
     if not self.is_ringing():
-      self._on_period = 0.20
-      self._off_period = 0
-      self._ring_duration = 0.20
+      self._ringing = self.ring(0.20, 0, 0.20)
 
-      self._thread = threading.Thread(target = self.run)
-      self._thread.start()
+    return self._ringing
 
   @ClassLogger.TraceAs.event()
   def start_ringing(self):
     if not self.is_ringing():
-      self._on_period = self.RING_DURATION_SEC
-      self._off_period = self.PAUSE_DURATION_SEC
-      self._ring_duration = -1
+      self._ringing = self.ring(self.RING_DURATION_SEC, self.PAUSE_DURATION_SEC)
 
-      self._thread = threading.Thread(target = self.run)
-      self._thread.start()
+    return self._ringing
 
   @ClassLogger.TraceAs.event()
   def stop_ringing(self):
     if self.is_ringing():
-      self._stop.set()
-      self._thread.join()
-      self._stop.clear()
+      self._ringing.cancel()
 
   def is_ringing(self):
-    return self._thread != None and self._thread.is_alive()
-
-  def run(self):
+    return self._ringing is not None and not self._ringing.done()
+
+  @coroutine
+  def ring(self, on_period, off_period, ring_duration = -1):
+    """
+    Rings on_period seconds, pauses off_period seconds, and so on for
+    ring_duration seconds (forever when negative, until cancelled).
+    """
     ring_period_sec = 1.0 / self.RING_FREQUENCY_HZ
 
     self._ringer_enable(1)
     self._ring_source.select_internal()
 
-    time_to_stop = time.time() + self._ring_duration
-    while self._is_running() and (self._ring_duration < 0 or time.time() < time_to_stop):
-
-      on_period = time.time() + self._on_period
-      while self._is_running() and time.time() < on_period:
-        self._ding()
-        time.sleep(ring_period_sec)
+    try:
+      time_to_stop = monotonic() + ring_duration
+      while ring_duration < 0 or monotonic() < time_to_stop:
 
-      self._sleep_or_exit(self._off_period)
+        on_period_end = monotonic() + on_period
+        while monotonic() < on_period_end:
+          self._ding()
+          yield sleep(ring_period_sec)
 
-    self._ringer_enable(0)
-    self._ring_source.select_external()
+        if off_period > 0:
+          yield sleep(off_period)
+    finally:
+      self._ringer_enable(0)
+      self._ring_source.select_external()
 
   def _ringer_enable(self, value):
     self._outputs.ringer_enable(value)
@@ -146,14 +144,6 @@ class BellRinger(ClassLogger):
     self._polarity = not self._polarity
     self._outputs.ringer_2(self._polarity)
 
-  def _sleep_or_exit(self, seconds):
-    sleep_period = time.time() + seconds
-    while self._is_running() and time.time() < sleep_period:
-      time.sleep(0.001)
-
-  def _is_running(self):
-    return not self._stop.is_set()
-
   def __enter__(self):
     return self
 
@@ -1,6 +1,7 @@
 import os
 import dbus
 
+from phony.base.ipc import proxies
 from phony.base.log import ClassLogger
 
 class PulseAudio(ClassLogger):
@@ -15,6 +16,7 @@ class PulseAudio(ClassLogger):
 
   _server_address = None
 
+  _bus_provider = None
   _bus = None
   _connection = None
   _core = None
@@ -36,6 +38,7 @@ class PulseAudio(ClassLogger):
   def __init__(self, bus_provider, server_address = None, microphone_source_hint = None, primary_audio_sink_hint = None):
     ClassLogger.__init__(self)
 
+    self._bus_provider = bus_provider
     self._bus = bus_provider.session_bus()
     self._server_address = server_address
 
@@ -44,13 +47,19 @@ class PulseAudio(ClassLogger):
 
   @ClassLogger.TraceAs.call()
   def start(self):
+    self._disconnect_from_server()
+
     self._connection = self._connect_to_server(self._server_address)
-    self._core = self._connection.get_object(
+    self._core = proxies.interface(
+      self._connection,
       PulseAudio.PA_CORE_INTERFACE,
-      PulseAudio.PA_CORE_PATH
+      PulseAudio.PA_CORE_PATH,
+      PulseAudio.PA_CORE_INTERFACE
     )
-    self._core_properties = dbus.Interface(
-      self._core,
+    self._core_properties = proxies.interface(
+      self._connection,
+      PulseAudio.PA_CORE_INTERFACE,
+      PulseAudio.PA_CORE_PATH,
       PulseAudio.DBUS_PROPERTIES_INTERFACE
     )
 
@@ -85,7 +94,7 @@ class PulseAudio(ClassLogger):
         {
           'sink': sink,
           'source': source,
-          'latency_msec': 1
+          'latency_msec': '1'
         }
       )
 
@@ -119,10 +128,12 @@ class PulseAudio(ClassLogger):
     sinks = self._get_core_property('Sinks')
 
     for path in sinks:
-      sink = self._connection.get_object(object_path = path)
-
-      self._sink_properties_by_path[path] = \
-        dbus.Interface(sink, PulseAudio.DBUS_PROPERTIES_INTERFACE)
+      self._sink_properties_by_path[path] = proxies.interface(
+        self._connection,
+        None,
+        path,
+        PulseAudio.DBUS_PROPERTIES_INTERFACE
+      )
 
   def _collect_sources(self):
     self._source_properties_by_path = {}
@@ -130,10 +141,12 @@ class PulseAudio(ClassLogger):
     sources = self._get_core_property('Sources')
 
     for path in sources:
-      source = self._connection.get_object(object_path = path)
-
-      self._source_properties_by_path[path] = \
-        dbus.Interface(source, PulseAudio.DBUS_PROPERTIES_INTERFACE)
+      self._source_properties_by_path[path] = proxies.interface(
+        self._connection,
+        None,
+        path,
+        PulseAudio.DBUS_PROPERTIES_INTERFACE
+      )
 
   @ClassLogger.TraceAs.call()
   def _connect_to_server(self, server_address = None):
@@ -144,19 +157,27 @@ class PulseAudio(ClassLogger):
 
     return dbus.connection.Connection(server_address)
 
+  def _disconnect_from_server(self):
+    # A private connection, its proxies and their receivers go with it
+    if self._connection:
+      proxies.forget(self._connection)
+      self._connection.close()
+      self._connection = None
+
   def _get_server_address(self):
     if 'PULSE_DBUS_SERVER' in os.environ:
       address = os.environ['PULSE_DBUS_SERVER']
     else:
-      server = self._bus.get_object(
+      server = proxies.interface(
+        self._bus,
         PulseAudio.PA_ROOT_INTERFACE,
-        PulseAudio.PA_SERVER_LOOKUP_PATH
+        PulseAudio.PA_SERVER_LOOKUP_PATH,
+        PulseAudio.DBUS_PROPERTIES_INTERFACE
       )
 
       address = server.Get(
         PulseAudio.PA_SERVER_LOOKUP_INTERFACE,
-        'Address',
-        PulseAudio.DBUS_PROPERTIES_INTERFACE
+        'Address'
       )
 
     return address
@@ -198,4 +219,6 @@ class PulseAudio(ClassLogger):
     return self
 
   def __exit__(self, exc_type, exc_value, traceback):
-    pass
\ No newline at end of file
+    self._disconnect_from_server()
+    self._bus_provider.release(self._bus)
+    self._bus = None
\ No newline at end of file
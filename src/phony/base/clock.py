@@ -0,0 +1,42 @@
+import time
+import ctypes
+import ctypes.util
+
+CLOCK_MONOTONIC = 1
+
+class _Timespec(ctypes.Structure):
+  _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+def _find_clock_gettime():
+  for library in [None, ctypes.util.find_library('rt')]:
+    try:
+      # PyDLL: the call is short enough that there's no point in
+      # releasing the GIL
+      clock_gettime = ctypes.PyDLL(library).clock_gettime
+      clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+      return clock_gettime
+    except (OSError, AttributeError):
+      pass
+
+  return None
+
+def _make_monotonic():
+  if hasattr(time, 'monotonic'):
+    return time.monotonic
+
+  clock_gettime = _find_clock_gettime()
+  if not clock_gettime:
+    return time.time
+
+  def monotonic():
+    timespec = _Timespec()
+    clock_gettime(CLOCK_MONOTONIC, ctypes.byref(timespec))
+    return timespec.tv_sec + timespec.tv_nsec * 1e-9
+
+  return monotonic
+
+#
+# Seconds, from an arbitrary starting point, that never go backwards
+# (unlike time.time(), which follows NTP and manual clock changes).
+#
+monotonic = _make_monotonic()
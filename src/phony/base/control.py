@@ -0,0 +1,365 @@
+import os
+import json
+import errno
+import socket
+import struct
+
+from phony.base.log import ClassLogger
+
+try:
+  import gobject
+except ImportError:
+  # ControlClient is used by scripts that don't run a main loop
+  gobject = None
+
+# Linux, Python 2's socket module doesn't name it
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+
+class ControlError(Exception):
+  pass
+
+class ControlSocket(ClassLogger):
+  """
+  Local control plane: an AF_UNIX stream socket served from the main
+  loop, speaking newline delimited JSON.  Requests are
+
+    {"id": 1, "command": "status", "args": {}}
+
+  answered with {"id": 1, "result": ...} or {"id": 1, "error": "..."}.
+  Built in commands are 'commands' (lists them) and 'subscribe' /
+  'unsubscribe' ({"events": [...]}, none for all), after which publish()ed
+  events arrive as {"event": "call_began", "data": ...}.
+
+  A socket file left behind by a crashed process is replaced, one that
+  still accepts connections means another instance is running.  Only
+  the user running it (and root) can connect.
+  """
+
+  BACKLOG = 4
+  RECEIVE_SIZE = 4096
+
+  # A client that doesn't read its events is dropped beyond this
+  MAXIMUM_PENDING_BYTES = 1 << 20
+  MAXIMUM_REQUEST_BYTES = 1 << 16
+
+  _path = None
+  _socket = None
+  _watch = None
+  _connections = None
+  _commands = None
+
+  def __init__(self, path):
+    ClassLogger.__init__(self)
+
+    self._path = path
+    self._connections = {}
+    self._commands = {
+      'commands': self._list_commands,
+      'subscribe': None,
+      'unsubscribe': None
+    }
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.stop()
+
+  def path(self):
+    return self._path
+
+  def register(self, command, handler):
+    """handler(**args) returns the (JSON serializable) result"""
+    self._commands[command] = handler
+
+  @ClassLogger.TraceAs.call()
+  def start(self):
+    self._socket = ControlSocket.bind(self._path, self.BACKLOG)
+    self._watch = gobject.io_add_watch(self._socket.fileno(), gobject.IO_IN, self._accept)
+
+  @ClassLogger.TraceAs.call()
+  def stop(self):
+    for connection in self._connections.values():
+      self._close(connection)
+
+    if self._watch is not None:
+      gobject.source_remove(self._watch)
+      self._watch = None
+
+    if self._socket:
+      self._socket.close()
+      self._socket = None
+
+      try:
+        os.remove(self._path)
+      except OSError, ex:
+        self.log().warning('Unable to remove socket file %s: %s' % (self._path, ex))
+
+  def publish(self, event, data = None):
+    message = None
+
+    for connection in self._connections.values():
+      if connection.wants(event):
+        if message is None:
+          message = ControlSocket.encode({'event': event, 'data': data})
+        self._send(connection, message)
+
+  def subscriber_count(self):
+    return len([c for c in self._connections.values() if c.events is not None])
+
+  def connection_count(self):
+    return len(self._connections)
+
+  @staticmethod
+  def bind(path, backlog):
+    if os.path.exists(path):
+      probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      try:
+        probe.connect(path)
+      except socket.error, ex:
+        if ex.errno not in (errno.ECONNREFUSED, errno.ENOTSOCK):
+          raise
+        os.remove(path)
+      else:
+        raise Exception('Socket file %s is in use, already running?' % path)
+      finally:
+        probe.close()
+
+    listening = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    # Created owner only, there's no window where others can connect
+    umask = os.umask(0077)
+    try:
+      listening.bind(path)
+    finally:
+      os.umask(umask)
+
+    os.chmod(path, 0600)
+
+    listening.listen(backlog)
+    listening.setblocking(False)
+    return listening
+
+  @staticmethod
+  def peer_uid(client):
+    credentials = client.getsockopt(socket.SOL_SOCKET, SO_PEERCRED, struct.calcsize('3i'))
+    pid, uid, gid = struct.unpack('3i', credentials)
+    return uid
+
+  @staticmethod
+  def encode(message):
+    return json.dumps(message, separators = (',', ':')) + '\n'
+
+  def _accept(self, fd, condition):
+    try:
+      client, _ = self._socket.accept()
+    except socket.error:
+      return True
+
+    uid = ControlSocket.peer_uid(client)
+    if uid not in (0, os.getuid()):
+      self.log().warning('Refusing control connection from uid %d' % uid)
+      client.close()
+      return True
+
+    client.setblocking(False)
+
+    connection = _Connection(client)
+    connection.read_watch = gobject.io_add_watch(
+      client.fileno(),
+      gobject.IO_IN | gobject.IO_HUP | gobject.IO_ERR,
+      lambda fd, condition: self._readable(connection)
+    )
+
+    self._connections[client.fileno()] = connection
+    return True
+
+  def _readable(self, connection):
+    try:
+      received = connection.socket.recv(self.RECEIVE_SIZE)
+    except socket.error, ex:
+      if ex.errno in (errno.EAGAIN, errno.EINTR):
+        return True
+      received = ''
+
+    if not received:
+      self._close(connection)
+      return False
+
+    connection.incoming += received
+
+    while '\n' in connection.incoming:
+      line, connection.incoming = connection.incoming.split('\n', 1)
+      if line.strip():
+        self._send(connection, ControlSocket.encode(self._handle(connection, line)))
+
+    if len(connection.incoming) > self.MAXIMUM_REQUEST_BYTES:
+      self.log().warning('Control request too long, closing connection')
+      self._close(connection)
+      return False
+
+    return connection.socket is not None
+
+  def _handle(self, connection, line):
+    request_id = None
+
+    try:
+      request = json.loads(line)
+      if not isinstance(request, dict):
+        raise ControlError('Requests are JSON objects')
+
+      request_id = request.get('id')
+      command = request.get('command')
+      args = request.get('args') or {}
+
+      if command not in self._commands:
+        raise ControlError('Unknown command: %s' % command)
+
+      if command == 'subscribe':
+        connection.subscribe(args.get('events'))
+        result = True
+      elif command == 'unsubscribe':
+        connection.events = None
+        result = True
+      else:
+        args = dict((str(k), v) for k, v in args.iteritems())
+        result = self._commands[command](**args)
+
+      return {'id': request_id, 'result': result}
+    except Exception, ex:
+      return {'id': request_id, 'error': str(ex)}
+
+  def _send(self, connection, message):
+    if connection.socket is None:
+      return
+
+    connection.outgoing += message
+
+    if len(connection.outgoing) > self.MAXIMUM_PENDING_BYTES:
+      self.log().warning('Control client is not reading, closing connection')
+      self._close(connection)
+      return
+
+    self._flush(connection)
+
+  def _flush(self, connection):
+    try:
+      sent = connection.socket.send(connection.outgoing)
+      connection.outgoing = connection.outgoing[sent:]
+    except socket.error, ex:
+      if ex.errno not in (errno.EAGAIN, errno.EINTR):
+        self._close(connection)
+        return False
+
+    if connection.outgoing and connection.write_watch is None:
+      connection.write_watch = gobject.io_add_watch(
+        connection.socket.fileno(),
+        gobject.IO_OUT,
+        lambda fd, condition: self._writable(connection)
+      )
+
+    return True
+
+  def _writable(self, connection):
+    if connection.socket is None or not self._flush(connection):
+      return False
+
+    if connection.outgoing:
+      return True
+
+    connection.write_watch = None
+    return False
+
+  def _close(self, connection):
+    if connection.socket is None:
+      return
+
+    for watch in [connection.read_watch, connection.write_watch]:
+      if watch is not None:
+          gobject.source_remove(watch)
+
+    connection.read_watch = None
+    connection.write_watch = None
+
+    self._connections.pop(connection.socket.fileno(), None)
+
+    connection.socket.close()
+    connection.socket = None
+
+  def _list_commands(self):
+    return sorted(self._commands.keys())
+
+class _Connection(object):
+  __slots__ = ('socket', 'incoming', 'outgoing', 'events', 'read_watch', 'write_watch')
+
+  def __init__(self, client):
+    self.socket = client
+    self.incoming = ''
+    self.outgoing = ''
+    # None: not subscribed, empty: all events
+    self.events = None
+    self.read_watch = None
+    self.write_watch = None
+
+  def subscribe(self, events):
+    self.events = set(events or [])
+
+  def wants(self, event):
+    return self.events is not None and (not self.events or event in self.events)
+
+class ControlClient(object):
+  """Blocking client of a ControlSocket, for scripts and crankyctl"""
+
+  _socket = None
+  _file = None
+  _next_id = 0
+
+  def __init__(self, path, timeout = None):
+    self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self._socket.settimeout(timeout)
+    self._socket.connect(path)
+    self._file = self._socket.makefile('r')
+
+  def call(self, command, **args):
+    self._next_id += 1
+    request_id = self._next_id
+
+    self._socket.sendall(ControlSocket.encode({'id': request_id, 'command': command, 'args': args}))
+
+    while True:
+      message = self._receive()
+
+      if message.get('id') != request_id:
+        # An event that arrived before the reply
+        continue
+
+      if 'error' in message:
+        raise ControlError(message['error'])
+
+      return message.get('result')
+
+  def subscribe(self, events = None):
+    """Yields (event, data) pairs as they are published"""
+    self.call('subscribe', events = events or [])
+
+    while True:
+      message = self._receive()
+      if 'event' in message:
+        yield message['event'], message.get('data')
+
+  def close(self):
+    self._file.close()
+    self._socket.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def _receive(self):
+    line = self._file.readline()
+    if not line:
+      raise ControlError('Connection closed')
+    return json.loads(line)
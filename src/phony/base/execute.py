@@ -1,4 +1,201 @@
+import os
+import sys
+import json
+import errno
+import socket
 import subprocess
 
+from phony.base import privileged as helper_script
+from phony.base.future import Future
+from phony.base.log import ClassLogger
+
+try:
+  import gobject
+except ImportError:
+  # Without a main loop, replies are only read by calling _receive()
+  gobject = None
+
 def privileged(command, shell = True):
-  subprocess.check_output("sudo " + command, shell = shell)
\ No newline at end of file
+  subprocess.check_output("sudo " + command, shell = shell)
+
+class PrivilegedError(Exception):
+  def __init__(self, argv, status, output):
+    Exception.__init__(self, '%s exited with %s: %s' % (' '.join(argv), status, output.strip()))
+    self.status = status
+    self.output = output
+
+class PrivilegedHelper(ClassLogger):
+  """
+  A root process started once (with sudo), instead of a sudo and a
+  shell per command.  Commands are sent over a socketpair and must be in
+  phony.base.privileged.ALLOWED_COMMANDS:
+
+    helper.run('rfkill', 'unblock', 'bluetooth')
+
+  returns a Future of the command's output, that fails with
+  PrivilegedError if it exits with a non zero status.  Replies are read
+  from the main loop; the helper is restarted by the next run() if it
+  exits.
+  """
+
+  LAUNCHER = ['sudo', '-n']
+  RECEIVE_SIZE = 4096
+
+  _launcher = None
+  _process = None
+  _socket = None
+  _watch = None
+  _incoming = ''
+  _pending = None
+  _next_id = 0
+
+  def __init__(self, launcher = LAUNCHER):
+    ClassLogger.__init__(self)
+
+    self._launcher = list(launcher)
+    self._pending = {}
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.stop()
+
+  @ClassLogger.TraceAs.call()
+  def start(self):
+    if self.running():
+      return
+
+    script = os.path.splitext(os.path.abspath(helper_script.__file__))[0] + '.py'
+
+    ours, theirs = socket.socketpair()
+
+    try:
+      self._process = subprocess.Popen(
+        self._launcher + [sys.executable, script],
+        stdin = theirs,
+        stdout = theirs,
+        close_fds = True
+      )
+    except:
+      ours.close()
+      raise
+    finally:
+      theirs.close()
+
+    self._socket = ours
+    self._incoming = ''
+
+    if gobject:
+      self._watch = gobject.io_add_watch(
+        ours.fileno(),
+        gobject.IO_IN | gobject.IO_HUP | gobject.IO_ERR,
+        lambda fd, condition: self._receive()
+      )
+
+  @ClassLogger.TraceAs.call()
+  def stop(self):
+    if self._socket:
+      # The helper exits once its stdin is closed
+      self._disconnect('Privileged helper stopped')
+
+  def running(self):
+    return self._socket is not None
+
+  def run(self, *argv):
+    argv = list(argv)
+
+    try:
+      helper_script.check(argv)
+    except ValueError, ex:
+      return Future.failed(ex)
+
+    future = Future()
+
+    try:
+      self.start()
+
+      self._next_id += 1
+      request_id = self._next_id
+      self._pending[request_id] = (argv, future)
+
+      self._socket.sendall(json.dumps({'id': request_id, 'argv': argv}) + '\n')
+    except Exception, ex:
+      if self._socket:
+        self._disconnect('Privileged helper failed: %s' % ex)
+      future.set_exception(ex)
+
+    return future
+
+  def _receive(self):
+    if not self._socket:
+      return False
+
+    try:
+      received = self._socket.recv(self.RECEIVE_SIZE)
+    except socket.error, ex:
+      if ex.errno in (errno.EAGAIN, errno.EINTR):
+        return True
+      received = ''
+
+    if not received:
+      self._disconnect('Privileged helper exited')
+      return False
+
+    self._incoming += received
+
+    while '\n' in self._incoming:
+      line, self._incoming = self._incoming.split('\n', 1)
+
+      try:
+        message = json.loads(line)
+      except ValueError, ex:
+        self.log().error('Ignoring malformed privileged helper reply: %s' % ex)
+        continue
+
+      if isinstance(message, dict):
+        self._reply(message)
+
+    return True
+
+  def _reply(self, message):
+    argv, future = self._pending.pop(message.get('id'), (None, None))
+    if not future:
+      return
+
+    if 'error' in message:
+      future.set_exception(Exception(message['error']))
+    elif message['status'] != 0:
+      future.set_exception(PrivilegedError(argv, message['status'], message['output']))
+    else:
+      future.set_result(message['output'])
+
+  def _disconnect(self, reason):
+    if self._watch is not None:
+      gobject.source_remove(self._watch)
+      self._watch = None
+
+    self._socket.close()
+    self._socket = None
+
+    if self._process:
+      self._reap(self._process, reason)
+      self._process = None
+
+    pending, self._pending = self._pending, {}
+    for argv, future in pending.values():
+      future.set_exception(Exception('%s before %s completed' % (reason, ' '.join(argv))))
+
+  def _reap(self, process, reason):
+    # The helper exits once its stdin is closed, it isn't waited for
+    if gobject:
+      gobject.child_watch_add(process.pid,
+        lambda pid, condition: self.log().info('%s (status %s)' % (reason, condition >> 8)))
+    elif process.poll() is not None:
+      self.log().info('%s (status %s)' % (reason, process.returncode))
+    else:
+      # Reaped by subprocess once the last reference is gone
+      self.log().info(reason)
+
+helper = PrivilegedHelper()
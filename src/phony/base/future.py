@@ -0,0 +1,183 @@
+from phony.base.log import static
+
+class CancelledError(Exception):
+  pass
+
+class Future(object):
+  """
+  Result of an operation that completes later on the main loop, i.e. a
+  D-Bus call made with reply and error handlers (see
+  phony.base.ipc.call_async).  Not thread safe: complete it, and add
+  callbacks, from the main loop only.
+  """
+
+  _done = False
+  _result = None
+  _exception = None
+  _callbacks = None
+
+  def __init__(self):
+    self._callbacks = []
+
+  def done(self):
+    return self._done
+
+  def cancelled(self):
+    return isinstance(self._exception, CancelledError)
+
+  def result(self):
+    if not self._done:
+      raise Exception('Result is not ready yet')
+
+    if self._exception is not None:
+      raise self._exception
+
+    return self._result
+
+  def exception(self):
+    if not self._done:
+      raise Exception('Result is not ready yet')
+
+    return self._exception
+
+  def set_result(self, result):
+    if self._done:
+      return
+
+    self._result = result
+    self._complete()
+
+  def set_exception(self, exception):
+    if self._done:
+      return
+
+    self._exception = exception
+    self._complete()
+
+  def cancel(self):
+    """Completes the future with CancelledError, unless it is done already"""
+    if self._done:
+      return False
+
+    self.set_exception(CancelledError())
+    return True
+
+  def add_done_callback(self, callback):
+    """Calls callback(future) once done, right away if it already is"""
+    if self._done:
+      self._call(callback)
+    else:
+      self._callbacks.append(callback)
+
+  def then(self, callback):
+    """
+    Returns a future of callback(result), or of the future callback
+    returns.  Exceptions skip the callback and fail the returned future.
+    """
+    chained = Future()
+
+    def done(future):
+      if future._exception is not None:
+        chained.set_exception(future._exception)
+        return
+
+      try:
+        result = callback(future._result)
+      except Exception, ex:
+        chained.set_exception(ex)
+        return
+
+      if isinstance(result, Future):
+        result.add_done_callback(lambda inner: Future._copy(inner, chained))
+      else:
+        chained.set_result(result)
+
+    self.add_done_callback(done)
+    return chained
+
+  def _complete(self):
+    self._done = True
+
+    callbacks = self._callbacks
+    self._callbacks = []
+
+    for callback in callbacks:
+      self._call(callback)
+
+  def _call(self, callback):
+    # One failing callback mustn't keep the others from running
+    try:
+      callback(self)
+    except Exception:
+      static(__name__).exception('Callback %r of a future failed' % callback)
+
+  @staticmethod
+  def _copy(source, destination):
+    if source._exception is not None:
+      destination.set_exception(source._exception)
+    else:
+      destination.set_result(source._result)
+
+  @staticmethod
+  def resolved(result = None):
+    future = Future()
+    future.set_result(result)
+    return future
+
+  @staticmethod
+  def failed(exception):
+    future = Future()
+    future.set_exception(exception)
+    return future
+
+def gather(futures):
+  """
+  Returns a future of the list of all results, failing with the first
+  exception.
+  """
+  futures = list(futures)
+  gathered = Future()
+
+  if not futures:
+    gathered.set_result([])
+    return gathered
+
+  remaining = [len(futures)]
+
+  def done(future):
+    if future._exception is not None:
+      gathered.set_exception(future._exception)
+      return
+
+    remaining[0] -= 1
+    if remaining[0] == 0:
+      gathered.set_result([f._result for f in futures])
+
+  for future in futures:
+    future.add_done_callback(done)
+
+  return gathered
+
+def settle(futures):
+  """
+  Returns a future of the list of `futures`, once all of them are done
+  whether they failed or not.  It never fails.
+  """
+  futures = list(futures)
+  settled = Future()
+
+  if not futures:
+    settled.set_result([])
+    return settled
+
+  remaining = [len(futures)]
+
+  def done(future):
+    remaining[0] -= 1
+    if remaining[0] == 0:
+      settled.set_result(futures)
+
+  for future in futures:
+    future.add_done_callback(done)
+
+  return settled
@@ -1,23 +1,82 @@
 import dbus
-import os
+import weakref
+import functools
+import threading
 
 from dbus.mainloop.glib import DBusGMainLoop
+from phony.base.clock import monotonic
+from phony.base.future import Future
+from phony.base.log import note_io
+
+_call_stats = None
+
+def collect_call_stats(stats):
+  """
+  Records the calls and signals of the interfaces handed out by
+  `proxies` (and of add_signal_receiver()) to a stats.CallStats, or
+  stops recording when None.
+  """
+  global _call_stats
+  _call_stats = stats
+
+def call_stats():
+  return _call_stats
 
 class BusProvider:
+  """
+  Hands out bus connections.  By default every component shares one
+  connection per bus address, created on first use and closed when the
+  last user releases it.  Ask for a dedicated connection to isolate a
+  component's match rules and traffic.
+  """
+
+  SYSTEM = 'system'
+  SESSION = 'session'
+
   path = None
 
+  # Shared by all providers, by bus address: [connection, reference count]
+  _shared = {}
+  _dedicated = set()
+  _lock = threading.Lock()
+  _glib_main_loop = None
+
   def __init__(self, session_bus_path=None):
     self.path = session_bus_path
 
-  def system_bus(self):
-    return dbus.SystemBus(mainloop = self._main_loop())
+  def system_bus(self, dedicated = False):
+    return self._acquire(self.SYSTEM, dedicated)
 
-  def session_bus(self):
-    main_loop = self._main_loop()
-    if self.path:
-      return dbus.bus.BusConnection(self.path, mainloop=main_loop)
-    else:
-      return dbus.SessionBus(mainloop = main_loop)
+  def session_bus(self, dedicated = False):
+    return self._acquire(self.path or self.SESSION, dedicated)
+
+  def release(self, bus):
+    """
+    Drops a reference to a connection from system_bus() or session_bus(),
+    closing it once nobody is using it.
+    """
+    if not bus:
+      return
+
+    with BusProvider._lock:
+      if bus in BusProvider._dedicated:
+        BusProvider._dedicated.discard(bus)
+        proxies.forget(bus)
+        bus.close()
+        return
+
+      for address, entry in BusProvider._shared.items():
+        if entry[0] is bus:
+          entry[1] -= 1
+          if entry[1] <= 0:
+            del BusProvider._shared[address]
+            proxies.forget(bus)
+            bus.close()
+          return
+
+  def connection_count(self):
+    with BusProvider._lock:
+      return len(BusProvider._shared) + len(BusProvider._dedicated)
 
   def __repr__(self):
     if self.path:
@@ -25,37 +84,487 @@ class BusProvider:
     else:
       return ''
 
+  def _acquire(self, address, dedicated):
+    with BusProvider._lock:
+      if dedicated:
+        bus = self._connect(address)
+        BusProvider._dedicated.add(bus)
+        return bus
+
+      entry = BusProvider._shared.get(address)
+      if not entry:
+        entry = BusProvider._shared[address] = [self._connect(address), 0]
+
+      entry[1] += 1
+      return entry[0]
+
+  def _connect(self, address):
+    if address == self.SYSTEM:
+      address = dbus.bus.BUS_SYSTEM
+    elif address == self.SESSION:
+      address = dbus.bus.BUS_SESSION
+
+    return dbus.bus.BusConnection(address, mainloop = self._main_loop())
+
   def _main_loop(self):
-    return DBusGMainLoop()
+    if not BusProvider._glib_main_loop:
+      BusProvider._glib_main_loop = DBusGMainLoop()
 
-class OwnedSocketFile:
-  def __init__(self, bus, socket_file):
-    self.socket_file = socket_file
-    self.create_socket_file(bus)
+    return BusProvider._glib_main_loop
 
-  def create_socket_file(self, bus):
-    if os.path.isfile(self.socket_file):
-      raise Exception('Socket file %s exists, already running?' % self.socket_file)
+# In-signatures of the remote methods phony calls, so proxies can be
+# created without introspection and still marshal their arguments right
+SIGNATURES = {
+  'org.freedesktop.DBus.Properties': {'Get': 'ss', 'Set': 'ssv', 'GetAll': 's'},
+  'org.freedesktop.DBus.ObjectManager': {'GetManagedObjects': ''},
 
-    try:
-      socket_file = open(self.socket_file, 'w')
+  'org.bluez.Adapter1': {'StartDiscovery': '', 'StopDiscovery': '', 'RemoveDevice': 'o'},
+  'org.bluez.Device1': {'Connect': '', 'Disconnect': '', 'ConnectProfile': 's', 'DisconnectProfile': 's', 'Pair': '', 'CancelPairing': ''},
+  'org.bluez.AgentManager1': {'RegisterAgent': 'os', 'UnregisterAgent': 'o', 'RequestDefaultAgent': 'o'},
 
-      if bus.path:
-        socket_file.write(str(bus))
-    except Exception, ex:
-      self.log().warning('Unable to write socket file %s: %s' % (self.socket_file, ex))
+  'org.ofono.Manager': {'GetModems': ''},
+  'org.ofono.Modem': {'GetProperties': '', 'SetProperty': 'sv'},
+  'org.ofono.Handsfree': {'GetProperties': '', 'SetProperty': 'sv', 'RequestPhoneNumber': ''},
+  'org.ofono.VoiceCallManager': {'GetProperties': '', 'GetCalls': '', 'Dial': 'ss', 'HangupAll': '', 'SendTones': 's'},
+  'org.ofono.VoiceCall': {'GetProperties': '', 'Answer': '', 'Hangup': '', 'Deflect': 's'},
+
+  'org.PulseAudio.Core1': {'LoadModule': 'sa{ss}', 'Exit': ''},
+  'org.PulseAudio.Core1.Device': {'Suspend': 'b', 'GetPortByName': 's'}
+}
+
+# Signals whose first argument is the path of an object that went away
+REMOVAL_SIGNALS = [
+  ('org.freedesktop.DBus.ObjectManager', 'InterfacesRemoved'),
+  ('org.ofono.Manager', 'ModemRemoved'),
+  ('org.ofono.VoiceCallManager', 'CallRemoved')
+]
+
+# Interfaces that make an object what it is: the object is gone once
+# one is removed, rather than left with fewer (i.e. a device losing
+# org.bluez.MediaControl1 or Battery1 on disconnect)
+KEY_INTERFACES = set([
+  'org.bluez.Adapter1',
+  'org.bluez.Device1',
+  'org.ofono.Modem',
+  'org.ofono.VoiceCall'
+])
+
+# ... and of an object that (re)appeared
+ADDITION_SIGNALS = [
+  ('org.freedesktop.DBus.ObjectManager', 'InterfacesAdded'),
+  ('org.ofono.Manager', 'ModemAdded'),
+  ('org.ofono.VoiceCallManager', 'CallAdded')
+]
+
+class SignedInterface(dbus.Interface):
+  """
+  dbus.Interface that passes the bundled signature of each method it
+  knows, instead of relying on introspection data.  Its methods and
+  signal handlers are instrumented, see InstrumentedMethod.
+  """
+
+  def __init__(self, obj, dbus_interface, signatures):
+    dbus.Interface.__init__(self, obj, dbus_interface)
+    self._signatures = signatures
+
+  def __getattr__(self, member):
+    if member.startswith('__') and member.endswith('__'):
+      raise AttributeError(member)
+
+    method = self._obj.get_dbus_method(member, self._dbus_interface)
+
+    signature = self._signatures.get(member)
+    if signature is not None:
+      method = functools.partial(method, signature = signature)
+
+    return InstrumentedMethod(method, self._obj.requested_bus_name, self._dbus_interface, member)
+
+  def connect_to_signal(self, signal_name, handler_function, **keywords):
+    return dbus.Interface.connect_to_signal(
+      self,
+      signal_name,
+      instrumented_handler(handler_function, self._dbus_interface, signal_name),
+      **keywords
+    )
+
+class InstrumentedMethod(object):
+  """
+  Remote method that notes blocking calls as I/O for traces (see
+  log.note_io), and while collect_call_stats() is on, records the
+  latency, error and reply size of both blocking calls and calls with
+  reply and error handlers.
+  """
+
+  __slots__ = ('_method', '_destination', '_interface', '_member')
+
+  def __init__(self, method, destination, interface, member):
+    self._method = method
+    self._destination = destination
+    self._interface = interface
+    self._member = member
+
+  def __call__(self, *args, **kwargs):
+    stats = _call_stats
+    asynchronous = 'reply_handler' in kwargs
+
+    if not asynchronous:
+      note_io()
+
+    if stats is None:
+      return self._method(*args, **kwargs)
+
+    started = monotonic()
+
+    if asynchronous:
+      reply_handler = kwargs['reply_handler']
+      error_handler = kwargs.get('error_handler')
+
+      def reply(*values):
+        self._record(stats, started, None, values)
+        reply_handler(*values)
+
+      def error(exception):
+        self._record(stats, started, exception, None)
+        if error_handler:
+          error_handler(exception)
+
+      kwargs['reply_handler'] = reply
+      kwargs['error_handler'] = error
+
+      return self._method(*args, **kwargs)
 
-  def remove_socket_file(self):
     try:
-      if os.path.isfile(self.socket_file):
-        os.remove(self.socket_file)
+      result = self._method(*args, **kwargs)
     except Exception, ex:
-      self.log().warning('Unable to remove socket file %s: %s' % (self.socket_file, ex))
+      self._record(stats, started, ex, None)
+      raise
+
+    self._record(stats, started, None, result)
+    return result
+
+  def _record(self, stats, started, error, reply):
+    stats.record_call(
+      self._destination,
+      self._interface,
+      self._member,
+      monotonic() - started,
+      error,
+      reply
+    )
+
+def instrumented_handler(handler, interface, member):
+  """Wraps a signal handler to record its latency while collecting call stats"""
+  def handle(*args, **kwargs):
+    stats = _call_stats
+    if stats is None:
+      return handler(*args, **kwargs)
+
+    started = monotonic()
+    try:
+      return handler(*args, **kwargs)
+    finally:
+      stats.record_signal(interface, member, monotonic() - started)
+
+  return handle
+
+def add_signal_receiver(bus, handler, dbus_interface, signal_name, **keywords):
+  """bus.add_signal_receiver() with an instrumented handler"""
+  return bus.add_signal_receiver(
+    instrumented_handler(handler, dbus_interface, signal_name),
+    dbus_interface = dbus_interface,
+    signal_name = signal_name,
+    **keywords
+  )
+
+class Subscriptions(object):
+  """
+  The signal receivers of one object, so they can be removed with it
+  (i.e. in dispose() or stop()) instead of piling up on the connection.
+
+  dbus-python match rules take exact paths only; pass `path_namespace`
+  to add() to also drop signals from outside a subtree (i.e. another
+  adapter's devices) before they reach the handler.
+
+  subscription_counts() reports the live receivers of every owner.
+  """
+
+  _owner = None
+  _matches = None
+
+  def __init__(self, owner):
+    self._owner = owner
+    self._matches = []
+    _subscriptions.add(self)
+
+  def owner(self):
+    return self._owner
+
+  def add(self, bus, handler, dbus_interface, signal_name, path_namespace = None, **keywords):
+    """add_signal_receiver(), removed by remove_all()"""
+    if path_namespace is not None:
+      handler = in_path_namespace(handler, path_namespace, keywords.get('path_keyword'))
+      keywords['path_keyword'] = keywords.get('path_keyword') or 'path'
+
+    return self._added(add_signal_receiver(bus, handler, dbus_interface, signal_name, **keywords))
 
-  def __enter__(self):
-    return self
+  def connect(self, interface, signal_name, handler, **keywords):
+    """interface.connect_to_signal(), removed by remove_all()"""
+    return self._added(interface.connect_to_signal(signal_name, handler, **keywords))
+
+  def remove(self, match):
+    if match in self._matches:
+      self._matches.remove(match)
+      match.remove()
+
+  def remove_all(self):
+    matches, self._matches = self._matches, []
+    for match in matches:
+      match.remove()
+
+  def __len__(self):
+    return len(self._matches)
+
+  def _added(self, match):
+    self._matches.append(match)
+    return match
+
+_subscriptions = weakref.WeakSet()
+
+def subscription_counts():
+  """Live signal receivers by Subscriptions owner"""
+  counts = {}
+
+  for subscriptions in list(_subscriptions):
+    if len(subscriptions):
+      owner = subscriptions.owner()
+      counts[owner] = counts.get(owner, 0) + len(subscriptions)
+
+  return counts
+
+def in_path_namespace(handler, namespace, path_keyword = None):
+  """
+  Wraps a signal handler registered with a path keyword, to only pass
+  on signals from `namespace` or below it.  The path is only passed to
+  `handler` when it asked for it with `path_keyword`.
+  """
+  prefix = namespace.rstrip('/') + '/'
+
+  def handle(*args, **kwargs):
+    path = kwargs[path_keyword or 'path']
+
+    if path != namespace and not path.startswith(prefix):
+      return
+
+    if not path_keyword:
+      del kwargs['path']
+
+    return handler(*args, **kwargs)
+
+  return handle
+
+class ProxyCache:
+  """
+  Interfaces on remote objects, created once without introspection and
+  keyed by (bus, service, path, interface).  Entries of an object are
+  dropped when its service announces that it is gone (see
+  REMOVAL_SIGNALS), or when the service's owner changes.
+
+  Objects announced as gone (or of a service that left the bus) are
+  remembered until they are added again, so that calls to them can be
+  skipped instead of waiting for an error, see gone().
+  """
+
+  _interfaces = None
+  # bus -> Subscriptions of its removal and addition signals, shared by
+  # the services watched on it
+  _shared = None
+  # bus -> services watched on it
+  _services = None
+  # (bus, service) -> Subscriptions of its owner changes
+  _watched = None
+  _gone = None
+
+  def __init__(self):
+    self._interfaces = {}
+    self._shared = {}
+    self._services = {}
+    self._watched = {}
+    self._gone = set()
+
+  def interface(self, bus, service, path, interface):
+    key = (bus, service, path, interface)
+
+    cached = self._interfaces.get(key)
+    if cached is None:
+      self._watch(bus, service)
+
+      cached = SignedInterface(
+        bus.get_object(service, path, introspect = False),
+        interface,
+        SIGNATURES.get(interface, {})
+      )
+
+      self._interfaces[key] = cached
+
+    return cached
+
+  def evict(self, bus, service, path = None):
+    """Drops the service's interfaces at and below `path`, or all of them"""
+    for key in self._interfaces.keys():
+      key_bus, key_service, key_path, _ = key
+
+      if key_bus is not bus or key_service != service:
+        continue
+
+      if path is None or key_path == path or key_path.startswith(path + '/'):
+        del self._interfaces[key]
+
+  def gone(self, bus, service, path):
+    """True when the object at `path`, or one of its parents, was removed"""
+    if not self._gone:
+      return False
+
+    while True:
+      if (bus, service, path) in self._gone:
+        return True
+
+      if path == '/' or not path:
+        return False
+
+      path = path[:path.rfind('/')] or '/'
+
+  def removed(self, bus, service, path, interfaces = None):
+    """
+    The object at `path` is gone when `interfaces` (all of them when
+    None) include one of KEY_INTERFACES, otherwise only the removed
+    interfaces are dropped.
+    """
+    if interfaces is None or KEY_INTERFACES.intersection(interfaces):
+      self.evict(bus, service, path)
+      self._gone.add((bus, service, path))
+      return
+
+    for interface in interfaces:
+      self._interfaces.pop((bus, service, path, str(interface)), None)
+
+  def added(self, bus, service, path):
+    self._gone.discard((bus, service, path))
+
+  def forget(self, bus):
+    for key in self._interfaces.keys():
+      if key[0] is bus:
+        del self._interfaces[key]
+
+    for watched in self._watched.keys():
+      if watched[0] is bus:
+        self._watched.pop(watched).remove_all()
+
+    if bus in self._shared:
+      self._shared.pop(bus).remove_all()
+      del self._services[bus]
+
+    self._gone = set([gone for gone in self._gone if gone[0] is not bus])
+
+  def __len__(self):
+    return len(self._interfaces)
+
+  def _watch(self, bus, service):
+    if (bus, service) in self._watched:
+      return
+
+    if bus not in self._shared:
+      self._watch_bus(bus)
+
+    self._services[bus].add(service)
+
+    subscriptions = self._watched[(bus, service)] = Subscriptions('ProxyCache')
+
+    if service and isinstance(bus, dbus.bus.BusConnection):
+      def owner_changed(name, old_owner, new_owner):
+        self.evict(bus, service)
+
+        self._gone = set([gone for gone in self._gone if gone[:2] != (bus, service)])
+        if not new_owner:
+          self._gone.add((bus, service, '/'))
+
+      subscriptions.add(
+        bus,
+        owner_changed,
+        dbus_interface = 'org.freedesktop.DBus',
+        signal_name = 'NameOwnerChanged',
+        arg0 = service
+      )
+
+  def _watch_bus(self, bus):
+    """
+    One receiver per signal for all of the bus' services.  Filtering by
+    bus_name would cost a match per service, and dbus-python adds a
+    NameOwnerChanged match for each receiver with a well-known name.
+    Paths of the services phony uses don't overlap, so a removal is
+    applied to all of them.
+    """
+    subscriptions = self._shared[bus] = Subscriptions('ProxyCache')
+    self._services[bus] = set()
+
+    # InterfacesRemoved lists the interfaces, ModemRemoved and
+    # CallRemoved remove the whole object
+    def removed(path, interfaces = None):
+      for service in list(self._services.get(bus, ())):
+        self.removed(bus, service, path, interfaces)
+
+    def added(path, *args):
+      for service in list(self._services.get(bus, ())):
+        self.added(bus, service, path)
+
+    for signals, handler in [(REMOVAL_SIGNALS, removed), (ADDITION_SIGNALS, added)]:
+      for interface, signal in signals:
+        subscriptions.add(
+          bus,
+          handler,
+          dbus_interface = interface,
+          signal_name = signal
+        )
+
+proxies = ProxyCache()
+
+# Seconds to wait for a reply, libdbus' default
+DEFAULT_CALL_TIMEOUT = 25.0
+
+# Calls made past their deadline still get this long
+MINIMUM_CALL_TIMEOUT = 0.001
+
+def timeout_until(deadline, timeout = DEFAULT_CALL_TIMEOUT):
+  """
+  `timeout`, shortened so that a call made now ends by `deadline` (in
+  phony.base.clock.monotonic() seconds), when there is one
+  """
+  if deadline is None:
+    return timeout
+
+  return max(MINIMUM_CALL_TIMEOUT, min(timeout, deadline - monotonic()))
+
+def call_async(method, *args, **kwargs):
+  """
+  Calls a remote method without blocking the main loop, returning a
+  Future of its reply (None, the value, or a tuple of values).  Pass
+  `timeout` (seconds) to bound the wait, the future then fails with
+  org.freedesktop.DBus.Error.NoReply.
+  """
+  future = Future()
+
+  def reply(*values):
+    if not values:
+      future.set_result(None)
+    elif len(values) == 1:
+      future.set_result(values[0])
+    else:
+      future.set_result(values)
 
-  def __exit__(self, exc_type, exc_value, traceback):
-    self.remove_socket_file()
+  kwargs.setdefault('timeout', DEFAULT_CALL_TIMEOUT)
 
+  try:
+    method(*args, reply_handler = reply, error_handler = future.set_exception, **kwargs)
+  except Exception, ex:
+    future.set_exception(ex)
 
+  return future
@@ -1,26 +1,256 @@
+import os
+import sys
 import string
 import logging
-import inspect
+import threading
+import collections
 
 from functools import wraps
+from phony.base.clock import monotonic
 
 MAXIMUM_TRACE_WIDTH = 40
 
-def send_to_stdout(level = logging.DEBUG):
-  logging.basicConfig(
-    level = level,
-    format = '%(asctime)s.%(msecs)03d %(name)-60s %(levelname)-8s %(message)s',
-    datefmt = '%Y-%m-%d %H:%M:%S'
-  )
+#
+# Set PHONY_TRACE=0 in the environment (or call disable_tracing()) before
+# any phony module is imported, and the TraceAs decorators will return
+# the undecorated methods.
+#
+_tracing = os.environ.get('PHONY_TRACE', '1') != '0'
+
+def disable_tracing():
+  global _tracing
+  _tracing = False
+
+def enable_tracing():
+  global _tracing
+  _tracing = True
+
+def tracing_enabled():
+  return _tracing
+
+#
+# When set, every TraceAs call and event is recorded (and every
+# TraceAs call timed), regardless of log level.
+#
+_recorder = None
+_method_stats = None
+_observed = False
+
+def record_to(flight_recorder):
+  global _recorder, _observed
+  _recorder = flight_recorder
+  _observed = _recorder is not None or _method_stats is not None
+
+def flight_recorder():
+  return _recorder
+
+def collect_method_stats(method_stats):
+  global _method_stats, _observed
+  _method_stats = method_stats
+  _observed = _recorder is not None or _method_stats is not None
+
+def method_stats():
+  return _method_stats
+
+LOG_FORMAT = '%(asctime)s.%(msecs)03d %(name)-60s %(levelname)-8s %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+MAXIMUM_QUEUED_RECORDS = 4096
+
+def send_to_stdout(level = logging.DEBUG, queued = True, capacity = MAXIMUM_QUEUED_RECORDS):
+  if not queued:
+    logging.basicConfig(level = level, format = LOG_FORMAT, datefmt = LOG_DATE_FORMAT)
+    return
+
+  root = logging.getLogger()
+
+  # Same as basicConfig, do nothing if logging is already configured
+  if root.handlers:
+    return
+
+  handler = QueuedStreamHandler(capacity = capacity)
+  handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+
+  root.addHandler(handler)
+  root.setLevel(level)
+
+class QueuedStreamHandler(logging.Handler):
+  """
+  Records are queued in O(1) by whichever thread logs them (the main
+  loop, GPIO callbacks, ...) and are formatted and written in batches
+  by a background thread, so that logging never blocks on the stream
+  (e.g. the journal's pipe when running under systemd).
+
+  At most `capacity` records are held; beyond that records are dropped
+  and counted, and the count is reported in the stream once there is
+  room again.  Queued records are flushed when logging shuts down.
+  """
+
+  BATCH_SIZE = 256
+
+  _stream = None
+  _capacity = 0
+  _queue = None
+  _ready = None
+  _stopped = False
+  _writer = None
+  _write_lock = None
+
+  _drop_lock = None
+  _dropped = 0
+  _dropped_reported = 0
+
+  def __init__(self, stream = None, capacity = MAXIMUM_QUEUED_RECORDS):
+    logging.Handler.__init__(self)
+
+    self._stream = stream or sys.stderr
+    self._capacity = capacity
+    self._queue = collections.deque()
+    self._ready = threading.Event()
+    self._write_lock = threading.Lock()
+    self._drop_lock = threading.Lock()
+
+    try:
+      import gobject
+      # The writer thread has to be able to run while the gobject
+      # main loop is idle.
+      gobject.threads_init()
+    except ImportError:
+      pass
+
+    self._writer = threading.Thread(target = self._write_batches, name = 'phony-log-writer')
+    self._writer.daemon = True
+    self._writer.start()
+
+  def handle(self, record):
+    # Unlike logging.Handler.handle(), no lock is taken: deque.append
+    # is atomic, and formatting happens on the writer thread.
+    rv = self.filter(record)
+    if rv:
+      self.emit(record)
+    return rv
+
+  def emit(self, record):
+    if len(self._queue) >= self._capacity:
+      with self._drop_lock:
+        self._dropped += 1
+      return
+
+    self._queue.append(record)
+    self._ready.set()
+
+  def dropped(self):
+    return self._dropped
+
+  def queued(self):
+    return len(self._queue)
+
+  def flush(self):
+    with self._write_lock:
+      while self._queue:
+        self._write_batch()
+
+  def close(self):
+    self._stopped = True
+    self._ready.set()
+
+    if self._writer.is_alive() and self._writer is not threading.current_thread():
+      self._writer.join(1.0)
+
+    self.flush()
+    logging.Handler.close(self)
+
+  def _write_batches(self):
+    while not self._stopped:
+      self._ready.wait()
+      self._ready.clear()
+
+      with self._write_lock:
+        while self._queue:
+          self._write_batch()
+
+  def _write_batch(self):
+    lines = []
+
+    try:
+      while len(lines) < self.BATCH_SIZE:
+        record = self._queue.popleft()
+        try:
+          lines.append(self.format(record))
+        except Exception:
+          self.handleError(record)
+    except IndexError:
+      pass
+
+    dropped = self._dropped
+    if dropped != self._dropped_reported:
+      lines.append('%d log record(s) dropped, queue is full' % (dropped - self._dropped_reported))
+      self._dropped_reported = dropped
+
+    if lines:
+      try:
+        self._stream.write('\n'.join(lines) + '\n')
+        self._stream.flush()
+      except Exception:
+        pass
 
 def static(name):
   return logging.getLogger(name)
 
-class TypeLabel:
+def set_level(prefix, level):
+  """
+  Changes the level of the `prefix` logger (a dotted logger name, i.e.
+  'phony.bluetooth.profiles.handsfree', or '' for the root), and so of
+  all loggers under it that don't have a level of their own.  Takes
+  effect immediately, TraceAs decorated methods of other loggers stay
+  on their fast path.
+  """
+  if isinstance(level, basestring):
+    level = Levels.parse(level)
+
+  logging.getLogger(prefix or None).setLevel(level)
+
+def set_levels(spec):
+  """
+  Applies a comma separated list of prefix=LEVEL pairs, for example:
+  'phony.bluetooth.profiles.handsfree=DEBUG,phony.audio=NOTSET'.  A
+  bare LEVEL applies to the root logger.
+  """
+  for pair in filter(None, [p.strip() for p in spec.split(',')]):
+    if '=' in pair:
+      prefix, level = pair.split('=', 1)
+    else:
+      prefix, level = '', pair
+
+    set_level(prefix.strip(), level.strip())
+
+def levels():
+  """
+  Returns {logger name: level name} for the loggers that have a level
+  of their own, the root logger is ''.
+  """
+  root = logging.getLogger()
+  explicit = {'': logging.getLevelName(root.level)}
+
+  for name, logger in logging.Logger.manager.loggerDict.items():
+    if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET:
+      explicit[name] = logging.getLevelName(logger.level)
+
+  return explicit
+
+class TypeLabel(object):
+  __slots__ = ()
+
   def source(self, instance):
     return instance.__module__ + '.' + type(instance).__name__
 
+  def name(self, instance):
+    return type(instance).__name__
+
   def call(self, instance, method, args, limit):
+    return self.label(self.name(instance), method, args, limit)
+
+  def label(self, name, method, args, limit):
     if args and len(args) > 0:
       args = pretty_args(args[1:], limit)
     else:
@@ -29,23 +259,16 @@ class TypeLabel:
     if not isinstance(method, basestring):
       method = method.__name__
 
-    return type(instance).__name__ + '.' + method + '(' + args + ')'
+    return name + '.' + method + '(' + args + ')'
+
+class InstanceLabel(TypeLabel):
+  __slots__ = ()
 
-class InstanceLabel:
   def source(self, instance):
     return instance.__module__ + '.' + type(instance).__name__ + '.' + str(id(instance))
 
-  def call(self, instance, method, args, limit):
-    if args and len(args) > 0:
-      args = pretty_args(args[1:], limit)
-    else:
-      args = ''
-
-    if not isinstance(method, basestring):
-      method = method.__name__
-
-    type_and_instance = type(instance).__name__ + '.' + str(id(instance))
-    return type_and_instance + '.' + method + '(' + args + ')'
+  def name(self, instance):
+    return type(instance).__name__ + '.' + str(id(instance))
 
 class Levels:
   CRITICAL = logging.CRITICAL
@@ -53,6 +276,7 @@ class Levels:
   WARNING = logging.WARNING
   INFO = logging.INFO
   DEBUG = logging.DEBUG
+  NOTSET = logging.NOTSET
   DEFAULT = logging.DEBUG
 
   @classmethod
@@ -68,21 +292,23 @@ class Levels:
       return cls.INFO
     elif level == 'DEBUG':
       return cls.DEBUG
+    elif level == 'NOTSET':
+      return cls.NOTSET
     elif level == 'DEFAULT':
       return cls.DEFAULT
     else:
       raise Exception('Unrecognized logging level: "' + str + '"')
 
 class ScopedLogger(object):
-  _label = ""
-  _level = None
-  _instance = None
+  __slots__ = ('_log', '_label', '_level')
 
   def __init__(self, name_or_instance, scope_label, log_level = Levels.DEBUG):
     if isinstance(name_or_instance, basestring):
-      self._instance = NamedLogger(name_or_instance)
+      self._log = NamedLogger(name_or_instance).log()
+    elif isinstance(name_or_instance, TraceLogger):
+      self._log = name_or_instance
     elif name_or_instance:
-      self._instance = name_or_instance
+      self._log = name_or_instance.log()
     else:
       raise Exception('Must provide a name or logger class instance')
 
@@ -90,57 +316,298 @@ class ScopedLogger(object):
     self._level = log_level
 
   def __enter__(self):
-    self._instance.log().log(self._level, "-> " + self._label)
+    self._log.log(self._level, "-> " + self._label)
 
   def __exit__(self, exc_type, exc_value, traceback):
-    self._instance.log().log(self._level, "<- " + self._label)
+    self._log.log(self._level, "<- " + self._label)
+
+class Limiter(object):
+  """
+  Decides which of a stream of similar records (i.e. from one call site)
+  get logged.  The number of records suppressed in between is reported
+  along with the next record that is let through.  This one lets every
+  record through, RateLimit and Sampler override allow().
+  """
+
+  __slots__ = ('_suppressed',)
+
+  def __init__(self):
+    self._suppressed = 0
+
+  def allow(self):
+    return True
+
+  def suppressed(self):
+    return self._suppressed
+
+  def admit(self, log, level, label):
+    """
+    Returns True if a record should be logged.  If records were suppressed
+    since the last one admitted, a summary is logged first.
+    """
+    if not self.allow():
+      self._suppressed += 1
+      return False
+
+    suppressed = self._suppressed
+    if suppressed:
+      self._suppressed = 0
+
+      if isinstance(log, TraceLogger) and not isinstance(label, basestring):
+        label = log.label_name() + '.' + label.__name__
+
+      log.log(level, '** %s: suppressed %d similar message(s)' % (label, suppressed))
+
+    return True
+
+  def log(self, log, level, message):
+    if self.admit(log, level, message):
+      log.log(level, message)
+
+class RateLimit(Limiter):
+  """
+  Token bucket: up to `burst` records at once, and `per_second` on average.
+  """
+
+  __slots__ = ('_rate', '_burst', '_tokens', '_updated')
+
+  def __init__(self, per_second, burst = None):
+    Limiter.__init__(self)
+
+    self._rate = float(per_second)
+    self._burst = float(burst if burst else max(1, per_second))
+    self._tokens = self._burst
+    self._updated = monotonic()
+
+  def allow(self):
+    now = monotonic()
+
+    tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+    self._updated = now
+
+    if tokens >= 1:
+      self._tokens = tokens - 1
+      return True
+    else:
+      self._tokens = tokens
+      return False
+
+class Sampler(Limiter):
+  """
+  Lets the first, and then every `every`th record through.
+  """
+
+  __slots__ = ('_every', '_count')
+
+  def __init__(self, every):
+    Limiter.__init__(self)
+
+    if every < 1:
+      raise Exception('Sampling rate must be at least 1')
+
+    self._every = every
+    self._count = 0
+
+  def allow(self):
+    count = self._count
+    self._count = count + 1
+    return count % self._every == 0
+
+class TraceLogger(object):
+  """
+  What NamedLogger.log() returns: the logging.Logger's methods, plus
+  variable(), event() and call() which label records with the calling
+  method (i.e. 'Class.method(args)').  ClassLoggers share one per class,
+  and it holds no reference to any instance.
+  """
+
+  __slots__ = (
+    'name', '_logger', '_label_maker', '_label_name',
+    'debug', 'info', 'warning', 'warn', 'error', 'critical', 'exception',
+    'log', 'isEnabledFor'
+  )
+
+  def __init__(self, name, label_maker, label_name):
+    self.name = name
+    self._label_maker = label_maker
+    self._label_name = label_name
+
+    logger = logging.getLogger(name)
+    self._logger = logger
+
+    # Bound directly, so there's no extra call through the adapter
+    self.debug = logger.debug
+    self.info = logger.info
+    self.warning = logger.warning
+    self.warn = logger.warn
+    self.error = logger.error
+    self.critical = logger.critical
+    self.exception = logger.exception
+    self.log = logger.log
+    self.isEnabledFor = logger.isEnabledFor
+
+  def logger(self):
+    return self._logger
+
+  def label_name(self):
+    return self._label_name
+
+  def __getattr__(self, name):
+    return getattr(self._logger, name)
+
+  def variable(self, variable, value, label = '', with_arguments = True, width = MAXIMUM_TRACE_WIDTH, level = Levels.DEFAULT):
+    if not self.isEnabledFor(level):
+      return
+
+    if label == '':
+      (instance, method_name, args) = NamedLogger._calling_instance_method_name_and_args(1)
+      label = self._label_maker.call(instance, method_name, args if with_arguments else None, width)
+
+    if label:
+      self.log(level, '%s => %s = %s' % (label, variable, value))
+    else:
+      self.log(level, '%s = %s' % (variable, value))
+
+  def event(self, method = None, args = None, width = MAXIMUM_TRACE_WIDTH, level = Levels.DEFAULT):
+    if not self.isEnabledFor(level):
+      return
+
+    if not method:
+      (instance, method_name, args) = NamedLogger._calling_instance_method_name_and_args(1)
+      label = self._label_maker.call(instance, method_name, args, width)
+    else:
+      label = self._label_maker.label(self._label_name, method, args, width)
+
+    self.log(level, '** %s' % label)
+
+  def call(self, method = None, args = None, width = MAXIMUM_TRACE_WIDTH, level = Levels.DEFAULT):
+    if not self.isEnabledFor(level):
+      return ScopedLogger(self, '', level)
+
+    if not method:
+      (instance, method_name, args) = NamedLogger._calling_instance_method_name_and_args(1)
+      label = self._label_maker.call(instance, method_name, args, width)
+    else:
+      label = self._label_maker.label(self._label_name, method, args, width)
+
+    return ScopedLogger(self, label, level)
 
 class NamedLogger(object):
-  _log_name = ""
   _log = None
-  _label_maker = None
   _level = Levels.DEFAULT
 
   class TraceAs:
+    #
+    # rate_limit: a RateLimit (or any Limiter) shared by every call to the
+    #             decorated method, records beyond it are suppressed
+    # sample:     only log 1 in every `sample` calls
+    #
+    # Either only affects logging, the flight recorder and method stats
+    # still see every call.
+    #
+
     @staticmethod
-    def call(with_arguments = True, width = MAXIMUM_TRACE_WIDTH, log_level = Levels.DEFAULT):
+    def call(with_arguments = True, width = MAXIMUM_TRACE_WIDTH, log_level = Levels.DEFAULT, rate_limit = None, sample = None):
+      limiter = NamedLogger.TraceAs._limiter(rate_limit, sample)
+
       def decorator(method):
+        if not _tracing:
+          return method
+
+        @wraps(method)
         def call_wrapper(*args, **kwargs):
           instance = args[0]
 
-          with instance.log().call(method, args if with_arguments else None, width, log_level):
-           return method(*args, **kwargs)
+          level = log_level
+          if level == Levels.DEFAULT:
+            level = instance.log_level()
+
+          # Fast path, don't bother building a label that will be dropped
+          if not _observed and not instance.log().isEnabledFor(level):
+            return method(*args, **kwargs)
+
+          return NamedLogger._traced_call(method, args, kwargs, with_arguments, width, level, limiter)
 
         return call_wrapper
       return decorator
 
     @staticmethod
-    def event(with_arguments = True, width = MAXIMUM_TRACE_WIDTH, log_level = Levels.DEFAULT):
+    def event(with_arguments = True, width = MAXIMUM_TRACE_WIDTH, log_level = Levels.DEFAULT, rate_limit = None, sample = None):
+      limiter = NamedLogger.TraceAs._limiter(rate_limit, sample)
+
       def decorator(method):
+        if not _tracing:
+          return method
+
+        @wraps(method)
         def call_wrapper(*args, **kwargs):
           instance = args[0]
 
-          instance.log().event(method, args if with_arguments else None, width, log_level)
+          level = log_level
+          if level == Levels.DEFAULT:
+            level = instance.log_level()
+
+          recorder = _recorder
+          if recorder:
+            recorder.record(recorder.EVENT, instance, method)
+
+          if instance.log().isEnabledFor(level) \
+            and (limiter is None or limiter.admit(instance.log(), level, method)):
+            instance.log().event(method, args if with_arguments else None, width, level)
 
           return method(*args, **kwargs)
 
         return call_wrapper
       return decorator
 
+    @staticmethod
+    def _limiter(rate_limit, sample):
+      if rate_limit and sample:
+        raise Exception('Use either rate_limit or sample, not both')
+      elif sample:
+        return Sampler(sample)
+      else:
+        return rate_limit
+
+  @staticmethod
+  def _traced_call(method, args, kwargs, with_arguments, width, level, limiter = None):
+    instance = args[0]
+
+    scope = None
+    if instance.log().isEnabledFor(level) \
+      and (limiter is None or limiter.admit(instance.log(), level, method)):
+      scope = instance.log().call(method, args if with_arguments else None, width, level)
+      scope.__enter__()
+
+    recorder = _recorder
+    if recorder:
+      recorder.record(recorder.CALL, instance, method)
+
+    stats = _method_stats
+    if stats:
+      started = monotonic()
+
+    try:
+      return method(*args, **kwargs)
+    finally:
+      if stats:
+        stats.record(instance, method, monotonic() - started)
+
+      if recorder:
+        recorder.record(recorder.RETURN, instance, method)
+
+      if scope:
+        scope.__exit__(None, None, None)
+
   def __init__(self, name_or_label_maker):
     if isinstance(name_or_label_maker, basestring):
-      self._log_name = str(name_or_label_maker)
-      self._label_maker = TypeLabel()
+      label_maker = TypeLabel()
+      name = str(name_or_label_maker)
     else:
-      self._log_name = name_or_label_maker.source(self)
-      self._label_maker = name_or_label_maker
-
-    self._log = logging.getLogger(self._log_name)
+      label_maker = name_or_label_maker
+      name = label_maker.source(self)
 
-    # Add mixin methods to logger instance:
-    self._log.variable = self._variable
-    self._log.event = self._log_event_with_method_label
-    self._log.call = self._log_method_call
+    self._log = TraceLogger(name, label_maker, label_maker.name(self))
 
   def log(self):
     return self._log
@@ -152,84 +619,117 @@ class NamedLogger(object):
     return self._level
 
   def log_name(self):
-    return self._log_name
+    return self._log.name
 
-  def _variable(self, variable, value, label = '', with_arguments = True, width = MAXIMUM_TRACE_WIDTH, level = Levels.DEFAULT):
-    if level == Levels.DEFAULT:
-      level = self.log_level()
-
-    if label == '':
-      (instance, method_name, args) = NamedLogger._calling_instance_method_name_and_args(1)
-      label = self._label_maker.call(instance, method_name, args if with_arguments else None, width)
-
-    if label:
-      self._log.log(level, '%s => %s = %s' % (label, variable, value))
-    else:
-      self._log.log(level, '%s = %s' % (variable, value))
-
-  def _log_event_with_method_label(self, method = None, args = None, width = MAXIMUM_TRACE_WIDTH, level = Levels.DEFAULT):
-    if level == Levels.DEFAULT:
-      level = self.log_level()
-
-    if not method:
-      (instance, method_name, args) = NamedLogger._calling_instance_method_name_and_args(1)
-      label = self._label_maker.call(instance, method_name, args if with_arguments else None, width)
-    else:
-      label = self._label_maker.call(self, method, args, width)
-
-    self._log.log(level, '** %s' % label)
-
-  def _log_method_call(self, method = None, args = None, width = MAXIMUM_TRACE_WIDTH, level = Levels.DEFAULT):
-    if level == Levels.DEFAULT:
-      level = self.log_level()
-
-    if not method:
-      (instance, method_name, args) = NamedLogger._calling_instance_method_name_and_args(1)
-      label = self._label_maker.call(instance, method_name, args if with_arguments else None, width)
-    else:
-      label = self._label_maker.call(self, method, args, width)
-
-    return ScopedLogger(self, label, level)
+  # Maps a code object to its (name, argument names)
+  _code_labels = {}
 
   @staticmethod
   def _calling_instance_method_name_and_args(frame_level = 0):
-    clazz = ''
-    caller_args = []
-    method_name = ''
+    # Only the one frame that's needed is touched, no stack walk,
+    # source lookup or argument introspection.
+    frame = sys._getframe(frame_level + 1)
+    code = frame.f_code
+
+    try:
+      method_name, arg_names = NamedLogger._code_labels[code]
+    except KeyError:
+      method_name, arg_names = NamedLogger._code_labels[code] = \
+        (code.co_name, code.co_varnames[:code.co_argcount])
 
-    frame = NamedLogger._calling_frame(frame_level + 1)
-    frame_info = inspect.getframeinfo(frame)
-    method_name = frame_info[2]
+    values = frame.f_locals
 
-    args, _, _, values = inspect.getargvalues(frame)
-    if len(args) and args[0] == 'self':
+    instance = None
+    if arg_names and arg_names[0] == 'self':
       instance = values.get('self', None)
 
-    caller_args = map(lambda arg: values[arg], args)
+    caller_args = [values.get(arg) for arg in arg_names]
 
     return (instance, method_name, caller_args)
 
-  @staticmethod
-  def _calling_frame(frame_level = 0):
-    cur_frame = inspect.currentframe()
-    calling_frame = inspect.getouterframes(cur_frame, frame_level + 2)
-
-    return calling_frame[1 + frame_level][0]
+_class_loggers = {}
 
 class ClassLogger(NamedLogger):
+  """
+  Shares one TraceLogger between the instances of a class that use the
+  same type of label maker, so its logger name and labels are the first
+  such instance's: label makers of one type must label alike.  Use
+  InstanceLogger for labels of each instance's own.
+  log_level() is still per instance, the TraceAs decorators log at it.
+  """
+
   def __init__(self, label_maker = TypeLabel()):
-    name = label_maker.source(self)
-    NamedLogger.__init__(self, name)
+    # Built once per class and type of label maker, a fresh label maker
+    # for each instance mustn't add an entry each
+    key = (type(self), type(label_maker))
+
+    log = _class_loggers.get(key)
+    if log is None:
+      log = _class_loggers.setdefault(key,
+        TraceLogger(label_maker.source(self), label_maker, label_maker.name(self)))
+
+    self._log = log
 
 class InstanceLogger(NamedLogger):
   def __init__(self, label_maker = InstanceLabel()):
-    name = label_maker.source(self)
-    NamedLogger.__init__(self, name)
+    NamedLogger.__init__(self, label_maker)
+
+#
+# Types that render cheaply and without side effects.  dbus.String,
+# dbus.ObjectPath, dbus.Boolean, dbus.UInt32, etc. are subclasses of these.
+#
+PLAIN_TYPES = (basestring, int, long, float, type(None))
+
+_render_state = threading.local()
+_traces_with_io = 0
+_types_with_io = set()
+
+def note_io():
+  """
+  Called by code that performs a blocking round trip (e.g. a D-Bus method
+  call), so that trace labels whose rendering caused I/O can be flagged.
+  """
+  if getattr(_render_state, 'rendering', False):
+    _render_state.io = True
+
+def traces_with_io():
+  return _traces_with_io
+
+def types_with_io():
+  return sorted(_types_with_io)
+
+def trace_label(value):
+  """
+  Renders a traced argument without calling into the object, unless it
+  provides a trace_label() method that promises to be cheap (i.e. returns
+  something cached, and never goes out on the bus).  Unknown objects are
+  rendered by type and id.
+  """
+  if isinstance(value, PLAIN_TYPES):
+    return str(value)
+
+  # Look the method up on the type, dbus proxies answer to any attribute
+  label = getattr(type(value), 'trace_label', None)
+  if label:
+    return str(label(value))
+
+  if isinstance(value, dict):
+    return '{' + ', '.join(
+      '%s: %s' % (trace_label(k), trace_label(v)) for k, v in value.iteritems()
+    ) + '}'
+  elif isinstance(value, list):
+    return '[' + ', '.join(map(trace_label, value)) + ']'
+  elif isinstance(value, tuple):
+    return '(' + ', '.join(map(trace_label, value)) + ')'
+
+  return '<%s@0x%x>' % (type(value).__name__, id(value))
 
 def pretty_args(args, limit):
+  global _traces_with_io
+
   def stringify(s):
     try:
-      s = str(s)
+      s = trace_label(s)
     except:
       s = '???'
 
@@ -239,8 +739,29 @@ def pretty_args(args, limit):
     else:
       return s
 
-  val = ', '.join(filter(None, map(stringify, args)))
+  rendered = []
+  io = False
+
+  _render_state.rendering = True
+  try:
+    for arg in args:
+      _render_state.io = False
+
+      rendered.append(stringify(arg))
+
+      if _render_state.io:
+        io = True
+        if type(arg).__name__ not in _types_with_io:
+          _types_with_io.add(type(arg).__name__)
+          static(__name__).warning('Rendering trace label for %s caused I/O' % type(arg).__name__)
+  finally:
+    _render_state.rendering = False
+
+  if io:
+    _traces_with_io += 1
+
+  val = ', '.join(filter(None, rendered))
   if len(val) > limit:
     return val[:limit] + '...'
   else:
-    return val
\ No newline at end of file
+    return val
@@ -0,0 +1,78 @@
+"""
+The privileged side of phony.base.execute.PrivilegedHelper: a long lived
+process started once with sudo, that runs allow-listed commands sent as
+newline delimited JSON on stdin, answering on stdout:
+
+  {"id": 1, "argv": ["rfkill", "unblock", "bluetooth"]}
+  {"id": 1, "status": 0, "output": ""}
+
+It is run by path (sudo resets PYTHONPATH), so it only uses the
+standard library.
+"""
+
+import re
+import sys
+import json
+import subprocess
+
+# Each command's accepted argument lists, every argument matching the
+# regular expression at its position, whole (\Z, unlike $, doesn't
+# match before a trailing newline).
+ALLOWED_COMMANDS = {
+  'rfkill': [
+    ('block|unblock', 'bluetooth|all|[0-9]+'),
+    ('list', 'bluetooth')
+  ],
+  'hciconfig': [
+    ('hci[0-9]+', 'sspmode', '0|1'),
+    ('hci[0-9]+', 'up|down|reset')
+  ]
+}
+
+def check(argv):
+  """Raises ValueError unless `argv` is in the allowed vocabulary"""
+  if not argv or argv[0] not in ALLOWED_COMMANDS:
+    raise ValueError('Command not allowed: %s' % ' '.join(argv or []))
+
+  arguments = argv[1:]
+
+  for accepted in ALLOWED_COMMANDS[argv[0]]:
+    if len(accepted) == len(arguments) and \
+       all(re.match(r'(?:%s)\Z' % pattern, argument) for pattern, argument in zip(accepted, arguments)):
+      return
+
+  raise ValueError('Arguments not allowed: %s' % ' '.join(argv))
+
+def run(argv):
+  process = subprocess.Popen(argv, stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+  output, _ = process.communicate()
+  return process.returncode, output
+
+def handle(line, runner = run):
+  request_id = None
+
+  try:
+    request = json.loads(line)
+    request_id = request.get('id')
+    argv = [str(argument) for argument in request.get('argv') or []]
+
+    check(argv)
+    status, output = runner(argv)
+
+    return {'id': request_id, 'status': status, 'output': output}
+  except Exception, ex:
+    return {'id': request_id, 'error': str(ex)}
+
+def serve(incoming, outgoing, runner = run):
+  """Answers requests until `incoming` is closed"""
+  while True:
+    line = incoming.readline()
+    if not line:
+      return
+
+    if line.strip():
+      outgoing.write(json.dumps(handle(line, runner)) + '\n')
+      outgoing.flush()
+
+if __name__ == '__main__':
+  serve(sys.stdin, sys.stdout)
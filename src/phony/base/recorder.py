@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+import thread
+import itertools
+
+from phony.base.clock import monotonic
+
+class FlightRecorder(object):
+  """
+  Fixed size, preallocated ring buffer of the most recent TraceAs
+  call entries, exits and events.  Recording is a handful of list
+  stores, no formatting or I/O happens until the buffer is exported,
+  so it can be left running at any log level.
+  """
+
+  DEFAULT_CAPACITY = 4096
+
+  # Chrome trace-event phases
+  CALL = 'B'
+  RETURN = 'E'
+  EVENT = 'i'
+
+  _capacity = 0
+  _counter = None
+
+  _sequences = None
+  _times = None
+  _threads = None
+  _phases = None
+  _types = None
+  _methods = None
+
+  def __init__(self, capacity = DEFAULT_CAPACITY):
+    if capacity < 1:
+      raise Exception('Flight recorder capacity must be at least 1')
+
+    self._capacity = capacity
+    self.clear()
+
+  def clear(self):
+    # itertools.count() is advanced atomically, so concurrent
+    # recorders (e.g. GPIO threads) never claim the same slot.
+    self._counter = itertools.count()
+
+    self._sequences = [-1] * self._capacity
+    self._times = [0.0] * self._capacity
+    self._threads = [0] * self._capacity
+    self._phases = [None] * self._capacity
+    self._types = [None] * self._capacity
+    self._methods = [None] * self._capacity
+
+  def capacity(self):
+    return self._capacity
+
+  def record(self, phase, instance, method):
+    sequence = next(self._counter)
+    slot = sequence % self._capacity
+
+    self._times[slot] = monotonic()
+    self._threads[slot] = thread.get_ident()
+    self._phases[slot] = phase
+    self._types[slot] = type(instance)
+    self._methods[slot] = method
+    self._sequences[slot] = sequence
+
+  def events(self):
+    """
+    Returns the recorded (sequence, seconds, thread id, phase, type, method
+    name) tuples, oldest first.
+    """
+    events = []
+
+    for slot in xrange(0, self._capacity):
+      sequence = self._sequences[slot]
+      if sequence < 0:
+        continue
+
+      method = self._methods[slot]
+      if not isinstance(method, basestring):
+        method = method.__name__
+
+      events.append((
+        sequence,
+        self._times[slot],
+        self._threads[slot],
+        self._phases[slot],
+        self._types[slot],
+        method
+      ))
+
+    events.sort()
+    return events
+
+  def chrome_trace(self):
+    """
+    Exports the recording in the Chrome trace-event format, load it in
+    chrome://tracing (or https://ui.perfetto.dev) to view it as a timeline.
+    """
+    pid = os.getpid()
+    trace_events = []
+
+    for sequence, seconds, thread_id, phase, clazz, method in self.events():
+      event = {
+        'name': '%s.%s' % (clazz.__name__, method),
+        'cat': clazz.__module__,
+        'ph': phase,
+        'ts': seconds * 1e6,
+        'pid': pid,
+        'tid': thread_id
+      }
+
+      if phase == self.EVENT:
+        event['s'] = 't'
+
+      trace_events.append(event)
+
+    return json.dumps({'traceEvents': trace_events, 'displayTimeUnit': 'ms'})
+
+  def dump(self, path):
+    with open(path, 'w') as trace_file:
+      trace_file.write(self.chrome_trace())
+
+    return path
+
+  def dump_on_unhandled_exception(self, path):
+    """
+    Writes the recording to `path` whenever an exception goes unhandled,
+    including those raised from gobject main loop callbacks.
+    """
+    previous_hook = sys.excepthook
+
+    def excepthook(exc_type, exc_value, traceback):
+      try:
+        self.dump(path)
+      except Exception:
+        pass
+
+      previous_hook(exc_type, exc_value, traceback)
+
+    sys.excepthook = excepthook
@@ -0,0 +1,272 @@
+import math
+import collections
+
+from phony.base.log import ClassLogger
+
+class LogLinearHistogram(object):
+  """
+  Fixed memory latency histogram.  Values (in microseconds) below
+  2 * SUB_BUCKETS are counted exactly, above that each power of two
+  range is split into SUB_BUCKETS linear buckets, so any reported
+  percentile is within 1/SUB_BUCKETS (~6%) of the recorded value.
+  Values beyond 2^MAXIMUM_BITS us (~71 minutes) land in the last bucket.
+  """
+
+  SUB_BUCKET_BITS = 4
+  SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+  MAXIMUM_BITS = 32
+
+  BUCKET_COUNT = SUB_BUCKETS * (MAXIMUM_BITS - SUB_BUCKET_BITS - 1) + 2 * SUB_BUCKETS
+
+  _counts = None
+  _count = 0
+  _total = 0
+  _maximum = 0
+
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self._counts = [0] * self.BUCKET_COUNT
+    self._count = 0
+    self._total = 0
+    self._maximum = 0
+
+  def record(self, seconds):
+    self.record_microseconds(int(seconds * 1e6))
+
+  def record_microseconds(self, value):
+    if value < 0:
+      value = 0
+
+    self._counts[self._index(value)] += 1
+    self._count += 1
+    self._total += value
+
+    if value > self._maximum:
+      self._maximum = value
+
+  def count(self):
+    return self._count
+
+  def maximum(self):
+    return self._maximum
+
+  def mean(self):
+    if not self._count:
+      return 0
+    return self._total / float(self._count)
+
+  def percentile(self, percent):
+    """
+    Returns the highest value (in microseconds) of the bucket that holds
+    the given percentile, never more than the maximum recorded value.
+    """
+    if not self._count:
+      return 0
+
+    target = max(1, int(math.ceil(self._count * percent / 100.0)))
+
+    seen = 0
+    for index, count in enumerate(self._counts):
+      seen += count
+      if seen >= target:
+        return min(self._highest_in_bucket(index), self._maximum)
+
+    return self._maximum
+
+  def summary(self):
+    """Count, and p50, p95, p99 and max in milliseconds"""
+    return {
+      'count': self._count,
+      'p50': self.percentile(50) / 1000.0,
+      'p95': self.percentile(95) / 1000.0,
+      'p99': self.percentile(99) / 1000.0,
+      'max': self._maximum / 1000.0
+    }
+
+  def _index(self, value):
+    shift = value.bit_length() - self.SUB_BUCKET_BITS - 1
+    if shift <= 0:
+      return value
+
+    if shift > self.MAXIMUM_BITS - self.SUB_BUCKET_BITS - 1:
+      return self.BUCKET_COUNT - 1
+
+    return (shift << self.SUB_BUCKET_BITS) + (value >> shift)
+
+  def _highest_in_bucket(self, index):
+    if index < 2 * self.SUB_BUCKETS:
+      return index
+
+    shift = (index >> self.SUB_BUCKET_BITS) - 1
+    top = index - (shift << self.SUB_BUCKET_BITS)
+    return ((top + 1) << shift) - 1
+
+class MethodStats(object):
+  """
+  Latency histograms of TraceAs.call decorated methods, keyed by
+  'Class.method'.  See phony.base.log.collect_method_stats()
+  """
+
+  _histograms = None
+
+  def __init__(self):
+    self._histograms = {}
+
+  def record(self, instance, method, seconds):
+    key = (type(instance), method)
+
+    histogram = self._histograms.get(key)
+    if histogram is None:
+      histogram = self._histograms.setdefault(key, LogLinearHistogram())
+
+    histogram.record(seconds)
+
+  def histogram(self, name):
+    for key, histogram in self._histograms.items():
+      if MethodStats._name(key) == name:
+        return histogram
+
+    return None
+
+  def summary(self, prefix = ''):
+    """
+    Returns {'Class.method': {'count', 'p50', 'p95', 'p99', 'max'}},
+    latencies in milliseconds, for the methods that start with `prefix`.
+    """
+    summary = {}
+
+    for key, histogram in self._histograms.items():
+      name = MethodStats._name(key)
+      if name.startswith(prefix):
+        summary[name] = histogram.summary()
+
+    return summary
+
+  def reset(self):
+    self._histograms = {}
+
+  @staticmethod
+  def _name(key):
+    clazz, method = key
+    return clazz.__name__ + '.' + method.__name__
+
+class CallStats(ClassLogger):
+  """
+  Latency histograms, error counts and reply sizes of remote D-Bus calls
+  keyed by 'interface.member', plus handler latencies of the signals
+  received.  Calls slower than `slow_call_threshold` seconds are logged
+  and the most recent SLOW_CALLS_KEPT of them kept.  See
+  phony.base.ipc.collect_call_stats()
+  """
+
+  DEFAULT_SLOW_CALL_THRESHOLD = 0.5
+  SLOW_CALLS_KEPT = 64
+
+  _calls = None
+  _signals = None
+  _slow_calls = None
+  _slow_call_threshold = None
+
+  def __init__(self, slow_call_threshold = DEFAULT_SLOW_CALL_THRESHOLD):
+    ClassLogger.__init__(self)
+    self._slow_call_threshold = slow_call_threshold
+    self.reset()
+
+  def record_call(self, destination, interface, member, seconds, error = None, reply = None):
+    entry = self._calls.get((interface, member))
+    if entry is None:
+      entry = self._calls.setdefault((interface, member), _CallEntry())
+
+    entry.histogram.record(seconds)
+
+    if error is not None:
+      entry.errors += 1
+    else:
+      entry.reply_size += CallStats.size(reply)
+
+    if seconds >= self._slow_call_threshold:
+      self._slow_calls.append({
+        'destination': str(destination),
+        'member': '%s.%s' % (interface, member),
+        'milliseconds': seconds * 1000.0,
+        'error': str(error) if error is not None else ''
+      })
+
+      self.log().warning('Slow D-Bus call %s %s.%s: %.1f ms%s' % (
+        destination, interface, member, seconds * 1000.0,
+        ', failed: %s' % error if error is not None else ''))
+
+  def record_signal(self, interface, member, seconds):
+    histogram = self._signals.get((interface, member))
+    if histogram is None:
+      histogram = self._signals.setdefault((interface, member), LogLinearHistogram())
+
+    histogram.record(seconds)
+
+  def summary(self, prefix = ''):
+    """
+    Returns {'interface.member': {'count', 'errors', 'reply_size', 'p50',
+    'p95', 'p99', 'max'}} of the calls, latencies in milliseconds and
+    reply_size the mean number of values in a reply.
+    """
+    summary = {}
+
+    for (interface, member), entry in self._calls.items():
+      name = '%s.%s' % (interface, member)
+      if not name.startswith(prefix):
+        continue
+
+      summary[name] = entry.histogram.summary()
+      summary[name]['errors'] = entry.errors
+
+      replies = entry.histogram.count() - entry.errors
+      summary[name]['reply_size'] = entry.reply_size / float(replies) if replies else 0
+
+    return summary
+
+  def signal_summary(self, prefix = ''):
+    """Returns {'interface.member': {'count', 'p50', 'p95', 'p99', 'max'}}"""
+    summary = {}
+
+    for (interface, member), histogram in self._signals.items():
+      name = '%s.%s' % (interface, member)
+      if name.startswith(prefix):
+        summary[name] = histogram.summary()
+
+    return summary
+
+  def slow_calls(self):
+    return list(self._slow_calls)
+
+  def slow_call_threshold(self):
+    return self._slow_call_threshold
+
+  def set_slow_call_threshold(self, seconds):
+    self._slow_call_threshold = seconds
+
+  def reset(self):
+    self._calls = {}
+    self._signals = {}
+    self._slow_calls = collections.deque(maxlen = self.SLOW_CALLS_KEPT)
+
+  @staticmethod
+  def size(value):
+    """Number of values in a reply, counting those inside containers"""
+    if isinstance(value, dict):
+      return 1 + sum([CallStats.size(k) + CallStats.size(v) for k, v in value.iteritems()])
+    elif isinstance(value, (list, tuple)):
+      return 1 + sum([CallStats.size(v) for v in value])
+    elif value is None:
+      return 0
+    else:
+      return 1
+
+class _CallEntry(object):
+  __slots__ = ('histogram', 'errors', 'reply_size')
+
+  def __init__(self):
+    self.histogram = LogLinearHistogram()
+    self.errors = 0
+    self.reply_size = 0
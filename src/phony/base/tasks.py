@@ -0,0 +1,171 @@
+from functools import wraps
+from phony.base.future import Future, gather
+
+class Return(Exception):
+  """Raised by a task's generator to finish with a value"""
+
+  def __init__(self, value = None):
+    Exception.__init__(self)
+    self.value = value
+
+class TimeoutError(Exception):
+  pass
+
+class Task(Future):
+  """
+  Runs a generator on the main loop.  The generator yields futures (or
+  lists of futures) and is resumed with their result, or has their
+  exception raised at the yield.  The task is a future of the generator's
+  outcome: raise Return(value) to finish with a value.
+
+    @coroutine
+    def ring_twice(self):
+      for i in range(0, 2):
+        self._bells.short_ring()
+        yield sleep(1.0)
+
+  cancel() raises CancelledError at the yield the task is waiting at,
+  so try/finally blocks in the generator run.  Each future of a yielded
+  list is cancelled.
+  """
+
+  _generator = None
+  _waiting_on = None
+  # The futures of a yielded list, _waiting_on gathers them
+  _waiting_on_all = None
+
+  def __init__(self, generator):
+    Future.__init__(self)
+    self._generator = generator
+    self._step(None, None)
+
+  def cancel(self):
+    if self.done():
+      return False
+
+    if self._waiting_on is not None:
+      waiting_on, children = self._waiting_on, self._waiting_on_all or []
+
+      for child in children:
+        child.cancel()
+      waiting_on.cancel()
+    else:
+      self._generator.close()
+      Future.cancel(self)
+
+    return True
+
+  def _step(self, value, exception):
+    # Loops instead of recursing while the yielded futures are done already
+    while True:
+      self._waiting_on = None
+      self._waiting_on_all = None
+
+      try:
+        if exception is not None:
+          yielded = self._generator.throw(exception)
+        else:
+          yielded = self._generator.send(value)
+      except StopIteration:
+        self.set_result(None)
+        return
+      except Return, ret:
+        self.set_result(ret.value)
+        return
+      except Exception, ex:
+        self.set_exception(ex)
+        return
+
+      future = Task._as_future(yielded)
+
+      if not future.done():
+        self._waiting_on = future
+        if future is not yielded:
+          self._waiting_on_all = list(yielded)
+        future.add_done_callback(self._resume)
+        return
+
+      value, exception = future._result, future._exception
+
+  def _resume(self, future):
+    self._step(future._result, future._exception)
+
+  @staticmethod
+  def _as_future(yielded):
+    if isinstance(yielded, Future):
+      return yielded
+    elif isinstance(yielded, (list, tuple)):
+      return gather(yielded)
+    else:
+      return Future.failed(TypeError('Tasks can only yield futures, not %r' % (yielded,)))
+
+def coroutine(generator_function):
+  """Calling the decorated generator function starts it as a Task"""
+  @wraps(generator_function)
+  def start(*args, **kwargs):
+    return Task(generator_function(*args, **kwargs))
+
+  return start
+
+def sleep(seconds):
+  """Future that completes after `seconds` on the main loop"""
+  import gobject
+
+  future = Future()
+
+  def expired():
+    future.set_result(None)
+    return False
+
+  source = gobject.timeout_add(int(seconds * 1000), expired)
+
+  def done(future):
+    if future.cancelled():
+      gobject.source_remove(source)
+
+  future.add_done_callback(done)
+  return future
+
+def wait_for(future, seconds):
+  """
+  Future of `future`'s outcome, that fails with TimeoutError (and cancels
+  `future`) when it takes longer than `seconds`.
+  """
+  import gobject
+
+  bounded = Future()
+  pending = [None]
+
+  def expired():
+    pending[0] = None
+    bounded.set_exception(TimeoutError('No result after %s seconds' % seconds))
+    future.cancel()
+    return False
+
+  pending[0] = gobject.timeout_add(int(seconds * 1000), expired)
+
+  def done(future):
+    if pending[0] is not None:
+      gobject.source_remove(pending[0])
+      pending[0] = None
+
+    if future._exception is not None:
+      bounded.set_exception(future._exception)
+    else:
+      bounded.set_result(future._result)
+
+  future.add_done_callback(done)
+  return bounded
+
+def call_soon_threadsafe(future, result):
+  """
+  Completes `future` with `result` on the main loop, for callbacks
+  running in other threads (i.e. RPi.GPIO edge detection).
+  """
+  import gobject
+
+  def complete():
+    future.set_result(result)
+    return False
+
+  gobject.idle_add(complete)
@@ -1,2 +1,3 @@
 from bluez4 import Bluez4
-from bluez5 import Bluez5
\ No newline at end of file
+from bluez5 import Bluez5
+from bluez5_adapters import Bluez5Adapters
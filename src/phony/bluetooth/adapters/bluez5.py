@@ -1,10 +1,20 @@
 import dbus
 
 from phony.base import execute
-from phony.base.log import ClassLogger
+from phony.base.clock import monotonic
+from phony.base.future import CancelledError, Future, gather
+from phony.base.ipc import DEFAULT_CALL_TIMEOUT, Subscriptions, call_async, proxies, timeout_until
+from phony.base.log import ClassLogger, RateLimit
+from phony.base.stats import LogLinearHistogram
+from phony.base.tasks import coroutine, sleep
+from phony.bluetooth.reconnect import Backoff, DeviceCache
 
 class Bluez5(ClassLogger):
   AGENT_PATH = '/phony/agent/bluez'
+
+  # In the order start() begins them
+  STARTUP_PHASES = ['objects', 'settings', 'properties', 'agent', 'ready']
+
   _agent = None
 
   _adapter_address = None
@@ -14,79 +24,160 @@ class Bluez5(ClassLogger):
   _adapter = None
   _adapter_properties = None
 
-  _on_device_connected_listeners = []
-  _on_device_disconnected_listeners = []
+  _on_device_connected_listeners = None
+  _on_device_disconnected_listeners = None
 
   _started = False
 
-  def __init__(self, bus_provider, adapter_address = None):
+  _bus_provider = None
+  _bus = None
+
+  _call_timeout = None
+  _mirror = None
+  # Which devices this adapter serves, see bluez5_adapters
+  _policy = None
+  _pincode = None
+
+  # path -> Bluez5Device, one per device for as long as bluez has it
+  _devices = None
+
+  # Task of start(), and the seconds each of its phases took
+  _bring_up = None
+  _startup_times = None
+
+  # Devices that connected last, called back by reconnect()
+  _device_cache = None
+  # Task of reconnect(), since when a device has been missed, and how
+  # long devices took to come back
+  _reconnecting = None
+  _reconnect_began = None
+  _reconnect_attempts = 0
+  _reconnect_latency = None
+
+  def __init__(self, bus_provider, adapter_address = None, call_timeout = DEFAULT_CALL_TIMEOUT,
+               mirror = None, device_cache = None, agent = None, policy = None):
+    """
+    Pass a DeviceCache with a file to remember devices across restarts.
+    Adapters of one process share a Bluez5Mirror, DeviceCache and
+    PermissibleAgent, and admit devices by `policy` (see
+    bluez5_adapters.Bluez5Adapters).
+    """
     ClassLogger.__init__(self)
     self._adapter_address = adapter_address
+    self._call_timeout = call_timeout
+    self._bus_provider = bus_provider
     self._bus = bus_provider.system_bus()
+    self._mirror = mirror or Bluez5Mirror(self._bus)
+    self._agent = agent
+    self._policy = policy
+    self._devices = {}
+
+    self._on_device_connected_listeners = []
+    self._on_device_disconnected_listeners = []
+
+    if device_cache is None:
+      device_cache = DeviceCache()
+
+    self._device_cache = device_cache
+    self._reconnect_latency = LogLinearHistogram()
 
   def __enter__(self):
     return self
 
   def __exit__(self, exc_type, exc_value, traceback):
     self.stop()
+    self._bus_provider.release(self._bus)
+    self._bus = None
 
   @ClassLogger.TraceAs.call(with_arguments = False)
   def start(self, name, pincode):
+    """
+    Brings the adapter up from the main loop, returning a Future that
+    completes once it is ready.  Calls that don't depend on each other
+    are made together:
+
+      GetManagedObjects -+- Set Alias, Set Powered --- GetAll
+                         +- RegisterAgent --- RequestDefaultAgent
+
+    then already connected devices are announced, or cached ones called
+    back (see reconnect()).  How long each phase took is logged, and
+    kept in startup_times().
+    """
     if self._started:
-      return
+      return self._bring_up
 
-    self._adapter = Bluez5Utils.find_adapter(self._adapter_address, self._bus)
+    self._pincode = PermissibleAgent.checked_pincode(pincode)
 
-    self._adapter_properties = Bluez5Utils.properties(
-      self._adapter.object_path,
-      self._bus
-    )
+    # Exported once, a path can't be exported twice
+    if not self._agent:
+      self._agent = PermissibleAgent(self._bus, self.AGENT_PATH)
 
-    self._bus.add_signal_receiver(
-      self.properties_changed,
-      dbus_interface = Bluez5Utils.PROPERTIES_INTERFACE,
-      signal_name = 'PropertiesChanged',
-      arg0 = Bluez5Utils.DEVICE_INTERFACE,
-      path_keyword = 'path'
-    )
-
-    self._bus.add_signal_receiver(
-      self.interfaces_added,
-      dbus_interface = Bluez5Utils.OBJECT_MANAGER_INTERFACE,
-      signal_name = 'InterfacesAdded'
-    )
+    self._started = True
+    self._startup_times = {}
+    self._bring_up = self._start(name, monotonic())
+    self._bring_up.add_done_callback(self._brought_up)
 
-    self._bus.add_signal_receiver(
-      self.interfaces_removed,
-      dbus_interface = Bluez5Utils.OBJECT_MANAGER_INTERFACE,
-      signal_name = 'InterfacesRemoved'
-    )
+    return self._bring_up
 
-    if name:
-      self._set_property('Alias', name)
+  def stop(self, deadline = None):
+    """Asks bluez to hide the adapter and drop its devices, by `deadline`"""
+    if not self._started:
+      return
 
-    self._set_property('Powered', True)
+    self._bring_up.cancel()
+    self._cancel_reconnect()
+    self._reconnect_began = None
+    self._remove_mirror_listeners()
 
-    self._show_properties()
+    if self._adapter:
+      self.disable_pairability(deadline)
+      self.disconnect_all_devices(deadline)
 
-    self.log().debug('Registering agent: ' + self.AGENT_PATH)
-    self._agent = PermissibleAgent(self._bus, self.AGENT_PATH)
-    self._agent.set_pincode(pincode)
+      # Send the queued asynchronous calls before the main loop is gone
+      self._bus.flush()
 
-    self._started = True
+    self._mirror.stop()
+    self._devices = {}
+    self._started = False
 
-    self._find_connected_devices_and_notify()
+  def startup_times(self):
+    """Seconds each phase of start() took, and 'ready' in all"""
+    return dict(self._startup_times or {})
 
-  def stop(self):
-    if not self._started:
+  @ClassLogger.TraceAs.call()
+  def reconnect(self, since = None):
+    """
+    Calls back the cached devices, most recently connected first, until
+    stop_reconnecting(), or until a device is connected.  Rounds of
+    Connect attempts are spaced by a jittered exponential Backoff.
+    `since` (monotonic seconds) is when the device was lost, for the
+    latency in reconnect_stats().
+    """
+    if self._reconnect_began is None:
+      self._reconnect_began = since if since is not None else monotonic()
+
+    if self._reconnecting and not self._reconnecting.done():
       return
 
-    if self.pairable():
-      self.disable_pairability()
-
-    self.disconnect_all_devices()
+    if self._reconnect_candidates():
+      self._reconnecting = self._reconnect()
 
-    self._started = False
+  @ClassLogger.TraceAs.call()
+  def stop_reconnecting(self):
+    """Called once a device is back (i.e. its audio gateway is attached)"""
+    self._cancel_reconnect()
+
+    if self._reconnect_began is not None:
+      self._reconnect_latency.record(monotonic() - self._reconnect_began)
+      self._reconnect_began = None
+
+  def reconnect_stats(self):
+    return {
+      'reconnecting': self._reconnecting is not None and not self._reconnecting.done(),
+      'attempts': self._reconnect_attempts,
+      'known_devices': self._device_cache.addresses(),
+      'latency': self._reconnect_latency.summary()
+    }
 
   @ClassLogger.TraceAs.call()
   def cancel_pending_operations(self):
@@ -94,20 +185,28 @@ class Bluez5(ClassLogger):
 
   @ClassLogger.TraceAs.event()
   def enable_pairability(self, timeout = 0):
-    self._set_property('Discoverable', True)
-    self._set_property('Pairable', True)
-    self._set_property('PairableTimeout', dbus.UInt32(timeout))
-    self._set_property('DiscoverableTimeout', dbus.UInt32(timeout))
+    """Made once start() is done, bluez can't make an unpowered adapter discoverable"""
+    def enable(ready):
+      return gather([
+        self._set_property_async('Discoverable', True),
+        self._set_property_async('Pairable', True),
+        self._set_property_async('PairableTimeout', dbus.UInt32(timeout)),
+        self._set_property_async('DiscoverableTimeout', dbus.UInt32(timeout))
+      ])
+
+    if self._bring_up:
+      return self._bring_up.then(enable)
+
+    return enable(None)
 
   @ClassLogger.TraceAs.event()
-  def disable_pairability(self):
-    try:
-      self._set_property('Discoverable', False)
-      self._set_property('Pairable', False)
-      self._set_property('PairableTimeout', dbus.UInt32(0))
-      self._set_property('DiscoverableTimeout', dbus.UInt32(180))
-    except:
-      pass
+  def disable_pairability(self, deadline = None):
+    return gather([
+      self._set_property_async('Discoverable', False, deadline),
+      self._set_property_async('Pairable', False, deadline),
+      self._set_property_async('PairableTimeout', dbus.UInt32(0), deadline),
+      self._set_property_async('DiscoverableTimeout', dbus.UInt32(180), deadline)
+    ])
 
   def pairable(self):
     return self._get_property('Discoverable') and self._get_property('Pairable')
@@ -119,11 +218,26 @@ class Bluez5(ClassLogger):
   def address(self):
     return self._get_property('Address')
 
+  def path(self):
+    return self._adapter.object_path if self._adapter else None
+
   @ClassLogger.TraceAs.call()
-  def disconnect_all_devices(self):
+  def disconnect_all_devices(self, deadline = None):
     devices = self._find_connected_devices()
-    for device in devices:
-      device.disconnect()
+    return gather([device.disconnect(connected = True, deadline = deadline) for device in devices])
+
+  def connected_devices(self):
+    return self._find_connected_devices() if self._adapter else []
+
+  def device(self, path):
+    """The Bluez5Device at `path`, the same one every time"""
+    device = self._devices.get(path)
+
+    if device is None:
+      device = Bluez5Device(Bluez5Utils.device(path, self._bus), self._bus, self._call_timeout, self._mirror)
+      self._devices[path] = device
+
+    return device
 
   def on_device_connected(self, listener):
     self._on_device_connected_listeners.append(listener)
@@ -131,25 +245,29 @@ class Bluez5(ClassLogger):
   def on_device_disconnected(self, listener):
     self._on_device_disconnected_listeners.append(listener)
 
-  @ClassLogger.TraceAs.event()
+  # Fires for every device property change (i.e. RSSI)
+  @ClassLogger.TraceAs.event(rate_limit = RateLimit(per_second = 5, burst = 20))
   def properties_changed(self, interface, changed, invalidated, path):
     if interface != Bluez5Utils.DEVICE_INTERFACE:
       return
 
+    if not Bluez5Utils.is_child_device(self._adapter, path):
+      return
+
     if 'Connected' in changed:
       connected = changed['Connected']
 
       if connected:
         self.log().info('Device: %s Connected' % path)
-        for listener in self._on_device_connected_listeners:
-          device = Bluez5Utils.device(path, self._bus)
-          device = Bluez5Device(device, self._bus)
-          listener(device)
+        self._device_connected(self.device(path))
       else:
         self.log().info('Device: %s Disconnected' % path)
         for listener in self._on_device_disconnected_listeners:
           listener(path)
 
+        if self._worth_calling_back(path):
+          self.reconnect(since = monotonic())
+
   @ClassLogger.TraceAs.event()
   def interfaces_added(self, path, interfaces):
     if Bluez5Utils.DEVICE_INTERFACE not in interfaces:
@@ -161,10 +279,7 @@ class Bluez5(ClassLogger):
       properties = interfaces[Bluez5Utils.DEVICE_INTERFACE]
 
       if 'Connected' in properties and properties['Connected']:
-        for listener in self._on_device_connected_listeners:
-          device = Bluez5Utils.device(path, self._bus)
-          device = Bluez5Device(device, self._bus)
-          listener(device)
+        self._device_connected(self.device(path))
 
   @ClassLogger.TraceAs.event()
   def interfaces_removed(self, path, interfaces):
@@ -174,9 +289,79 @@ class Bluez5(ClassLogger):
     if Bluez5Utils.is_child_device(self._adapter, path):
       self.log().info('Device removed: %s' % path)
 
+      # Unpaired, there's no calling it back
+      device = self._devices.pop(path, None)
+      if device and device.address():
+        self._device_cache.forget(device.address())
+
       for listener in self._on_device_disconnected_listeners:
         listener(path)
 
+  @coroutine
+  def _start(self, name, began):
+    yield self._timed('objects', self._mirror.start(self._call_timeout))
+
+    adapter_path = self._mirror.find_adapter(self._adapter_address)
+    if not adapter_path:
+      raise Exception('Bluetooth adapter not found: "%s"' % (self._adapter_address or '*'))
+
+    self._adapter = Bluez5Utils.adapter(adapter_path, self._bus)
+    self._adapter_properties = Bluez5Utils.properties(adapter_path, self._bus)
+    self._agent.set_pincode(self._pincode, adapter_path)
+
+    self._mirror.on_properties_changed(self.properties_changed)
+    self._mirror.on_interfaces_added(self.interfaces_added)
+    self._mirror.on_interfaces_removed(self.interfaces_removed)
+
+    settings = [self._set_property_async('Powered', True)]
+    if name:
+      settings.append(self._set_property_async('Alias', name))
+
+    # Read back once set, to see the adapter as powered
+    properties = self._timed('settings', gather(settings)).then(
+      lambda ignored: self._timed('properties', self._get_all_properties()))
+
+    self.log().debug('Registering agent: ' + self.AGENT_PATH)
+    registered = self._timed('agent', self._agent.register(self._call_timeout))
+
+    properties, ignored = yield [properties, registered]
+
+    self._mirror.update(adapter_path, {Bluez5Utils.ADAPTER_INTERFACE: properties})
+    self._startup_times['ready'] = monotonic() - began
+
+    self._show_properties()
+    self.log().info('Adapter ready: ' + ', '.join('%s %.1f ms' % (phase, self._startup_times[phase] * 1000)
+      for phase in self.STARTUP_PHASES if phase in self._startup_times))
+
+    if not self._find_connected_devices_and_notify():
+      self.reconnect(since = began)
+
+  def _brought_up(self, bring_up):
+    # A failed start is undone, so that start() can be tried again
+    if bring_up is not self._bring_up or bring_up.exception() is None or bring_up.cancelled():
+      return
+
+    self._remove_mirror_listeners()
+    self._mirror.stop()
+
+    self._adapter = None
+    self._adapter_properties = None
+    self._devices = {}
+    self._started = False
+
+  def _remove_mirror_listeners(self):
+    for listener in [self.properties_changed, self.interfaces_added, self.interfaces_removed]:
+      self._mirror.remove_listener(listener)
+
+  def _timed(self, phase, future):
+    issued = monotonic()
+
+    def done(future):
+      self._startup_times[phase] = monotonic() - issued
+
+    future.add_done_callback(done)
+    return future
+
   def _find_connected_devices_and_notify(self):
     # This is mostly for development, in case the main application
     # is restarted after a device has already been paired and connected.
@@ -186,20 +371,83 @@ class Bluez5(ClassLogger):
       self.log().info('Found %d device(s) connected, notifying...' % len(already_connected))
 
     for device in already_connected:
-      for listener in self._on_device_connected_listeners:
-        listener(device)
+      self._device_connected(device)
 
-  def _find_connected_devices(self):
-    connected_devices = []
+    return already_connected
+
+  def _device_connected(self, device):
+    if not self._admits(device):
+      self.log().info('Device %s is not for this adapter, disconnecting' % device.path())
+      device.disconnect(connected = True)
+      return
+
+    if device.address():
+      self._device_cache.remember(device.address(), device.path())
+
+    for listener in self._on_device_connected_listeners:
+      listener(device)
+
+  @coroutine
+  def _reconnect(self):
+    backoff = Backoff()
 
-    devices = Bluez5Utils.get_child_devices(self.address(), self._bus)
-    for device in devices:
-      device = Bluez5Device(device, self._bus)
+    while True:
+      candidates = self._reconnect_candidates()
 
-      if device.paired() and device.connected():
-        connected_devices.append(device)
+      # Calling another device back would have the headset drop the one
+      # that is connected, whether it came back by itself or was called
+      if not candidates or self._find_connected_devices():
+        return
 
-    return connected_devices
+      for path in candidates:
+        self._reconnect_attempts += 1
+
+        try:
+          yield self.device(path).connect()
+          # Back, there's nothing left to wait for
+          return
+        except CancelledError:
+          raise
+        except Exception, ex:
+          self.log().info('Unable to reconnect to %s: %s' % (path, ex))
+
+      yield sleep(backoff.next())
+
+  def _reconnect_candidates(self):
+    """Paths of the cached devices this adapter still has, most recent first"""
+    if not self._adapter:
+      return []
+
+    candidates = []
+
+    for entry in self._device_cache.devices():
+      path = entry['path']
+
+      # The path changes if the adapter's does, the address doesn't
+      if not Bluez5Utils.is_child_device(self._adapter, path) or \
+         self._mirror.property(path, Bluez5Utils.DEVICE_INTERFACE, 'Address', '').upper() != entry['address']:
+        path = self._mirror.find_device(entry['address'], self._adapter.object_path)
+
+      if path and self._admits(self.device(path)):
+        candidates.append(path)
+
+    return candidates
+
+  def _worth_calling_back(self, path):
+    """Whether the device that left is a cached one this adapter serves"""
+    address = self._mirror.property(path, Bluez5Utils.DEVICE_INTERFACE, 'Address')
+    return address is not None and address in self._device_cache and self._admits(self.device(path))
+
+  def _admits(self, device):
+    return self._policy is None or self._policy.admits(self, device)
+
+  def _cancel_reconnect(self):
+    if self._reconnecting:
+      self._reconnecting.cancel()
+      self._reconnecting = None
+
+  def _find_connected_devices(self):
+    return [self.device(path) for path in self._mirror.connected_devices(self._adapter.object_path)]
 
   def _show_properties(self):
     self.log().debug('Adapter Path: ' + self._adapter.object_path)
@@ -210,25 +458,58 @@ class Bluez5(ClassLogger):
     self.log().debug('Adapter Class: 0x%06x' % self._get_property('Class'))
 
   def _get_property(self, prop):
-    return self._adapter_properties.Get(Bluez5Utils.ADAPTER_INTERFACE, prop)
+    return self._mirror.property(self._adapter.object_path, Bluez5Utils.ADAPTER_INTERFACE, prop)
+
+  def _get_all_properties(self):
+    return call_async(
+      self._adapter_properties.GetAll,
+      Bluez5Utils.ADAPTER_INTERFACE,
+      timeout = self._call_timeout
+    )
 
-  def _set_property(self, prop, value):
-    self._adapter_properties.Set(Bluez5Utils.ADAPTER_INTERFACE, prop, value)
+  def _set_property_async(self, prop, value, deadline = None):
+    return call_async(
+      self._adapter_properties.Set,
+      Bluez5Utils.ADAPTER_INTERFACE,
+      prop,
+      value,
+      timeout = timeout_until(deadline, self._call_timeout)
+    )
+
+  def trace_label(self):
+    if self._adapter:
+      return self._adapter.object_path
+    else:
+      return 'Bluez5'
 
   def __repr__(self):
+    # Before start(), or after it failed, there's no adapter to describe
+    if not self._adapter:
+      return '<Bluez5 (not started)>'
+
     return '%s %s' % (self._get_property('Address'), self._get_property('Name'))
 
 class PermissibleAgent(dbus.service.Object, ClassLogger):
+  """
+  One agent serves every adapter on the bus: pincodes can be set per
+  adapter, and registering again returns the first registration.
+  """
+
   _passcode = None
   _pincode = None
+  # adapter path -> pincode, for its devices
+  _pincodes = None
   _path = None
   _capability = None
+  _manager = None
+  _registration = None
 
   def __init__(self, bus, path):
     ClassLogger.__init__(self)
     dbus.service.Object.__init__(self, bus, path)
 
     self._path = path
+    self._pincodes = {}
     self._capability = 'KeyboardDisplay'
 
     #
@@ -243,18 +524,45 @@ class PermissibleAgent(dbus.service.Object, ClassLogger):
     #self._capability = 'KeyboardDisplay'
     #self._capability = 'DisplayYesNo'
 
-    manager = dbus.Interface(
-      bus.get_object(Bluez5Utils.SERVICE_NAME, '/org/bluez'),
+    self._manager = proxies.interface(
+      bus,
+      Bluez5Utils.SERVICE_NAME,
+      '/org/bluez',
       Bluez5Utils.AGENT_MANAGER_INTERFACE
     )
 
-    manager.RegisterAgent(self._path, self._capability)
-    manager.RequestDefaultAgent(self._path)
+  def register(self, timeout = DEFAULT_CALL_TIMEOUT):
+    """Future of registering as the default agent"""
+    failed = self._registration and self._registration.done() and self._registration.exception()
+
+    if not self._registration or failed:
+      self._registration = call_async(self._manager.RegisterAgent, self._path, self._capability, timeout = timeout).then(
+        lambda ignored: call_async(self._manager.RequestDefaultAgent, self._path, timeout = timeout))
+
+    return self._registration.then(lambda ignored: None)
+
+  def set_pincode(self, pincode, adapter_path = None):
+    """The pincode for devices of `adapter_path`, or for all others"""
+    pincode = self.checked_pincode(pincode)
+
+    if adapter_path:
+      self._pincodes[adapter_path] = pincode
+    else:
+      self._pincode = pincode
+
+  def pincode(self, device_path):
+    for adapter_path, pincode in self._pincodes.iteritems():
+      if device_path.startswith(adapter_path + '/'):
+        return pincode
 
-  def set_pincode(self, pincode):
-    self._pincode = str(pincode)
-    if len(self._pincode) < 1 or len(self._pincode) > 16:
+    return self._pincode
+
+  @staticmethod
+  def checked_pincode(pincode):
+    pincode = str(pincode)
+    if len(pincode) < 1 or len(pincode) > 16:
       raise Exception('Pincode must be between 1 and 16 characters long')
+    return pincode
 
   def set_passcode(self, passcode):
     self._passcode = passcode
@@ -276,7 +584,7 @@ class PermissibleAgent(dbus.service.Object, ClassLogger):
   @dbus.service.method("org.bluez.Agent1", in_signature="o", out_signature="s")
   def RequestPinCode(self, device):
     self.log().debug("RequestPinCode (%s)" % (device))
-    return self._pincode
+    return self.pincode(device)
 
   @dbus.service.method("org.bluez.Agent1", in_signature="o", out_signature="u")
   def RequestPasskey(self, device):
@@ -307,6 +615,7 @@ class Bluez5Utils:
   """See bluez5-x.y/test/bluezutils.py"""
 
   SERVICE_NAME = 'org.bluez'
+  ROOT_PATH = '/org/bluez'
   ADAPTER_INTERFACE = 'org.bluez.Adapter1'
   DEVICE_INTERFACE = 'org.bluez.Device1'
   AGENT_MANAGER_INTERFACE = 'org.bluez.AgentManager1'
@@ -322,12 +631,17 @@ class Bluez5Utils:
     HandsFreeAudioGateway = '0000111F-0000-1000-8000-00805F9B34FB'
 
   @staticmethod
-  def get_managed_objects(bus):
-    manager = dbus.Interface(
-      bus.get_object(Bluez5Utils.SERVICE_NAME, '/'),
+  def get_managed_objects(bus, timeout = DEFAULT_CALL_TIMEOUT):
+    return Bluez5Utils.object_manager(bus).GetManagedObjects(timeout = timeout)
+
+  @staticmethod
+  def object_manager(bus):
+    return proxies.interface(
+      bus,
+      Bluez5Utils.SERVICE_NAME,
+      '/',
       Bluez5Utils.OBJECT_MANAGER_INTERFACE
     )
-    return manager.GetManagedObjects()
 
   @staticmethod
   def find_adapter(pattern, bus):
@@ -386,7 +700,8 @@ class Bluez5Utils:
 
   @staticmethod
   def is_child_device(adapter, device_path):
-    return device_path.startswith(adapter.object_path)
+    # hci1 isn't hci10's parent
+    return device_path.startswith(adapter.object_path + '/')
 
   @staticmethod
   def find_device(device_address, adapter_pattern, bus):
@@ -402,7 +717,7 @@ class Bluez5Utils:
     path_prefix = ''
     if adapter_pattern:
       adapter = Bluez5Utils.find_adapter_in_objects(objects, adapter_pattern, bus)
-      path_prefix = adapter.object_path
+      path_prefix = adapter.object_path + '/'
     for path, ifaces in objects.iteritems():
       device = ifaces.get(Bluez5Utils.DEVICE_INTERFACE)
 
@@ -417,58 +732,383 @@ class Bluez5Utils:
 
   @staticmethod
   def properties(path, bus):
-    return dbus.Interface(
-      bus.get_object(Bluez5Utils.SERVICE_NAME, path),
+    return proxies.interface(
+      bus,
+      Bluez5Utils.SERVICE_NAME,
+      path,
       Bluez5Utils.PROPERTIES_INTERFACE
     )
 
   @staticmethod
   def device(path, bus):
-    return dbus.Interface(
-      bus.get_object(Bluez5Utils.SERVICE_NAME, path),
+    return proxies.interface(
+      bus,
+      Bluez5Utils.SERVICE_NAME,
+      path,
       Bluez5Utils.DEVICE_INTERFACE
     )
 
   @staticmethod
   def adapter(path, bus):
-    return dbus.Interface(
-      bus.get_object(Bluez5Utils.SERVICE_NAME, path),
+    return proxies.interface(
+      bus,
+      Bluez5Utils.SERVICE_NAME,
+      path,
       Bluez5Utils.ADAPTER_INTERFACE
     )
 
+class Bluez5Mirror(ClassLogger):
+  """
+  A local copy of bluez's object tree: seeded from GetManagedObjects
+  once, and kept current from InterfacesAdded, InterfacesRemoved and
+  PropertiesChanged.  Objects are indexed by path, adapters and devices
+  by address, devices by adapter, so lookups make no calls.
+
+  Values are as bluez last reported them: a property set by a call is
+  seen once bluez signals the change.  Listeners registered with
+  on_interfaces_added() etc. are called after the mirror is updated.
+
+  A mirror can be shared: it is seeded by the first start() and
+  emptied by the last stop().
+  """
+
+  _bus = None
+  _subscriptions = None
+  _users = 0
+
+  # Future of the GetManagedObjects() reply, and of it being loaded
+  _loading = None
+  _loaded = None
+
+  # path -> {interface: {property: value}}
+  _objects = None
+  # address -> path
+  _adapters_by_address = None
+  # adapter path -> {address: device path}
+  _devices_by_adapter = None
+
+  _on_interfaces_added_listeners = None
+  _on_interfaces_removed_listeners = None
+  _on_properties_changed_listeners = None
+
+  def __init__(self, bus):
+    ClassLogger.__init__(self)
+
+    self._bus = bus
+    self._subscriptions = Subscriptions('Bluez5Mirror')
+
+    self._on_interfaces_added_listeners = []
+    self._on_interfaces_removed_listeners = []
+    self._on_properties_changed_listeners = []
+
+    self.clear()
+
+  @ClassLogger.TraceAs.call()
+  def start(self, timeout = DEFAULT_CALL_TIMEOUT):
+    """
+    Returns a Future that completes once the mirror is seeded.  Users of
+    a shared mirror wait for the first user's GetManagedObjects().
+    """
+    self._users += 1
+    if self._users > 1:
+      return self._seeded()
+
+    # Subscribed before asking, so no change is missed in between.  Not
+    # by bus_name, dbus-python would watch its owner for each receiver:
+    # other services' signals are told apart by their paths instead.
+    for signal_name, handler in [('InterfacesAdded', self._interfaces_added), ('InterfacesRemoved', self._interfaces_removed)]:
+      self._subscriptions.add(
+        self._bus,
+        handler,
+        dbus_interface = Bluez5Utils.OBJECT_MANAGER_INTERFACE,
+        signal_name = signal_name,
+        path = '/'
+      )
+
+    self._subscriptions.add(
+      self._bus,
+      self._properties_changed,
+      dbus_interface = Bluez5Utils.PROPERTIES_INTERFACE,
+      signal_name = 'PropertiesChanged',
+      path_namespace = Bluez5Utils.ROOT_PATH,
+      path_keyword = 'path'
+    )
+
+    loading = call_async(Bluez5Utils.object_manager(self._bus).GetManagedObjects, timeout = timeout)
+    self._loading = loading
+
+    def load(objects):
+      # Unless stopped while waiting
+      if self._loading is loading:
+        self.load(objects)
+
+    self._loaded = loading.then(load)
+    return self._seeded()
+
+  @ClassLogger.TraceAs.call()
+  def stop(self):
+    if self._users == 0:
+      return
+
+    self._users -= 1
+    if self._users == 0:
+      self._subscriptions.remove_all()
+      self._loaded.cancel()
+      self._loading = self._loaded = None
+      self.clear()
+
+  def load(self, objects):
+    """Replaces the mirror's contents with a GetManagedObjects() reply"""
+    self.clear()
+
+    for path, interfaces in objects.iteritems():
+      self._add(str(path), interfaces)
+
+  def update(self, path, interfaces):
+    """Merges `interfaces` ({interface: {property: value}}) into the object's"""
+    self._add(str(path), interfaces)
+
+  def clear(self):
+    self._objects = {}
+    self._adapters_by_address = {}
+    self._devices_by_adapter = {}
+
+  def on_interfaces_added(self, listener):
+    self._on_interfaces_added_listeners.append(listener)
+
+  def on_interfaces_removed(self, listener):
+    self._on_interfaces_removed_listeners.append(listener)
+
+  def on_properties_changed(self, listener):
+    self._on_properties_changed_listeners.append(listener)
+
+  def remove_listener(self, listener):
+    for listeners in [self._on_interfaces_added_listeners,
+                      self._on_interfaces_removed_listeners,
+                      self._on_properties_changed_listeners]:
+      if listener in listeners:
+        listeners.remove(listener)
+
+  def properties(self, path, interface):
+    """The object's properties of `interface`, None if it has none"""
+    return self._objects.get(path, {}).get(interface)
+
+  def property(self, path, interface, name, default = None):
+    properties = self.properties(path, interface)
+    if properties is None:
+      return default
+    return properties.get(name, default)
+
+  def contains(self, path, interface = None):
+    if interface is None:
+      return path in self._objects
+    return self.properties(path, interface) is not None
+
+  def adapters(self):
+    return sorted(self._adapters_by_address.values())
+
+  def find_adapter(self, pattern = None):
+    """
+    Path of the adapter with address `pattern` or whose path ends with
+    it (i.e. 'hci0'), or of the first adapter when there's no pattern.
+    """
+    if not pattern:
+      adapters = self.adapters()
+      return adapters[0] if adapters else None
+
+    pattern = pattern.upper()
+
+    path = self._adapters_by_address.get(pattern)
+    if path:
+      return path
+
+    for path in self._adapters_by_address.itervalues():
+      if path.upper().endswith(pattern):
+        return path
+
+    return None
+
+  def devices(self, adapter_path = None):
+    if adapter_path:
+      return sorted(self._devices_by_adapter.get(adapter_path, {}).values())
+
+    return sorted(path
+      for devices in self._devices_by_adapter.itervalues()
+      for path in devices.itervalues())
+
+  def find_device(self, address, adapter_path = None):
+    address = address.upper()
+
+    if adapter_path:
+      return self._devices_by_adapter.get(adapter_path, {}).get(address)
+
+    for devices in self._devices_by_adapter.itervalues():
+      if address in devices:
+        return devices[address]
+
+    return None
+
+  def connected_devices(self, adapter_path):
+    return [path for path in self.devices(adapter_path)
+      if self.property(path, Bluez5Utils.DEVICE_INTERFACE, 'Paired')
+      and self.property(path, Bluez5Utils.DEVICE_INTERFACE, 'Connected')]
+
+  def object_count(self):
+    return len(self._objects)
+
+  def _seeded(self):
+    # Each user's own, so cancelling it leaves the others waiting
+    return self._loaded.then(lambda ignored: None)
+
+  @staticmethod
+  def _in_bluez(path):
+    # Other services' ObjectManagers at / signal on the same match
+    return path == Bluez5Utils.ROOT_PATH or path.startswith(Bluez5Utils.ROOT_PATH + '/')
+
+  def _add(self, path, interfaces):
+    known = self._objects.setdefault(path, {})
+
+    for interface, properties in interfaces.iteritems():
+      known.setdefault(str(interface), {}).update(properties)
+
+    adapter = interfaces.get(Bluez5Utils.ADAPTER_INTERFACE)
+    if adapter is not None and 'Address' in adapter:
+      self._adapters_by_address[str(adapter['Address']).upper()] = path
+
+    device = interfaces.get(Bluez5Utils.DEVICE_INTERFACE)
+    if device is not None and 'Address' in device:
+      adapter_path = str(device.get('Adapter') or path[:path.rfind('/')])
+      self._devices_by_adapter.setdefault(adapter_path, {})[str(device['Address']).upper()] = path
+
+  def _remove(self, path, interfaces):
+    known = self._objects.get(path)
+    if known is None:
+      return
+
+    for interface in interfaces:
+      properties = known.pop(str(interface), None)
+      if properties is None:
+        continue
+
+      if interface == Bluez5Utils.ADAPTER_INTERFACE:
+        self._adapters_by_address.pop(str(properties.get('Address', '')).upper(), None)
+        self._devices_by_adapter.pop(path, None)
+      elif interface == Bluez5Utils.DEVICE_INTERFACE:
+        for devices in self._devices_by_adapter.itervalues():
+          devices.pop(str(properties.get('Address', '')).upper(), None)
+
+    if not known:
+      del self._objects[path]
+
+  def _interfaces_added(self, path, interfaces):
+    if not Bluez5Mirror._in_bluez(path):
+      return
+
+    self._add(str(path), interfaces)
+
+    for listener in self._on_interfaces_added_listeners:
+      listener(path, interfaces)
+
+  def _interfaces_removed(self, path, interfaces):
+    if not Bluez5Mirror._in_bluez(path):
+      return
+
+    self._remove(str(path), interfaces)
+
+    for listener in self._on_interfaces_removed_listeners:
+      listener(path, interfaces)
+
+  def _properties_changed(self, interface, changed, invalidated, path):
+    properties = self.properties(path, interface)
+
+    if properties is not None:
+      properties.update(changed)
+      for name in invalidated:
+        properties.pop(name, None)
+
+    for listener in self._on_properties_changed_listeners:
+      listener(interface, changed, invalidated, path)
+
 class Bluez5Device(ClassLogger):
   _device = None
   _properties = None
   _bus = None
-
-  def __init__(self, device, bus):
+  _call_timeout = None
+  _mirror = None
+
+  # Identity, read once
+  _address = None
+  _name = None
+  # Last values read from the mirror
+  _known = None
+
+  def __init__(self, device, bus, call_timeout = DEFAULT_CALL_TIMEOUT, mirror = None):
+    """
+    With a Bluez5Mirror, properties are read from it instead of bluez.
+    Get devices from Bluez5.device(), rather than creating them.
+    """
     ClassLogger.__init__(self)
 
     self._device = device
     self._bus = bus
+    self._call_timeout = call_timeout
+    self._mirror = mirror
+    self._known = {}
 
     self._properties = Bluez5Utils.properties(device.object_path, self._bus)
 
+    if self._mirrored():
+      # Free now, a round trip each later on
+      self.address()
+      self.name()
+
   @ClassLogger.TraceAs.call()
-  def dispose(self):
-    try:
-      self.disconnect()
-    except Exception:
-      pass
+  def dispose(self, deadline = None):
+    # Failures don't matter, the device is going away
+    return self.disconnect(deadline = deadline)
 
   @ClassLogger.TraceAs.call()
-  def disconnect(self):
-    if self.connected():
-      return self._device.Disconnect()
+  def connect(self, deadline = None):
+    return call_async(self._device.Connect, timeout = timeout_until(deadline, self._call_timeout))
+
+  @ClassLogger.TraceAs.call()
+  def disconnect(self, connected = None, deadline = None):
+    """
+    Pass `connected` when known, to save asking for it first, and a
+    `deadline` (monotonic seconds) to end the calls by.  Nothing is
+    called once bluez has removed the device.
+    """
+    if self.removed():
+      return Future.resolved()
+
+    def disconnect_if_connected(connected):
+      if not connected:
+        return Future.resolved()
+      return call_async(self._device.Disconnect, timeout = timeout_until(deadline, self._call_timeout))
+
+    if connected is None and self._mirrored():
+      connected = self.connected()
+
+    if connected is not None:
+      return disconnect_if_connected(connected)
+
+    return self._get_property_async('Connected', deadline).then(disconnect_if_connected)
+
+  def removed(self):
+    return proxies.gone(self._bus, Bluez5Utils.SERVICE_NAME, self.path())
 
   def path(self):
     return self._device.object_path
 
   def address(self):
-    return self._get_property('Address')
+    if self._address is None:
+      self._address = self._get_property('Address')
+    return self._address
 
   def name(self):
-    return self._get_property('Name')
+    if self._name is None:
+      self._name = self._get_property('Name')
+    return self._name
 
   def connected(self):
     return self._get_property('Connected')
@@ -477,14 +1117,35 @@ class Bluez5Device(ClassLogger):
     return self._get_property('Paired')
 
   def _get_property(self, prop):
-    return self._properties.Get(Bluez5Utils.DEVICE_INTERFACE, prop)
+    # Never a round trip: a device the mirror doesn't have (yet, or any
+    # more) has its last known value, or None.  See _get_property_async.
+    if self._mirrored():
+      self._known[prop] = self._mirror.property(self.path(), Bluez5Utils.DEVICE_INTERFACE, prop)
+
+    return self._known.get(prop)
+
+  def _mirrored(self):
+    return self._mirror is not None and self._mirror.contains(self.path(), Bluez5Utils.DEVICE_INTERFACE)
+
+  def _get_property_async(self, prop, deadline = None):
+    return call_async(
+      self._properties.Get,
+      Bluez5Utils.DEVICE_INTERFACE,
+      prop,
+      timeout = timeout_until(deadline, self._call_timeout)
+    )
 
-  def _set_property(self, prop, value):
-    self._properties.Set(Bluez5Utils.DEVICE_INTERFACE, prop, value)
+  def trace_label(self):
+    return self._device.object_path
 
   def __repr__(self):
     return '%s %s' % (self.address(), self.name())
 
   def __eq__(self, other):
-    return (isinstance(other, self.__class__)
-      and self.address() == other.address())
\ No newline at end of file
+    return isinstance(other, self.__class__) and self.path() == other.path()
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return hash(self.path())
\ No newline at end of file
@@ -0,0 +1,130 @@
+from phony.base.ipc import DEFAULT_CALL_TIMEOUT
+from phony.base.log import ClassLogger
+from phony.bluetooth.adapters.bluez5 import Bluez5, Bluez5Mirror, PermissibleAgent
+from phony.bluetooth.reconnect import DeviceCache
+
+class AssignmentPolicy(object):
+  """Decides which adapter serves a device: admits() it or not"""
+
+  def admits(self, adapter, device):
+    return True
+
+class OneDevicePerAdapter(AssignmentPolicy):
+  """
+  A device is turned away from an adapter that already has another one
+  connected, instead of the headset dropping the first for it.
+  """
+
+  def admits(self, adapter, device):
+    return all(connected == device for connected in adapter.connected_devices())
+
+class PinnedDevices(AssignmentPolicy):
+  """
+  Devices pinned to an adapter, by its address or HCI id, are only
+  admitted by that adapter:
+
+    PinnedDevices({'00:11:22:33:44:55': 'hci0', '00:11:22:33:44:66': 'hci1'})
+
+  Devices that aren't pinned are admitted anywhere.
+  """
+
+  _pins = None
+
+  def __init__(self, pins):
+    self._pins = dict((str(address).upper(), str(adapter).upper()) for address, adapter in pins.iteritems())
+
+  def admits(self, adapter, device):
+    pinned_to = self._pins.get(str(device.address()).upper())
+    if not pinned_to:
+      return True
+
+    return pinned_to in (str(adapter.address()).upper(), adapter.hci_id().upper())
+
+class AllOf(AssignmentPolicy):
+  """Admits a device when every one of `policies` does"""
+
+  _policies = None
+
+  def __init__(self, *policies):
+    self._policies = policies
+
+  def admits(self, adapter, device):
+    return all(policy.admits(adapter, device) for policy in self._policies)
+
+class Bluez5Adapters(ClassLogger):
+  """
+  Several adapters driven by one process, i.e. one headset per adapter.
+  They share the system bus connection, one Bluez5Mirror, DeviceCache
+  and PermissibleAgent, and the main loop, so an adapter only adds its
+  own state:
+
+    with Bluez5Adapters(bus, ['hci0', 'hci1'], policy = OneDevicePerAdapter()) as adapters:
+      headsets = [HandsFreeHeadset(bus, adapter, Ofono(bus), Alsa(card))
+        for adapter, card in zip(adapters, cards)]
+
+  Each headset starts and stops its adapter.  Devices are admitted by
+  `policy`, see AssignmentPolicy.
+  """
+
+  _bus_provider = None
+  _bus = None
+  _mirror = None
+  _agent = None
+  _adapters = None
+
+  def __init__(self, bus_provider, adapter_addresses, call_timeout = DEFAULT_CALL_TIMEOUT,
+               device_cache = None, policy = None):
+    ClassLogger.__init__(self)
+
+    self._bus_provider = bus_provider
+    self._bus = bus_provider.system_bus()
+    self._mirror = Bluez5Mirror(self._bus)
+    self._agent = PermissibleAgent(self._bus, Bluez5.AGENT_PATH)
+
+    if device_cache is None:
+      device_cache = DeviceCache(capacity = DeviceCache.CAPACITY * len(adapter_addresses))
+
+    self._adapters = [
+      Bluez5(
+        bus_provider,
+        address,
+        call_timeout,
+        mirror = self._mirror,
+        device_cache = device_cache,
+        agent = self._agent,
+        policy = policy
+      )
+      for address in adapter_addresses
+    ]
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    for adapter in self._adapters:
+      adapter.__exit__(exc_type, exc_value, traceback)
+
+    self._bus_provider.release(self._bus)
+    self._bus = None
+
+  def stop(self, deadline = None):
+    for adapter in self._adapters:
+      adapter.stop(deadline)
+
+  def adapter_for(self, device_path):
+    """The started adapter that `device_path` belongs to, if any"""
+    for adapter in self._adapters:
+      path = adapter.path()
+      if path and device_path.startswith(path + '/'):
+        return adapter
+
+    return None
+
+  def __iter__(self):
+    return iter(self._adapters)
+
+  def __len__(self):
+    return len(self._adapters)
+
+  def __getitem__(self, index):
+    return self._adapters[index]
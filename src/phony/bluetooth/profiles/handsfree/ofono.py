@@ -1,7 +1,9 @@
 import dbus
 import gobject
 
-from phony.base.log import ClassLogger, Levels
+from phony.base.future import Future, gather, settle
+from phony.base.ipc import DEFAULT_CALL_TIMEOUT, Subscriptions, call_async, proxies, timeout_until
+from phony.base.log import ClassLogger, Levels, RateLimit
 
 class Ofono(ClassLogger):
   SERVICE_NAME = 'org.ofono'
@@ -13,20 +15,31 @@ class Ofono(ClassLogger):
 
   POLL_FOR_HFP_MODEM_FREQUENCY_MS = 1000
 
+  _bus_provider = None
   _bus = None
   _manager = None
 
-  _poll_for_child_hfp_modem_id = None
+  # The _ModemSearch of attach_audio_gateway(), and the futures of
+  # wait_for_audio_gateway()
+  _attaching = None
+  _waiting = None
 
-  def __init__(self, bus_provider):
+  _call_timeout = None
+
+  def __init__(self, bus_provider, call_timeout = DEFAULT_CALL_TIMEOUT):
     ClassLogger.__init__(self)
 
+    self._call_timeout = call_timeout
+    self._bus_provider = bus_provider
     self._bus = bus_provider.system_bus()
+    self._waiting = []
 
   @ClassLogger.TraceAs.call()
   def start(self):
-    self._manager = dbus.Interface(
-      self._bus.get_object(self.SERVICE_NAME, '/'),
+    self._manager = proxies.interface(
+      self._bus,
+      self.SERVICE_NAME,
+      '/',
       self.MANAGER_INTERFACE
     )
 
@@ -36,58 +49,59 @@ class Ofono(ClassLogger):
 
   @ClassLogger.TraceAs.call()
   def attach_audio_gateway(self, adapter, device, listener):
-    self._poll_for_child_hfp_modem_id = gobject.timeout_add(
-      self.POLL_FOR_HFP_MODEM_FREQUENCY_MS,
-      self._poll_for_child_hfp_modem,
-      adapter,
-      device,
-      listener
-    )
+    if self._attaching:
+      self._attaching.cancel()
 
-  @ClassLogger.TraceAs.call()
-  def cancel_pending_operations(self):
-    self._reset()
+    self._attaching = _ModemSearch(self, adapter, device, listener)
 
-  @ClassLogger.TraceAs.call()
-  def _poll_for_child_hfp_modem(self, adapter, device, listener):
-    path = self._find_child_hfp_modem(adapter, device)
+  def wait_for_audio_gateway(self, adapter, device):
+    """
+    Future of the OfonoHfpAg of the device, once oFono has its modem.
+    Cancelling it cancels the wait, it has its own search so it doesn't
+    disturb attach_audio_gateway().
+    """
+    future = Future()
+    search = _ModemSearch(self, adapter, device, future.set_result)
+    self._waiting.append(future)
 
-    if path:
-      ag = OfonoHfpAg(path, self._bus)
-      listener(ag)
+    def done(future):
+      search.cancel()
+      if future in self._waiting:
+        self._waiting.remove(future)
 
-      # False: stop checking
-      self._poll_for_child_hfp_modem_id = None
-      return False
-    else:
-      # True: keep periodically checking
-      return True
+    future.add_done_callback(done)
+    return future
+
+  @ClassLogger.TraceAs.call()
+  def cancel_pending_operations(self):
+    self._reset()
 
   def _find_child_hfp_modem(self, adapter, device):
-    modems = self._manager.GetModems()
+    def find(modems):
+      for path, properties in modems:
+        if Ofono._is_child_of(adapter, path) \
+          and Ofono._is_bound_to(device, path) \
+          and self.HFP_INTERFACE in properties.get('Interfaces', []):
 
-    for path, properties in modems:
-      if Ofono._is_child_of(adapter, path) \
-        and Ofono._is_bound_to(device, path) \
-        and self._provides_hfp_interface(path):
+          return path
 
-        return path
+      return None
 
-    return None
+    return call_async(self._manager.GetModems, timeout = self._call_timeout).then(find)
 
   def _reset(self):
-    if self._find_child_hfp_modem:
-      try:
-        gobject.source_remove(self._poll_for_child_hfp_modem_id)
-      except:
-        pass
+    if self._attaching:
+      self._attaching.cancel()
+      self._attaching = None
 
-      self._poll_for_child_hfp_modem_id = None
+    waiting, self._waiting = self._waiting, []
+    for future in waiting:
+      future.cancel()
 
   @staticmethod
   def _is_child_of(adapter, path):
     path = path.lower()
-    parent = '/org/bluez/%s' % adapter.hci_id().lower()
+    parent = '/org/bluez/%s/' % adapter.hci_id().lower()
     return parent in path
 
   @staticmethod
@@ -96,73 +110,190 @@ class Ofono(ClassLogger):
     endpoint = device.address().lower()
     return path.endswith(endpoint)
 
-  def _provides_hfp_interface(self, path):
-    modem = dbus.Interface(
-      self._bus.get_object(self.SERVICE_NAME, path),
-      self.MODEM_INTERFACE
-    )
-
-    properties = modem.GetProperties()
-
-    return self.HFP_INTERFACE in properties['Interfaces']
-
   def __enter__(self):
     return self
 
   def __exit__(self, exc_type, exc_value, traceback):
     self._reset()
+    # Send what asynchronous calls (i.e. hangups) are still queued
+    self._bus.flush()
+    self._bus_provider.release(self._bus)
     self._bus = None
     self._manager = None
 
+class _ModemSearch(object):
+  """
+  Polls oFono for the HFP modem of `device`, and hands its OfonoHfpAg to
+  `listener` once its properties are read, unless cancel()led first.
+  """
+
+  _ofono = None
+  _adapter = None
+  _device = None
+  _listener = None
+  _poll_id = None
+  # Future of the last poll's GetModems
+  _listing = None
+
+  def __init__(self, ofono, adapter, device, listener):
+    self._ofono = ofono
+    self._adapter = adapter
+    self._device = device
+    self._listener = listener
+
+    self._poll_id = gobject.timeout_add(Ofono.POLL_FOR_HFP_MODEM_FREQUENCY_MS, self._poll)
+
+  def cancel(self):
+    self._stop_polling()
+    self._listener = None
+
+  def _poll(self):
+    # A slow oFono skips ticks, instead of piling up calls
+    if self._listing and not self._listing.done():
+      return True
+
+    self._listing = self._ofono._find_child_hfp_modem(self._adapter, self._device)
+    self._listing.then(self._found)
+    self._listing.add_done_callback(self._failed)
+
+    # True: keep periodically checking, until found
+    return True
+
+  def _found(self, path):
+    if not path or not self._listener:
+      return
+
+    self._stop_polling()
+    ag = OfonoHfpAg(path, self._ofono._bus, self._ofono._call_timeout)
+
+    def ready(ignored):
+      # Unless cancelled while reading its properties
+      listener, self._listener = self._listener, None
+      if listener:
+        listener(ag)
+      else:
+        ag.release()
+
+    ag.ready().then(ready)
+
+  def _failed(self, listing):
+    if listing.exception() is not None:
+      self._ofono.log().warning('Unable to list modems: %s' % listing.exception())
+
+  def _stop_polling(self):
+    if self._poll_id is not None:
+      gobject.source_remove(self._poll_id)
+      self._poll_id = None
+
 class OfonoHfpAg(ClassLogger):
+  """
+  The audio gateway (phone) of a connected device.  Its actions are
+  asynchronous: they return a Future (see phony.base.future) of the
+  remote call, instead of blocking the main loop for the round trip.
+  """
+
   _path = None
   _hfp = None
+  _hfp_properties = None
+  _hfp_properties_read = None
   _voice_call_manager = None
-  _calls = {}
+  _calls = None
+  _call_states = None
+  _call_timeout = None
+
+  # Of the modem and its calls
+  _subscriptions = None
 
-  _on_incoming_call_listeners = []
-  _on_call_began_listeners = []
-  _on_call_ended_listeners = []
+  _on_incoming_call_listeners = None
+  _on_call_began_listeners = None
+  _on_call_ended_listeners = None
 
-  def __init__(self, path, bus):
+  def __init__(self, path, bus, call_timeout = DEFAULT_CALL_TIMEOUT):
     ClassLogger.__init__(self)
 
+    self._on_incoming_call_listeners = []
+    self._on_call_began_listeners = []
+    self._on_call_ended_listeners = []
+
     self._bus = bus
     self._path = path
+    self._call_timeout = call_timeout
+
+    self._calls = {}
+    self._call_states = {}
+    self._subscriptions = Subscriptions('OfonoHfpAg')
 
-    self._hfp = dbus.Interface(
-      self._bus.get_object(Ofono.SERVICE_NAME, self._path),
+    self._hfp = proxies.interface(
+      self._bus,
+      Ofono.SERVICE_NAME,
+      self._path,
       Ofono.HFP_INTERFACE
     )
 
-    self._voice_call_manager = dbus.Interface(
-      self._bus.get_object(Ofono.SERVICE_NAME, self._path),
+    self._voice_call_manager = proxies.interface(
+      self._bus,
+      Ofono.SERVICE_NAME,
+      self._path,
       Ofono.VOICE_CALL_MANAGER_INTERFACE
     )
 
-    self._voice_call_manager.connect_to_signal('CallAdded', self._call_added)
-    self._voice_call_manager.connect_to_signal('CallRemoved', self._call_removed)
+    self._subscriptions.connect(self._hfp, 'PropertyChanged', self._hfp_property_changed)
+    self._subscriptions.connect(self._voice_call_manager, 'CallAdded', self._call_added)
+    self._subscriptions.connect(self._voice_call_manager, 'CallRemoved', self._call_removed)
 
-    self._bus.add_signal_receiver(
+    # One receiver for every call of the modem, in place before any call
+    # is added, so a state change right after CallAdded isn't missed.
+    # The modem's path namespace is oFono's, there's no need for a
+    # bus_name (and the owner watch dbus-python adds for it).
+    self._subscriptions.add(
+      self._bus,
       self._call_properties_changed,
       dbus_interface = Ofono.VOICE_CALL_INTERFACE,
       signal_name = 'PropertyChanged',
+      path_namespace = self._path,
       path_keyword = 'path'
     )
 
-    self._show_properties()
+    # Kept up to date by PropertyChanged, Features never change.  Read
+    # without waiting, the reply is newer than any change before it.
+    self._hfp_properties = {'Features': []}
+    self._hfp_properties_read = self._call(self._hfp.GetProperties).then(self._hfp_properties_loaded)
+
+    def failed(read):
+      if read.exception() is not None:
+        self.log().warning('Unable to read HFP properties: %s' % read.exception())
+
+    self._hfp_properties_read.add_done_callback(failed)
+
+  def ready(self):
+    """Future, done once the properties are read (whether or not they could be)"""
+    return settle([self._hfp_properties_read])
+
+  def release(self):
+    """Stops following the modem, without hanging up (see dispose())"""
+    self._on_incoming_call_listeners = []
+    self._on_call_began_listeners = []
+    self._on_call_ended_listeners = []
+
+    self._subscriptions.remove_all()
 
   @ClassLogger.TraceAs.call()
-  def dispose(self):
-    try:
-      self.hangup()
+  def dispose(self, deadline = None):
+    """
+    Hangs up, unless oFono has removed the modem already (the phone
+    left).  The future of the hangup ends by `deadline`, when given.
+    """
+    self.release()
+
+    if self.removed():
+      self._calls = {}
+      self._call_states = {}
+      return Future.resolved()
 
-      self._on_incoming_call_listeners = []
-      self._on_call_began_listeners = []
-      self._on_call_ended_listeners = []
+    return self.hangup(deadline = deadline)
 
-    except Exception, ex:
-      self.log().warn(str(ex))
+  def removed(self):
+    return proxies.gone(self._bus, Ofono.SERVICE_NAME, self._path)
 
   def on_incoming_call(self, listener):
     self._on_incoming_call_listeners.append(listener)
@@ -174,42 +305,37 @@ class OfonoHfpAg(ClassLogger):
     self._on_call_ended_listeners.append(listener)
 
   def provides_voice_recognition(self):
-    return 'voice-recognition' in self._hfp.GetProperties()['Features']
+    return 'voice-recognition' in self._hfp_properties['Features']
 
   @ClassLogger.TraceAs.event()
   def answer(self, path = None):
     if not path:
-      for path,call in self._calls.iteritems():
-        properties = call.GetProperties()
-        if 'State' in properties and properties['State'] == 'incoming':
-          call.Answer()
+      return gather([self._call(self._calls[path].Answer)
+        for path in self._calls_in_state('incoming')])
     elif path in self._calls:
-      self._calls[path].Answer()
+      return self._call(self._calls[path].Answer)
     else:
       raise Exception('Call %s not found' % path)
 
   @ClassLogger.TraceAs.event()
-  def hangup(self, path = None):
+  def hangup(self, path = None, deadline = None):
     if not path:
-      self._voice_call_manager.HangupAll()
-      self._calls = {}
+      for call_path in self._calls.keys():
+        self._forget_call(call_path)
+      return self._call(self._voice_call_manager.HangupAll, deadline = deadline)
     elif path in self._calls:
-      self._calls[path].Hangup()
-      del self._calls[path]
+      call = self._forget_call(path)
+      return self._call(call.Hangup, deadline = deadline)
     else:
       raise Exception('Call %s not found' % path)
 
   @ClassLogger.TraceAs.event()
   def deflect_to_voicemail(self, path = None):
     if not path:
-      for path,call in self._calls.iteritems():
-        properties = call.GetProperties()
-        if 'State' in properties:
-          state = properties['State']
-          if state == 'incoming' or state == 'waiting':
-            call.Hangup()
+      return gather([self._call(self._calls[path].Hangup)
+        for path in self._calls_in_state('incoming', 'waiting')])
     elif path in self._calls:
-      self._calls[path].Hangup()
+      return self._call(self._calls[path].Hangup)
     else:
       raise Exception('Call %s not found' % path)
 
@@ -218,36 +344,41 @@ class OfonoHfpAg(ClassLogger):
     if not self.provides_voice_recognition():
       raise Exception('Device does not support voice recognition')
 
-    self._hfp.SetProperty('VoiceRecognition', True)
+    return self._call(self._hfp.SetProperty, 'VoiceRecognition', True)
 
   @ClassLogger.TraceAs.event()
   def end_voice_dial(self):
     if not self.provides_voice_recognition():
       raise Exception('Device does not support voice recognition')
 
-    self._hfp.SetProperty('VoiceRecognition', False)
+    return self._call(self._hfp.SetProperty, 'VoiceRecognition', False)
 
   @ClassLogger.TraceAs.event()
   def dial(self, number):
-    self._voice_call_manager.Dial(number, 'default')
+    return self._call(self._voice_call_manager.Dial, number, 'default')
+
+  def path(self):
+    return self._path
 
   def call_count(self):
     return len(self._calls)
 
   @ClassLogger.TraceAs.call()
   def _call_added(self, path, properties):
-    call = dbus.Interface(
-      self._bus.get_object(Ofono.SERVICE_NAME, path),
+    call = proxies.interface(
+      self._bus,
+      Ofono.SERVICE_NAME,
+      path,
       Ofono.VOICE_CALL_INTERFACE
     )
 
     self._calls[call.object_path] = call
 
-    properties = call.GetProperties()
-
     state = properties['State']
     number = properties['LineIdentification']
 
+    self._call_states[call.object_path] = state
+
     self.log().info('%s: %s' % (state, number))
 
     listeners = []
@@ -262,14 +393,23 @@ class OfonoHfpAg(ClassLogger):
   @ClassLogger.TraceAs.call()
   def _call_removed(self, path):
     if path in self._calls:
-      del self._calls[path]
+      self._forget_call(path)
 
       for listener in self._on_call_ended_listeners:
         listener(path)
+    else:
+      self._call_states.pop(path, None)
 
-  @ClassLogger.TraceAs.call()
+  def _forget_call(self, path):
+    self._call_states.pop(path, None)
+    return self._calls.pop(path)
+
+  @ClassLogger.TraceAs.call(rate_limit = RateLimit(per_second = 5, burst = 10))
   def _call_properties_changed(self, property, value, path = None):
     if path in self._calls:
+      if property == 'State':
+        self._call_states[path] = value
+
       if property == 'State' and value == 'incoming':
         for listener in self._on_incoming_call_listeners:
           listener(path)
@@ -277,21 +417,36 @@ class OfonoHfpAg(ClassLogger):
         for listener in self._on_call_began_listeners:
           listener(path)
 
-  def _show_properties(self):
-    properties = self._hfp.GetProperties()
+  def _hfp_property_changed(self, property, value):
+    self._hfp_properties[property] = value
 
+  def _hfp_properties_loaded(self, properties):
+    self._hfp_properties.update(properties)
+    self._show_properties()
+
+  def _calls_in_state(self, *states):
+    return [path for path, state in self._call_states.items()
+      if state in states and path in self._calls]
+
+  def _call(self, method, *args, **kwargs):
+    timeout = timeout_until(kwargs.get('deadline'), self._call_timeout)
+    return call_async(method, *args, timeout = timeout)
+
+  def _show_properties(self):
     features = ''
-    for feature in properties['Features']:
+    for feature in self._hfp_properties['Features']:
       features += feature + ' '
     self.log().info('Device HFP Features: %s' % features)
 
+  def trace_label(self):
+    return self._path
+
   def __repr__(self):
     info = 'Path: %s\n' % self._path
 
-    properties = self._hfp.GetProperties()
     features = 'Features: '
-    for feature in properties['Features']:
+    for feature in self._hfp_properties['Features']:
       features += feature + ' '
 
     info += features
-    return info
\ No newline at end of file
+    return info
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import random
+
+from phony.base.log import ClassLogger
+
+class DeviceCache(ClassLogger):
+  """
+  The devices that connected last, most recent first, kept in a small
+  JSON file so they can be called back after a restart:
+
+    {"devices": [{"address": "00:11:22:33:44:55",
+                  "path": "/org/bluez/hci0/dev_00_11_22_33_44_55",
+                  "last_connected": 1476000000.0}]}
+
+  Without a file, devices are only remembered until the process exits.
+  """
+
+  CAPACITY = 4
+
+  _file = None
+  _capacity = None
+  # address -> {'address', 'path', 'last_connected'}
+  _devices = None
+
+  def __init__(self, cache_file = None, capacity = CAPACITY):
+    ClassLogger.__init__(self)
+
+    self._file = cache_file
+    self._capacity = capacity
+    self._devices = {}
+
+    self.load()
+
+  def load(self):
+    self._devices = {}
+
+    if not self._file or not os.path.isfile(self._file):
+      return
+
+    try:
+      with open(self._file) as cache:
+        for entry in json.load(cache)['devices']:
+          self._devices[str(entry['address']).upper()] = {
+            'address': str(entry['address']).upper(),
+            'path': str(entry['path']),
+            'last_connected': float(entry['last_connected'])
+          }
+    except Exception, ex:
+      self.log().warning('Ignoring unreadable device cache %s: %s' % (self._file, ex))
+      self._devices = {}
+
+    self._trim()
+
+  def save(self):
+    if not self._file:
+      return
+
+    # Replaced in one rename, so a power cut leaves the old or new cache
+    partial = self._file + '.partial'
+
+    try:
+      directory = os.path.dirname(self._file)
+      if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+      with open(partial, 'w') as cache:
+        json.dump({'devices': self.devices()}, cache, indent = 2)
+        cache.flush()
+        os.fsync(cache.fileno())
+
+      os.rename(partial, self._file)
+      self._sync_directory(directory or '.')
+    except Exception, ex:
+      self.log().warning('Unable to save device cache %s: %s' % (self._file, ex))
+
+  def remember(self, address, path, when = None):
+    """
+    The file is only written when the order or a path changes, not for
+    the most recent device connecting again: its last_connected there
+    may be older than in memory.
+    """
+    address = str(address).upper()
+
+    previous = self._devices.get(address)
+    unchanged = previous is not None and previous['path'] == str(path) \
+      and self.devices()[0] is previous
+
+    self._devices[address] = {
+      'address': address,
+      'path': str(path),
+      'last_connected': when if when is not None else time.time()
+    }
+
+    self._trim()
+
+    if not unchanged:
+      self.save()
+
+  def forget(self, address):
+    if self._devices.pop(str(address).upper(), None):
+      self.save()
+
+  def devices(self):
+    """Entries, most recently connected first"""
+    return sorted(self._devices.values(), key = lambda entry: entry['last_connected'], reverse = True)
+
+  def addresses(self):
+    return [entry['address'] for entry in self.devices()]
+
+  def __len__(self):
+    return len(self._devices)
+
+  def __contains__(self, address):
+    return str(address).upper() in self._devices
+
+  @staticmethod
+  def _sync_directory(directory):
+    # Makes the rename itself durable
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+      os.fsync(descriptor)
+    finally:
+      os.close(descriptor)
+
+  def _trim(self):
+    for entry in self.devices()[self._capacity:]:
+      del self._devices[entry['address']]
+
+class Backoff(object):
+  """
+  Exponentially growing delays, each shortened by up to `jitter` of
+  itself at random, so that retries don't fall into step with whatever
+  they are waiting on.
+  """
+
+  INITIAL = 2.0
+  MAXIMUM = 60.0
+  FACTOR = 2.0
+  JITTER = 0.5
+
+  _initial = None
+  _maximum = None
+  _factor = None
+  _jitter = None
+  _random = None
+  _attempts = 0
+
+  def __init__(self, initial = INITIAL, maximum = MAXIMUM, factor = FACTOR, jitter = JITTER, random = random.random):
+    self._initial = initial
+    self._maximum = maximum
+    self._factor = factor
+    self._jitter = jitter
+    self._random = random
+
+  def next(self):
+    """Seconds to wait before the next attempt"""
+    # Capped, so that the power can't overflow
+    exponent = min(self._attempts, 32)
+    delay = min(self._maximum, self._initial * self._factor ** exponent)
+    self._attempts += 1
+    return delay * (1 - self._jitter * self._random())
+
+  def attempts(self):
+    return self._attempts
+
+  def reset(self):
+    self._attempts = 0
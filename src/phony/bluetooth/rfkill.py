@@ -0,0 +1,184 @@
+import os
+import errno
+import struct
+
+from phony.base.log import ClassLogger
+
+try:
+  import gobject
+except ImportError:
+  # Tests feed events to _readable() themselves
+  gobject = None
+
+# linux/rfkill.h
+TYPE_ALL = 0
+TYPE_WLAN = 1
+TYPE_BLUETOOTH = 2
+
+OP_ADD = 0
+OP_DEL = 1
+OP_CHANGE = 2
+OP_CHANGE_ALL = 3
+
+class RfkillEvent(object):
+  """struct rfkill_event: idx (u32), type, op, soft, hard (u8)"""
+
+  FORMAT = '=IBBBB'
+  SIZE = struct.calcsize(FORMAT)
+
+  __slots__ = ('index', 'type', 'op', 'soft', 'hard')
+
+  def __init__(self, index, type, op, soft, hard):
+    self.index = index
+    self.type = type
+    self.op = op
+    self.soft = bool(soft)
+    self.hard = bool(hard)
+
+  def encode(self):
+    return struct.pack(self.FORMAT, self.index, self.type, self.op, self.soft, self.hard)
+
+  @staticmethod
+  def decode(data):
+    # Newer kernels append fields, the first SIZE bytes are the same
+    return RfkillEvent(*struct.unpack(RfkillEvent.FORMAT, data[:RfkillEvent.SIZE]))
+
+  def __repr__(self):
+    return 'RfkillEvent(%d, type %d, op %d, soft %s, hard %s)' % \
+      (self.index, self.type, self.op, self.soft, self.hard)
+
+class Rfkill(ClassLogger):
+  """
+  Blocks and unblocks a type of radio through /dev/rfkill, without
+  running rfkill(8).  The kernel reports every rfkill device when the
+  device is opened, and every change after that; changes made by anyone
+  else are passed to on_change() listeners from the main loop.
+
+    with Rfkill() as radio:
+      if radio.hard_blocked():
+        ...
+      radio.unblock()
+  """
+
+  DEVICE = '/dev/rfkill'
+
+  _device = None
+  _type = None
+  _fd = None
+  _owns_fd = False
+  _watch = None
+
+  # index -> last RfkillEvent of each device of our type
+  _devices = None
+  _on_change_listeners = None
+
+  def __init__(self, device = DEVICE, rfkill_type = TYPE_BLUETOOTH):
+    """`device` is a path, or an open file descriptor"""
+    ClassLogger.__init__(self)
+
+    self._device = device
+    self._type = rfkill_type
+    self._devices = {}
+    self._on_change_listeners = []
+
+  def __enter__(self):
+    self.open()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  @ClassLogger.TraceAs.call()
+  def open(self):
+    if self._fd is not None:
+      return
+
+    if isinstance(self._device, basestring):
+      self._fd = os.open(self._device, os.O_RDWR | os.O_NONBLOCK)
+      self._owns_fd = True
+    else:
+      self._fd = self._device
+      self._owns_fd = False
+
+    self._readable()
+
+    if gobject:
+      self._watch = gobject.io_add_watch(self._fd, gobject.IO_IN, lambda fd, condition: self._readable())
+
+  @ClassLogger.TraceAs.call()
+  def close(self):
+    if self._watch is not None:
+      gobject.source_remove(self._watch)
+      self._watch = None
+
+    if self._fd is not None and self._owns_fd:
+      os.close(self._fd)
+
+    self._fd = None
+
+  def on_change(self, listener):
+    """listener(soft_blocked, hard_blocked), when either changes"""
+    self._on_change_listeners.append(listener)
+
+  @ClassLogger.TraceAs.call()
+  def block(self):
+    self._change_all(True)
+
+  @ClassLogger.TraceAs.call()
+  def unblock(self):
+    self._change_all(False)
+
+  def soft_blocked(self):
+    return any(event.soft for event in self._devices.values())
+
+  def hard_blocked(self):
+    return any(event.hard for event in self._devices.values())
+
+  def blocked(self):
+    return self.soft_blocked() or self.hard_blocked()
+
+  def device_count(self):
+    return len(self._devices)
+
+  def _change_all(self, soft):
+    os.write(self._fd, RfkillEvent(0, self._type, OP_CHANGE_ALL, soft, False).encode())
+
+  def _readable(self):
+    while True:
+      try:
+        data = os.read(self._fd, RfkillEvent.SIZE)
+      except OSError, ex:
+        if ex.errno == errno.EINTR:
+          continue
+        if ex.errno != errno.EAGAIN:
+          self.log().error('Unable to read rfkill events: %s' % ex)
+        return True
+
+      if not data:
+        self.log().warning('%s was closed' % self._device)
+        self._watch = None
+        return False
+
+      if len(data) < RfkillEvent.SIZE:
+        return True
+
+      self._event(RfkillEvent.decode(data))
+
+  def _event(self, event):
+    if event.type != self._type:
+      return
+
+    before = (self.soft_blocked(), self.hard_blocked())
+
+    if event.op == OP_DEL:
+      self._devices.pop(event.index, None)
+    elif event.op in (OP_ADD, OP_CHANGE):
+      self._devices[event.index] = event
+
+    after = (self.soft_blocked(), self.hard_blocked())
+
+    if after != before:
+      self.log().info('Radio soft blocked: %s, hard blocked: %s' % after)
+
+      for listener in self._on_change_listeners:
+        listener(*after)
@@ -1,7 +1,11 @@
 import time
 
 from phony.base import execute
+from phony.base.clock import monotonic
+from phony.base.future import Future, settle
 from phony.base.log import ClassLogger, ScopedLogger, Levels
+from phony.base.tasks import wait_for
+from phony.bluetooth.rfkill import Rfkill
 
 class HandsFreeHeadset(ClassLogger):
   """
@@ -11,9 +15,21 @@ class HandsFreeHeadset(ClassLogger):
   device is managed according to whether or not the 'headset'
   is in or initiating a call.  At all other times the audio
   will be muted.
+
+  Call actions don't wait for the phone: they return a Future of the
+  remote call, failures are logged (and the audio muted again).
   """
 
+  # Seconds the adapter waits for bluetooth to be unblocked, at most
+  ENABLE_TIMEOUT = 5.0
+
+  # Seconds reset() and stop() give the phone to hang up and disconnect
+  TEARDOWN_TIMEOUT = 2.0
+
   _started = False
+  # Future of start(), done once the adapter is ready
+  _starting = None
+  _bus_provider = None
   _bus = None
 
   _adapter = None
@@ -23,14 +39,32 @@ class HandsFreeHeadset(ClassLogger):
   _device = None
   _hfp_audio_gateway = None
 
-  _on_incoming_call_listeners = []
-  _on_call_began_listeners = []
-  _on_call_ended_listeners = []
-  _on_device_connected_listeners = []
+  # None when /dev/rfkill isn't usable, rfkill(8) is run instead
+  _rfkill = None
+
+  _on_incoming_call_listeners = None
+  _on_call_began_listeners = None
+  _on_call_ended_listeners = None
+  _on_device_connected_listeners = None
+  _on_radio_changed_listeners = None
+
+  # Futures of wait_for_audio_gateway() and wait_for_call_end()
+  _audio_gateway_waiters = None
+  _call_end_waiters = None
 
   def __init__(self, bus_provider, adapter, hfp, audio):
     ClassLogger.__init__(self)
 
+    self._audio_gateway_waiters = []
+    self._call_end_waiters = []
+
+    self._on_incoming_call_listeners = []
+    self._on_call_began_listeners = []
+    self._on_call_ended_listeners = []
+    self._on_device_connected_listeners = []
+    self._on_radio_changed_listeners = []
+
+    self._bus_provider = bus_provider
     self._bus = bus_provider.session_bus()
 
     self._adapter = adapter
@@ -45,45 +79,69 @@ class HandsFreeHeadset(ClassLogger):
 
   def __exit__(self, exc_type, exc_value, traceback):
     self.stop()
+    self._bus_provider.release(self._bus)
+    self._bus = None
 
   @ClassLogger.TraceAs.call(log_level = Levels.INFO, with_arguments = False)
   def start(self, name, pincode):
     if self._started:
       return
 
-    self.enable()
+    self._open_rfkill()
 
     self._audio.start()
     self.mute_microphone()
     self.mute_speaker()
 
     self._hfp.start()
-    self._adapter.start(name, pincode)
+
+    def start_adapter(ignored):
+      if self._started:
+        return self._adapter.start(name, pincode)
+
+    # The adapter can't be powered while bluetooth is blocked, it's
+    # started once unblocked, or once unblocking failed or timed out
+    enabled = settle([wait_for(self.enable(), self.ENABLE_TIMEOUT)])
+    self._starting = self._report_failure(enabled.then(start_adapter), 'bring up the adapter')
 
     self._started = True
+    return self._starting
 
   @ClassLogger.TraceAs.call(log_level = Levels.INFO)
   def stop(self):
     if self._started:
-      self._adapter.stop()
+      deadline = monotonic() + self.TEARDOWN_TIMEOUT
+
+      self.reset(deadline)
+      self._adapter.stop(deadline)
       self._hfp.stop()
-      self.reset()
+
+      if self._rfkill:
+        self._rfkill.close()
+        self._rfkill = None
 
       self._started = False
+      self._starting = None
 
   @ClassLogger.TraceAs.call(log_level = Levels.INFO)
   def enable(self):
-    try:
-      self._exec("rfkill unblock bluetooth")
-    except Exception, ex:
-      self.log().debug('Unable to unblock bluetooth with rfkill: %s' % ex)
+    if not self._rfkill:
+      return self._privileged('rfkill', 'unblock', 'bluetooth')
+
+    self._rfkill.unblock()
+
+    if self._rfkill.hard_blocked():
+      self.log().warning('Bluetooth is hard blocked (i.e. by a switch), it cannot be unblocked')
+
+    return Future.resolved()
 
   @ClassLogger.TraceAs.call(log_level = Levels.INFO)
   def disable(self):
-    try:
-      self._exec("rfkill block bluetooth")
-    except:
-      pass
+    if not self._rfkill:
+      return self._privileged('rfkill', 'block', 'bluetooth')
+
+    self._rfkill.block()
+    return Future.resolved()
 
   def on_incoming_call(self, listener):
     self._on_incoming_call_listeners.append(listener)
@@ -97,19 +155,54 @@ class HandsFreeHeadset(ClassLogger):
   def on_device_connected(self, listener):
     self._on_device_connected_listeners.append(listener)
 
+  def on_radio_changed(self, listener):
+    """listener(soft_blocked, hard_blocked), including blocks by others"""
+    self._on_radio_changed_listeners.append(listener)
+
+  def reconnect_stats(self):
+    """How the adapter is doing calling back known phones"""
+    return self._adapter.reconnect_stats()
+
+  def wait_for_audio_gateway(self):
+    """Future of the audio gateway, once a device with one connects"""
+    if self._hfp_audio_gateway:
+      return Future.resolved(self._hfp_audio_gateway)
+
+    future = Future()
+    self._audio_gateway_waiters.append(future)
+    return future
+
+  def wait_for_call_end(self, path = None):
+    """Future of the path of the next call (or of `path`) to end"""
+    future = Future()
+    self._call_end_waiters.append((path, future))
+    return future
+
   @ClassLogger.TraceAs.call(log_level = Levels.INFO)
   def enable_pairability(self, timeout = 0):
-    self._adapter.enable_pairability(timeout)
+    def enable(ignored):
+      return self._adapter.enable_pairability(timeout)
+
+    # After start(), the adapter isn't started until bluetooth is unblocked
+    enabled = self._starting.then(enable) if self._starting else enable(None)
+    return self._report_failure(enabled, 'enable pairability')
 
   @ClassLogger.TraceAs.call(log_level = Levels.INFO)
   def disable_pairability(self):
-    self._adapter.disable_pairability()
+    return self._report_failure(
+      self._adapter.disable_pairability(),
+      'disable pairability'
+    )
 
   @ClassLogger.TraceAs.call(log_level = Levels.INFO)
   def initiate_call(self):
     if self._hfp_audio_gateway:
       self._call_prologue()
-      self._hfp_audio_gateway.begin_voice_dial()
+      return self._report_failure(
+        self._hfp_audio_gateway.begin_voice_dial(),
+        'initiate call',
+        self._call_epilogue
+      )
     else:
       self._call_epilogue()
       raise Exception('No audio gateway is connected')
@@ -117,17 +210,22 @@ class HandsFreeHeadset(ClassLogger):
   @ClassLogger.TraceAs.call(log_level = Levels.INFO)
   def cancel_call_initiation(self):
     if self._hfp_audio_gateway:
-      self._hfp_audio_gateway.end_voice_dial()
+      future = self._hfp_audio_gateway.end_voice_dial()
     else:
       raise Exception('No audio gateway is connected')
 
     self._call_epilogue()
+    return self._report_failure(future, 'cancel call initiation')
 
   @ClassLogger.TraceAs.call(log_level = Levels.INFO)
   def dial(self, number):
     if self._hfp_audio_gateway:
       self._call_prologue()
-      self._hfp_audio_gateway.dial(number)
+      return self._report_failure(
+        self._hfp_audio_gateway.dial(number),
+        'dial',
+        self._call_epilogue
+      )
     else:
       self._call_epilogue()
       raise Exception('No audio gateway is connected')
@@ -136,7 +234,11 @@ class HandsFreeHeadset(ClassLogger):
   def answer_call(self, path = None):
     if self._hfp_audio_gateway:
       self._call_prologue()
-      self._hfp_audio_gateway.answer(path)
+      return self._report_failure(
+        self._hfp_audio_gateway.answer(path),
+        'answer call',
+        self._call_epilogue
+      )
     else:
       self._call_epilogue()
       raise Exception('No audio gateway is connected')
@@ -144,16 +246,20 @@ class HandsFreeHeadset(ClassLogger):
   @ClassLogger.TraceAs.call(log_level = Levels.INFO)
   def hangup_call(self, path = None):
     if self._hfp_audio_gateway:
-      self._hfp_audio_gateway.hangup(path)
+      future = self._hfp_audio_gateway.hangup(path)
     else:
       raise Exception('No audio gateway is connected')
 
     self._call_epilogue()
+    return self._report_failure(future, 'hang up')
 
   @ClassLogger.TraceAs.call(log_level = Levels.INFO)
   def deflect_call_to_voicemail(self, path = None):
     if self._hfp_audio_gateway:
-      self._hfp_audio_gateway.deflect_to_voicemail(path)
+      return self._report_failure(
+        self._hfp_audio_gateway.deflect_to_voicemail(path),
+        'deflect call to voicemail'
+      )
     else:
       raise Exception('No audio gateway is connected')
 
@@ -186,22 +292,34 @@ class HandsFreeHeadset(ClassLogger):
     self._audio.set_speaker_volume(volume)
 
   @ClassLogger.TraceAs.call(log_level = Levels.INFO)
-  def reset(self):
+  def reset(self, deadline = None):
+    """
+    Lets go of the device and its audio gateway.  Their teardown calls are
+    made concurrently, and end by `deadline` (TEARDOWN_TIMEOUT from now by
+    default); the returned future completes once they all have.
+    """
+    if deadline is None:
+      deadline = monotonic() + self.TEARDOWN_TIMEOUT
+
+    disposing = []
+
     try:
       self.mute_microphone()
       self._adapter.cancel_pending_operations()
       self._hfp.cancel_pending_operations()
 
       if self._hfp_audio_gateway:
-        self._hfp_audio_gateway.dispose()
+        disposing.append(self._hfp_audio_gateway.dispose(deadline))
         self._hfp_audio_gateway = None
 
       if self._device:
-        self._device.dispose()
+        disposing.append(self._device.dispose(deadline))
         self._device = None
     except Exception, ex:
       self.log().warn('Reset error: %s' % ex)
 
+    return settle(disposing)
+
   @ClassLogger.TraceAs.event(log_level = Levels.INFO)
   def get_status(self):
     status = {}
@@ -220,6 +338,22 @@ class HandsFreeHeadset(ClassLogger):
 
     return status
 
+  def state(self):
+    """
+    Like get_status(), without D-Bus calls or tracing: cheap enough to
+    be polled by monitoring scripts.
+    """
+    gateway = self._hfp_audio_gateway
+
+    return {
+      'started': self._started,
+      'device': self._device.path() if self._device else None,
+      'audio_gateway': gateway.path() if gateway else None,
+      'calls': gateway.call_count() if gateway else 0,
+      'radio_blocked': self._rfkill.blocked() if self._rfkill else None,
+      'adapter_startup': self._adapter.startup_times()
+    }
+
   #
   # Bluetooth adapter event callbacks
   #
@@ -252,16 +386,29 @@ class HandsFreeHeadset(ClassLogger):
   def _audio_gateway_attached(self, audio_gateway):
     if audio_gateway.provides_voice_recognition():
       self._hfp_audio_gateway = audio_gateway
+      self._adapter.stop_reconnecting()
       audio_gateway.on_incoming_call(self._incoming_call)
       audio_gateway.on_call_begin(self._call_began)
       audio_gateway.on_call_end(self._call_ended)
 
       for listener in self._on_device_connected_listeners:
         listener()
+
+      waiters, self._audio_gateway_waiters = self._audio_gateway_waiters, []
+      for future in waiters:
+        future.set_result(audio_gateway)
     else:
       self.log().error('Device %s does not provide voice dialing. Disconnecting...')
       self.reset()
 
+  @ClassLogger.TraceAs.event(log_level = Levels.INFO)
+  def _radio_changed(self, soft_blocked, hard_blocked):
+    if self._started and (soft_blocked or hard_blocked):
+      self.log().warning('Bluetooth was blocked by someone else')
+
+    for listener in self._on_radio_changed_listeners:
+      listener(soft_blocked, hard_blocked)
+
   #
   # Audio gateway event handlers:
   #
@@ -281,6 +428,13 @@ class HandsFreeHeadset(ClassLogger):
     for listener in self._on_call_ended_listeners:
       listener(path)
 
+    waiters = self._call_end_waiters
+    self._call_end_waiters = [(p, f) for p, f in waiters if p and p != path and not f.done()]
+
+    for waiting_for, future in waiters:
+      if not waiting_for or waiting_for == path:
+        future.set_result(path)
+
   #
   # Private methods
   #
@@ -293,6 +447,34 @@ class HandsFreeHeadset(ClassLogger):
     self.mute_speaker()
     self.mute_microphone()
 
-  def _exec(self, command):
-    self.log().debug('Running: ' + command)
-    execute.privileged(command, shell = True)
\ No newline at end of file
+  def _report_failure(self, future, action, recover = None):
+    def done(future):
+      if future.exception() is not None:
+        self.log().error('Unable to %s: %s' % (action, future.exception()))
+        if recover:
+          recover()
+
+    future.add_done_callback(done)
+    return future
+
+  def _open_rfkill(self):
+    rfkill = Rfkill()
+
+    try:
+      rfkill.open()
+    except OSError, ex:
+      self.log().info('Unable to open %s, using rfkill(8): %s' % (Rfkill.DEVICE, ex))
+      return
+
+    rfkill.on_change(self._radio_changed)
+    self._rfkill = rfkill
+
+  def _privileged(self, *argv):
+    future = execute.helper.run(*argv)
+
+    def done(future):
+      if future.exception() is not None:
+        self.log().debug('Unable to run %s: %s' % (' '.join(argv), future.exception()))
+
+    future.add_done_callback(done)
+    return future
@@ -1,8 +1,11 @@
 import time
 import copy
 import gobject
+import threading
 
+from phony.base.future import Future
 from phony.base.log import ClassLogger
+from phony.base.tasks import call_soon_threadsafe
 from RPi import GPIO
 from types import MethodType
 
@@ -14,9 +17,16 @@ class Inputs(ClassLogger):
   _falling_callback_by_channel_name = {}
   _pulse_callback_by_channel_name = {}
 
+  # (channel name, level) -> futures of wait_for_edge()
+  _edge_waiters = None
+  _edge_waiters_lock = None
+
   def __init__(self, layout):
     ClassLogger.__init__(self)
 
+    self._edge_waiters = {}
+    self._edge_waiters_lock = threading.Lock()
+
     # IO event callbacks occur in another thread, dbus/gdk need
     # to be made aware of this.
     gobject.threads_init()
@@ -43,6 +53,16 @@ class Inputs(ClassLogger):
   def on_pulse(self, channel_name, callback):
     self._pulse_callback_by_channel_name[channel_name] = callback
 
+  def wait_for_edge(self, channel_name, rising = True):
+    """
+    Future that completes, on the main loop, at the channel's next rising
+    (or falling) edge.
+    """
+    future = Future()
+    with self._edge_waiters_lock:
+      self._edge_waiters.setdefault((channel_name, bool(rising)), []).append(future)
+    return future
+
   #@ClassLogger.TraceAs.call()
   def _channel_changed(self, channel):
     name = self._inputs_by_channel[channel]['name']
@@ -50,7 +70,10 @@ class Inputs(ClassLogger):
     do_rise = name in self._rising_callback_by_channel_name
     do_fall = name in self._falling_callback_by_channel_name
 
-    if do_rise or do_fall:
+    with self._edge_waiters_lock:
+      waiting = (name, True) in self._edge_waiters or (name, False) in self._edge_waiters
+
+    if do_rise or do_fall or waiting:
       time.sleep(0.01)
 
       if GPIO.input(channel):
@@ -64,6 +87,13 @@ class Inputs(ClassLogger):
       if not high and do_fall:
         self._falling_callback_by_channel_name[name]()
 
+      if waiting:
+        with self._edge_waiters_lock:
+          waiters = self._edge_waiters.pop((name, bool(high)), [])
+
+        for future in waiters:
+          call_soon_threadsafe(future, name)
+
     if name in self._pulse_callback_by_channel_name:
       self._pulse_callback_by_channel_name[name]()
 
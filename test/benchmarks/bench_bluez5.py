@@ -0,0 +1,65 @@
+from phony.bluetooth.adapters.bluez5 import Bluez5Mirror, Bluez5Utils
+
+DEVICES_PER_ADAPTER = 250
+
+class RemoteObject(object):
+  def __init__(self, path):
+    self.object_path = path
+
+class Bus(object):
+  def get_object(self, service, path, *args, **kwargs):
+    return RemoteObject(path)
+
+  def add_signal_receiver(self, *args, **kwargs):
+    pass
+
+def managed_objects():
+  objects = {'/org/bluez': {'org.bluez.AgentManager1': {}}}
+
+  for hci in range(0, 2):
+    adapter_path = '/org/bluez/hci%d' % hci
+    objects[adapter_path] = {
+      Bluez5Utils.ADAPTER_INTERFACE: {'Address': '00:1A:7D:DA:71:%02X' % hci}
+    }
+
+    for i in range(0, DEVICES_PER_ADAPTER):
+      address = '00:11:22:33:%02X:%02X' % (i >> 8, i & 0xff)
+      objects['%s/dev_%s' % (adapter_path, address.replace(':', '_'))] = {
+        Bluez5Utils.DEVICE_INTERFACE: {'Address': address, 'Connected': False, 'Paired': True},
+        Bluez5Utils.PROPERTIES_INTERFACE: {}
+      }
+
+  return objects
+
+def bench_get_child_devices_in_objects():
+  objects = managed_objects()
+  bus = Bus()
+  return lambda: Bluez5Utils.get_child_devices_in_objects(objects, 'hci1', bus)
+
+def bench_find_adapter_in_objects():
+  objects = managed_objects()
+  bus = Bus()
+  return lambda: Bluez5Utils.find_adapter_in_objects(objects, '00:1A:7D:DA:71:01', bus)
+
+def bench_find_device_in_objects():
+  objects = managed_objects()
+  bus = Bus()
+  return lambda: Bluez5Utils.find_device_in_objects(objects, '00:11:22:33:00:F0', 'hci1', bus)
+
+def mirror():
+  mirrored = Bluez5Mirror(Bus())
+  mirrored.load(managed_objects())
+  return mirrored
+
+def bench_mirror_find_adapter():
+  mirrored = mirror()
+  return lambda: mirrored.find_adapter('00:1A:7D:DA:71:01')
+
+def bench_mirror_find_device():
+  mirrored = mirror()
+  return lambda: mirrored.find_device('00:11:22:33:00:F0', '/org/bluez/hci1')
+
+def bench_mirror_properties_changed():
+  mirrored = mirror()
+  path = '/org/bluez/hci1/dev_00_11_22_33_00_F0'
+  return lambda: mirrored._properties_changed(Bluez5Utils.DEVICE_INTERFACE, {'RSSI': -60}, [], path)
@@ -0,0 +1,31 @@
+from phony.headset import HandsFreeHeadset
+
+class BusProvider(object):
+  def session_bus(self):
+    return None
+
+class Adapter(object):
+  def on_device_connected(self, listener):
+    pass
+
+  def on_device_disconnected(self, listener):
+    pass
+
+LISTENERS = 4
+
+def headset():
+  hs = HandsFreeHeadset(BusProvider(), Adapter(), None, None)
+
+  for i in range(0, LISTENERS):
+    hs.on_incoming_call(lambda path: None)
+    hs.on_call_began(lambda path: None)
+
+  return hs
+
+def bench_incoming_call_dispatch():
+  hs = headset()
+  return lambda: hs._incoming_call('/hfp/org/bluez/hci0/dev_00_11_22_33_44_55/voicecall01')
+
+def bench_call_began_dispatch():
+  hs = headset()
+  return lambda: hs._call_began('/hfp/org/bluez/hci0/dev_00_11_22_33_44_55/voicecall01')
@@ -0,0 +1,58 @@
+import logging
+
+from phony.examples.cranky.hmi import HandCrankTelephoneControls
+
+class Inputs(object):
+  def on_rising_edge(self, name, callback):
+    pass
+
+  def on_falling_edge(self, name, callback):
+    pass
+
+  def on_pulse(self, name, callback):
+    pass
+
+class Ringer(object):
+  def start_ringing(self):
+    pass
+
+  def stop_ringing(self):
+    pass
+
+  def short_ring(self):
+    pass
+
+class Headset(object):
+  def __getattr__(self, name):
+    return lambda *args: None
+
+def controls():
+  controls = HandCrankTelephoneControls(Inputs(), Ringer(), Headset())
+  logging.getLogger(controls.log_name()).setLevel(logging.WARNING)
+  return controls
+
+def bench_outgoing_call_cycle():
+  hmi = controls()
+
+  def cycle():
+    hmi._swich_hook_high()
+    for i in range(0, HandCrankTelephoneControls.MAGNETO_PULSES_TO_INTITATE_CALL):
+      hmi._magneto_pulsed()
+    hmi._call_began(None)
+    hmi._switch_hook_low()
+
+  return cycle
+
+def bench_incoming_call_cycle():
+  hmi = controls()
+
+  def cycle():
+    hmi._incoming_call(None)
+    hmi._swich_hook_high()
+    hmi._switch_hook_low()
+
+  return cycle
+
+def bench_ignored_magneto_pulse():
+  hmi = controls()
+  return hmi._magneto_pulsed
@@ -0,0 +1,23 @@
+from phony.base import ipc
+from phony.base.stats import CallStats
+
+def reply(*args, **kwargs):
+  return {'Address': '00:11:22:33:44:55', 'Connected': True}
+
+def method():
+  return ipc.InstrumentedMethod(reply, 'org.bluez', 'org.freedesktop.DBus.Properties', 'Get')
+
+def bench_call_without_stats():
+  ipc.collect_call_stats(None)
+  get = method()
+  return lambda: get('org.bluez.Device1', 'Connected')
+
+def bench_call_with_stats():
+  ipc.collect_call_stats(CallStats())
+  get = method()
+  return lambda: get('org.bluez.Device1', 'Connected')
+
+def bench_signal_handler_with_stats():
+  ipc.collect_call_stats(CallStats())
+  handler = ipc.instrumented_handler(lambda *args: None, 'org.ofono.VoiceCall', 'PropertyChanged')
+  return lambda: handler('State', 'active')
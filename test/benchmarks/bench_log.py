@@ -0,0 +1,62 @@
+import logging
+
+from phony.base import log
+from phony.base.log import ClassLogger, Levels
+
+class Subject(ClassLogger):
+  def __init__(self, level):
+    ClassLogger.__init__(self)
+
+    logger = logging.getLogger(self.log_name())
+    logger.handlers = [logging.NullHandler()]
+    logger.propagate = False
+    logger.setLevel(level)
+
+  @ClassLogger.TraceAs.call()
+  def call(self, path, properties):
+    pass
+
+  @ClassLogger.TraceAs.event()
+  def event(self, path, properties):
+    pass
+
+  def implicit_event(self, path, properties):
+    self.log().event()
+
+  def plain(self, path, properties):
+    pass
+
+PATH = '/org/bluez/hci0/dev_00_11_22_33_44_55'
+PROPERTIES = {'State': 'incoming', 'LineIdentification': '+15555550100'}
+
+def bench_untraced_method():
+  subject = Subject(Levels.WARNING)
+  return lambda: subject.plain(PATH, PROPERTIES)
+
+def bench_TraceAs_call_disabled():
+  subject = Subject(Levels.WARNING)
+  return lambda: subject.call(PATH, PROPERTIES)
+
+def bench_TraceAs_call_enabled():
+  subject = Subject(Levels.DEBUG)
+  return lambda: subject.call(PATH, PROPERTIES)
+
+def bench_TraceAs_event_disabled():
+  subject = Subject(Levels.WARNING)
+  return lambda: subject.event(PATH, PROPERTIES)
+
+def bench_TraceAs_event_enabled():
+  subject = Subject(Levels.DEBUG)
+  return lambda: subject.event(PATH, PROPERTIES)
+
+def bench_implicit_event_enabled():
+  subject = Subject(Levels.DEBUG)
+  return lambda: subject.implicit_event(PATH, PROPERTIES)
+
+def bench_pretty_args():
+  class Device(object):
+    def trace_label(self):
+      return PATH
+
+  args = [Device(), PATH, PROPERTIES, 42, object()]
+  return lambda: log.pretty_args(args, log.MAXIMUM_TRACE_WIDTH)
@@ -0,0 +1,50 @@
+from phony.bluetooth.profiles.handsfree.ofono import Ofono
+
+MODEMS = 64
+
+class Adapter(object):
+  def hci_id(self):
+    return 'hci1'
+
+class Device(object):
+  def address(self):
+    return '00:11:22:33:44:3F'
+
+def modem_paths():
+  paths = []
+  for hci in range(0, 2):
+    for i in range(0, MODEMS / 2):
+      paths.append('/hfp/org/bluez/hci%d/dev_00_11_22_33_44_%02X' % (hci, i))
+  return paths
+
+def bench_is_child_of():
+  adapter = Adapter()
+  paths = modem_paths()
+
+  def match():
+    for path in paths:
+      Ofono._is_child_of(adapter, path)
+
+  return match
+
+def bench_is_bound_to():
+  device = Device()
+  paths = modem_paths()
+
+  def match():
+    for path in paths:
+      Ofono._is_bound_to(device, path)
+
+  return match
+
+def bench_find_child_modem():
+  adapter = Adapter()
+  device = Device()
+  paths = modem_paths()
+
+  def find():
+    for path in paths:
+      if Ofono._is_child_of(adapter, path) and Ofono._is_bound_to(device, path):
+        return path
+
+  return find
@@ -0,0 +1,114 @@
+"""
+Startup time, connection count and daemon side match rules of cranky's
+bus wiring: Bluez5, Ofono, PulseAudio, HandsFreeHeadset and
+DbusDebugInterface each asking the BusProvider for a bus, and Bluez5 and
+OfonoHfpAg registering their signal receivers.  Compares the pooled
+BusProvider against the previous one, which opened a new connection (and
+DBusGMainLoop) for every component.
+
+Needs a running bus, run it inside a throwaway session bus:
+
+  $ PYTHONPATH=src dbus-run-session -- python test/benchmarks/bus_connections.py
+
+Match rules are read from org.freedesktop.DBus.Debug.Stats, which only
+exists when dbus-daemon was built with --enable-stats.
+"""
+
+import os
+import sys
+import time
+import dbus
+
+from dbus.mainloop.glib import DBusGMainLoop
+from phony.base.ipc import BusProvider
+
+ROUNDS = 20
+
+COMPONENTS = ['Bluez5', 'Ofono', 'PulseAudio', 'HandsFreeHeadset', 'DbusDebugInterface']
+
+SIGNALS = {
+  'Bluez5': [
+    ('org.freedesktop.DBus.Properties', 'PropertiesChanged'),
+    ('org.freedesktop.DBus.ObjectManager', 'InterfacesAdded'),
+    ('org.freedesktop.DBus.ObjectManager', 'InterfacesRemoved')
+  ],
+  'Ofono': [
+    ('org.ofono.VoiceCallManager', 'CallAdded'),
+    ('org.ofono.VoiceCallManager', 'CallRemoved'),
+    ('org.ofono.VoiceCall', 'PropertyChanged')
+  ]
+}
+
+class LegacyBusProvider:
+  # What BusProvider.session_bus() used to do, kept here as a reference point
+  def __init__(self, path):
+    self.path = path
+
+  def session_bus(self, dedicated = False):
+    return dbus.bus.BusConnection(self.path, mainloop = DBusGMainLoop())
+
+  def release(self, bus):
+    bus.close()
+
+def ignore(*args):
+  pass
+
+def wire(provider):
+  buses = []
+  for component in COMPONENTS:
+    bus = provider.session_bus()
+    for interface, signal in SIGNALS.get(component, []):
+      bus.add_signal_receiver(ignore, dbus_interface = interface, signal_name = signal)
+    buses.append(bus)
+  return buses
+
+def match_rules(observer, buses):
+  stats = dbus.Interface(
+    observer.get_object('org.freedesktop.DBus', '/org/freedesktop/DBus'),
+    'org.freedesktop.DBus.Debug.Stats'
+  )
+
+  try:
+    unique_names = set([bus.get_unique_name() for bus in buses])
+    return sum([int(stats.GetConnectionStats(name).get('MatchRules', 0)) for name in unique_names])
+  except dbus.exceptions.DBusException:
+    return None
+
+def run(name, provider, observer):
+  elapsed = 0
+  rules = None
+  connections = 0
+
+  for i in range(0, ROUNDS):
+    started = time.time()
+    buses = wire(provider)
+    elapsed += time.time() - started
+
+    connections = len(set([bus.get_unique_name() for bus in buses]))
+    rules = match_rules(observer, buses)
+
+    for bus in buses:
+      provider.release(bus)
+
+  print '%-8s %8.2f ms startup  %d connection(s)  %s match rule(s)' % (
+    name,
+    elapsed / ROUNDS * 1000,
+    connections,
+    'n/a' if rules is None else rules
+  )
+
+def main():
+  address = os.environ.get('DBUS_SESSION_BUS_ADDRESS')
+  if not address:
+    print 'No session bus, run this with dbus-run-session'
+    return 1
+
+  observer = dbus.bus.BusConnection(address)
+
+  run('legacy', LegacyBusProvider(address), observer)
+  run('pooled', BusProvider(address), observer)
+
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Compares the cost of implicit-label logging (the label is derived from
+the calling frame) against explicit-label logging, and against the
+inspect.getouterframes() based lookup that NamedLogger used to do.
+
+  $ PYTHONPATH=src python test/benchmarks/caller_introspection.py
+"""
+
+import inspect
+import logging
+import timeit
+
+from phony.base.log import ClassLogger, NamedLogger, Levels
+
+ITERATIONS = 20000
+
+def inspect_calling_instance_method_name_and_args(frame_level = 0):
+  # The previous implementation, kept here as a reference point
+  cur_frame = inspect.currentframe()
+  frame = inspect.getouterframes(cur_frame, frame_level + 2)[1 + frame_level][0]
+
+  method_name = inspect.getframeinfo(frame)[2]
+  args, _, _, values = inspect.getargvalues(frame)
+  instance = values.get('self', None)
+
+  return (instance, method_name, map(lambda arg: values[arg], args))
+
+class Subject(ClassLogger):
+  def __init__(self):
+    ClassLogger.__init__(self)
+
+  def explicit(self, a, b):
+    self.log().event(Subject.explicit, (self, a, b))
+
+  def implicit(self, a, b):
+    self.log().event()
+
+  def explicit_variable(self, a, b):
+    self.log().variable('x', 1, label = 'Subject.explicit_variable(a, b)')
+
+  def implicit_variable(self, a, b):
+    self.log().variable('x', 1)
+
+  def inspect_lookup(self, a, b):
+    return inspect_calling_instance_method_name_and_args(0)
+
+  def frame_lookup(self, a, b):
+    return NamedLogger._calling_instance_method_name_and_args(0)
+
+def measure(statement):
+  seconds = min(timeit.repeat(statement, repeat = 3, number = ITERATIONS))
+  return seconds / ITERATIONS * 1e6
+
+def main():
+  subject = Subject()
+
+  logger = logging.getLogger(subject.log_name())
+  logger.handlers = [logging.NullHandler()]
+  logger.propagate = False
+  logger.setLevel(Levels.DEBUG)
+
+  results = [
+    ('event, explicit label', measure(lambda: subject.explicit(1, 'two'))),
+    ('event, implicit label', measure(lambda: subject.implicit(1, 'two'))),
+    ('variable, explicit label', measure(lambda: subject.explicit_variable(1, 'two'))),
+    ('variable, implicit label', measure(lambda: subject.implicit_variable(1, 'two'))),
+    ('caller lookup, sys._getframe', measure(lambda: subject.frame_lookup(1, 'two'))),
+    ('caller lookup, inspect (previous)', measure(lambda: subject.inspect_lookup(1, 'two'))),
+  ]
+
+  for name, usec in results:
+    print '%-40s %8.2f us/op' % (name, usec)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,122 @@
+"""
+Resident memory and time of 10k simulated device connect events, each of
+which (like Bluez5.properties_changed) creates a short-lived ClassLogger
+object and hands it to a traced listener.  Compares the shared per-class
+TraceLogger against the previous NamedLogger, which rebound variable(),
+event() and call() on the shared logging.Logger for every instance.
+
+Each variant runs in a fresh interpreter:
+
+  $ PYTHONPATH=src python test/benchmarks/logger_memory.py
+"""
+
+import gc
+import sys
+import time
+import logging
+import weakref
+import subprocess
+
+from phony.base.log import ClassLogger, TypeLabel
+
+EVENTS = 10000
+
+class LegacyClassLogger(object):
+  # What NamedLogger.__init__ used to do, kept here as a reference point
+  def __init__(self):
+    self._label_maker = TypeLabel()
+    self._log_name = self._label_maker.source(self)
+    self._log = logging.getLogger(self._log_name)
+
+    self._log.variable = self._variable
+    self._log.event = self._event
+    self._log.call = self._call
+
+  def log(self):
+    return self._log
+
+  def log_level(self):
+    return logging.DEBUG
+
+  def _variable(self, *args):
+    pass
+
+  def _event(self, *args):
+    pass
+
+  def _call(self, *args):
+    pass
+
+def device_class(base):
+  class Device(base):
+    def __init__(self, path):
+      base.__init__(self)
+      self._path = path
+      self._bus = None
+      self._properties = None
+
+    def trace_label(self):
+      return self._path
+
+  return Device
+
+class Headset(ClassLogger):
+  def __init__(self):
+    ClassLogger.__init__(self)
+
+  @ClassLogger.TraceAs.event()
+  def device_connected(self, device):
+    pass
+
+def resident_kb():
+  with open('/proc/self/status') as status:
+    for line in status:
+      if line.startswith('VmRSS:'):
+        return int(line.split()[1])
+  return 0
+
+def run(variant, keep):
+  Device = device_class(LegacyClassLogger if variant == 'legacy' else ClassLogger)
+  headset = Headset()
+
+  kept = []
+  last = None
+
+  gc.collect()
+  before = resident_kb()
+  started = time.time()
+
+  for i in range(0, EVENTS):
+    device = Device('/org/bluez/hci0/dev_00_11_22_33_%02X_%02X' % (i >> 8 & 0xff, i & 0xff))
+    headset.device_connected(device)
+
+    if keep:
+      kept.append(device)
+
+    last = weakref.ref(device)
+    del device
+
+  elapsed = time.time() - started
+  gc.collect()
+
+  print '%-8s %-9s %8d kB %8.2f us/event  last device alive: %s' % (
+    variant,
+    'kept' if keep else 'discarded',
+    resident_kb() - before,
+    elapsed / EVENTS * 1e6,
+    last() is not None
+  )
+
+def main():
+  if len(sys.argv) == 3:
+    run(sys.argv[1], sys.argv[2] == 'kept')
+    return
+
+  logging.getLogger().setLevel(logging.WARNING)
+
+  for keep in ['discarded', 'kept']:
+    for variant in ['legacy', 'shared']:
+      subprocess.check_call([sys.executable, __file__, variant, keep])
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Runs the microbenchmarks of phony's pure python hot paths, and compares
+them with a baseline.  Every bench_*.py module in this directory provides
+bench_<name>() functions that do their setup and return the callable to
+be timed.  None of them need a running D-Bus, bluetooth or GPIO, modules
+whose imports aren't installed (dbus, gobject, fysom) are skipped.
+
+  $ python test/benchmarks/run.py                  # compare with baseline.json
+  $ python test/benchmarks/run.py --save           # record a new baseline
+  $ python test/benchmarks/run.py --threshold 0.1  # fail when 10% slower
+  $ python test/benchmarks/run.py log              # only names containing 'log'
+
+Exits with 1 when any benchmark regressed beyond the threshold.  Baselines
+are only comparable on the machine (and python) they were recorded with.
+"""
+
+import os
+import sys
+import glob
+import json
+import timeit
+import argparse
+import traceback
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.normpath(os.path.join(DIRECTORY, '..', '..'))
+
+DEFAULT_BASELINE = os.path.join(DIRECTORY, 'baseline.json')
+DEFAULT_THRESHOLD = 0.25
+
+MINIMUM_SECONDS_PER_REPEAT = 0.1
+REPEATS = 5
+
+for path in [os.path.join(ROOT, 'examples', 'cranky', 'src'), os.path.join(ROOT, 'src'), DIRECTORY]:
+  if path not in sys.path:
+    sys.path.insert(0, path)
+
+def load_benchmarks(pattern):
+  benchmarks = []
+  skipped = []
+
+  for path in sorted(glob.glob(os.path.join(DIRECTORY, 'bench_*.py'))):
+    module_name = os.path.splitext(os.path.basename(path))[0]
+
+    try:
+      module = __import__(module_name)
+    except ImportError, ex:
+      skipped.append((module_name, str(ex)))
+      continue
+
+    for name in sorted(dir(module)):
+      if not name.startswith('bench_'):
+        continue
+
+      full_name = '%s.%s' % (module_name[len('bench_'):], name[len('bench_'):])
+      if pattern and pattern not in full_name:
+        continue
+
+      benchmarks.append((full_name, getattr(module, name)))
+
+  return benchmarks, skipped
+
+def measure(subject):
+  number = 1
+  while True:
+    seconds = timeit.timeit(subject, number = number)
+    if seconds >= MINIMUM_SECONDS_PER_REPEAT:
+      break
+    number *= 2
+
+  best = min(timeit.repeat(subject, repeat = REPEATS, number = number))
+  return best / number * 1e6
+
+def main():
+  parser = argparse.ArgumentParser(description = 'phony microbenchmarks')
+  parser.add_argument('pattern', nargs = '?', help = 'Only run benchmarks whose name contains this')
+  parser.add_argument('--baseline', default = DEFAULT_BASELINE, help = 'Baseline file, defaults to %s' % DEFAULT_BASELINE)
+  parser.add_argument('--threshold', type = float, default = DEFAULT_THRESHOLD, help = 'Allowed slowdown before failing, defaults to %s' % DEFAULT_THRESHOLD)
+  parser.add_argument('--save', action = 'store_true', help = 'Save the results as the new baseline')
+  args = parser.parse_args()
+
+  baseline = {}
+  if os.path.isfile(args.baseline):
+    with open(args.baseline) as baseline_file:
+      baseline = json.load(baseline_file)
+
+  benchmarks, skipped = load_benchmarks(args.pattern)
+
+  for module_name, reason in skipped:
+    print '%-50s skipped: %s' % (module_name, reason)
+
+  results = {}
+  regressions = []
+
+  for name, setup in benchmarks:
+    try:
+      usec = measure(setup())
+    except Exception:
+      print '%-50s failed:' % name
+      traceback.print_exc()
+      regressions.append(name)
+      continue
+
+    results[name] = usec
+
+    if name in baseline:
+      change = (usec - baseline[name]) / baseline[name]
+      regressed = change > args.threshold
+      if regressed:
+        regressions.append(name)
+
+      print '%-50s %10.3f us/op %+7.1f%%%s' % (name, usec, change * 100, '  REGRESSION' if regressed else '')
+    else:
+      print '%-50s %10.3f us/op     new' % (name, usec)
+
+  if args.save:
+    baseline.update(results)
+    with open(args.baseline, 'w') as baseline_file:
+      json.dump(baseline, baseline_file, indent = 2, sort_keys = True, separators = (',', ': '))
+      baseline_file.write('\n')
+    print 'Saved baseline to %s' % args.baseline
+    return 0
+
+  if regressions:
+    print '%d regression(s) beyond %d%%: %s' % (len(regressions), args.threshold * 100, ', '.join(regressions))
+    return 1
+
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
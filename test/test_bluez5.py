@@ -0,0 +1,320 @@
+from phony.bluetooth.adapters.bluez5 import Bluez5, Bluez5Device, Bluez5Mirror, Bluez5Utils
+from phony.bluetooth.adapters.bluez5_adapters import AllOf, Bluez5Adapters, OneDevicePerAdapter, PinnedDevices
+from phony.bluetooth.reconnect import DeviceCache
+
+ADAPTER = Bluez5Utils.ADAPTER_INTERFACE
+DEVICE = Bluez5Utils.DEVICE_INTERFACE
+
+def objects():
+  return {
+    '/org/bluez': {Bluez5Utils.AGENT_MANAGER_INTERFACE: {}},
+    '/org/bluez/hci0': {ADAPTER: {'Address': '00:1A:7D:DA:71:00', 'Powered': False}},
+    '/org/bluez/hci1': {ADAPTER: {'Address': '00:1A:7D:DA:71:01'}},
+    '/org/bluez/hci0/dev_00_11_22_33_44_55': {
+      DEVICE: {'Address': '00:11:22:33:44:55', 'Adapter': '/org/bluez/hci0', 'Paired': True, 'Connected': True}
+    },
+    '/org/bluez/hci1/dev_00_11_22_33_44_66': {
+      DEVICE: {'Address': '00:11:22:33:44:66', 'Adapter': '/org/bluez/hci1', 'Paired': True, 'Connected': False}
+    }
+  }
+
+def mirror():
+  mirrored = Bluez5Mirror(None)
+  mirrored.load(objects())
+  return mirrored
+
+def test_Bluez5Mirror_finds_adapters():
+  mirrored = mirror()
+
+  assert mirrored.adapters() == ['/org/bluez/hci0', '/org/bluez/hci1']
+  assert mirrored.find_adapter() == '/org/bluez/hci0'
+  assert mirrored.find_adapter('00:1a:7d:da:71:01') == '/org/bluez/hci1'
+  assert mirrored.find_adapter('hci1') == '/org/bluez/hci1'
+  assert mirrored.find_adapter('hci2') is None
+
+def test_Bluez5Mirror_finds_devices():
+  mirrored = mirror()
+
+  assert mirrored.find_device('00:11:22:33:44:66') == '/org/bluez/hci1/dev_00_11_22_33_44_66'
+  assert mirrored.find_device('00:11:22:33:44:66', '/org/bluez/hci0') is None
+  assert mirrored.devices('/org/bluez/hci0') == ['/org/bluez/hci0/dev_00_11_22_33_44_55']
+  assert len(mirrored.devices()) == 2
+  assert mirrored.connected_devices('/org/bluez/hci0') == ['/org/bluez/hci0/dev_00_11_22_33_44_55']
+  assert mirrored.connected_devices('/org/bluez/hci1') == []
+
+def test_Bluez5Mirror_follows_signals():
+  mirrored = mirror()
+  seen = []
+  mirrored.on_properties_changed(lambda interface, changed, invalidated, path: seen.append(path))
+
+  mirrored._properties_changed(ADAPTER, {'Powered': True}, [], '/org/bluez/hci0')
+  assert mirrored.property('/org/bluez/hci0', ADAPTER, 'Powered') is True
+  assert seen == ['/org/bluez/hci0']
+
+  path = '/org/bluez/hci1/dev_00_11_22_33_44_77'
+  mirrored._interfaces_added(path, {DEVICE: {'Address': '00:11:22:33:44:77', 'Adapter': '/org/bluez/hci1'}})
+  assert mirrored.find_device('00:11:22:33:44:77') == path
+
+  mirrored._properties_changed(DEVICE, {'Connected': True, 'Paired': True}, [], path)
+  assert mirrored.connected_devices('/org/bluez/hci1') == [path]
+
+  mirrored._interfaces_removed(path, [DEVICE])
+  assert mirrored.find_device('00:11:22:33:44:77') is None
+  assert not mirrored.contains(path)
+
+  mirrored._interfaces_removed('/org/bluez/hci1', [ADAPTER])
+  assert mirrored.find_adapter('hci1') is None
+  assert mirrored.devices('/org/bluez/hci1') == []
+
+  count = mirrored.object_count()
+  mirrored._interfaces_added('/org/freedesktop/UDisks2/drives/sda', {'org.freedesktop.UDisks2.Drive': {}})
+  assert mirrored.object_count() == count
+
+class RemoteObject(object):
+  requested_bus_name = Bluez5Utils.SERVICE_NAME
+
+  def __init__(self, path, calls):
+    self.object_path = path
+    self._calls = calls
+
+  def get_dbus_method(self, member, dbus_interface = None):
+    def call(*args, **kwargs):
+      self._calls.append((member, kwargs['reply_handler'], kwargs['error_handler']))
+    return call
+
+class Match(object):
+  def remove(self):
+    pass
+
+class Bus(object):
+  def __init__(self):
+    self.calls = []
+
+  def get_object(self, service, path, introspect = True):
+    return RemoteObject(path, self.calls)
+
+  def add_signal_receiver(self, *args, **kwargs):
+    return Match()
+
+  def flush(self):
+    pass
+
+  def _register_object_path(self, *args, **kwargs):
+    pass
+
+  def pending(self):
+    return sorted(member for member, _, _ in self.calls)
+
+  def reply(self, member, *values):
+    for call in self.calls:
+      if call[0] == member:
+        self.calls.remove(call)
+        call[1](*values)
+        return
+
+  def fail(self, member, error):
+    for call in self.calls:
+      if call[0] == member:
+        self.calls.remove(call)
+        call[2](error)
+        return
+
+def test_Bluez5Device_identity():
+  mirrored = mirror()
+  bus = Bus()
+  path = '/org/bluez/hci0/dev_00_11_22_33_44_55'
+
+  first = Bluez5Device(Bluez5Utils.device(path, bus), bus, mirror = mirrored)
+  second = Bluez5Device(Bluez5Utils.device(path, bus), bus, mirror = mirrored)
+  other = Bluez5Device(Bluez5Utils.device(path + '_', bus), bus, mirror = mirrored)
+
+  assert first == second and not first != second
+  assert first != other
+  assert len(set([first, second, other])) == 2
+
+  mirrored._properties_changed(DEVICE, {'Address': 'changed'}, [], path)
+  assert first.address() == '00:11:22:33:44:55'
+
+class BusProvider(object):
+  def __init__(self, bus = None):
+    self.bus = bus or Bus()
+
+  def system_bus(self):
+    return self.bus
+
+def test_Bluez5_device_registry():
+  adapter = Bluez5(BusProvider(), mirror = mirror())
+  path = '/org/bluez/hci0/dev_00_11_22_33_44_55'
+
+  assert adapter.device(path) is adapter.device(path)
+  assert adapter.device(path).address() == '00:11:22:33:44:55'
+
+def test_Bluez5_start_makes_independent_calls_together():
+  bus = Bus()
+  adapter = Bluez5(BusProvider(bus), 'hci0')
+
+  ready = adapter.start('cranky', '1234')
+  pairable = adapter.enable_pairability()
+  assert bus.pending() == ['GetManagedObjects']
+
+  bus.reply('GetManagedObjects', objects())
+  assert bus.pending() == ['RegisterAgent', 'Set', 'Set']
+
+  bus.reply('RegisterAgent')
+  bus.reply('Set')
+  bus.reply('Set')
+  assert bus.pending() == ['GetAll', 'RequestDefaultAgent']
+
+  bus.reply('GetAll', {'Address': '00:1A:7D:DA:71:00', 'Name': 'raspberrypi', 'Alias': 'cranky', 'Class': 0x200404, 'Powered': True})
+  assert not ready.done()
+
+  bus.reply('RequestDefaultAgent')
+  assert ready.done() and ready.exception() is None
+  assert adapter._get_property('Powered') is True
+  assert sorted(adapter.startup_times()) == sorted(Bluez5.STARTUP_PHASES)
+
+  assert not pairable.done()
+  assert bus.pending() == ['Set', 'Set', 'Set', 'Set']
+
+def test_Bluez5_stop_during_start():
+  bus = Bus()
+  mirrored = Bluez5Mirror(bus)
+  adapter = Bluez5(BusProvider(bus), mirror = mirrored)
+
+  ready = adapter.start(None, '1234')
+  adapter.stop()
+  assert ready.cancelled()
+
+  bus.reply('GetManagedObjects', objects())
+  assert mirrored.object_count() == 0
+  assert bus.pending() == []
+
+def test_Bluez5_failed_start_can_be_retried():
+  bus = Bus()
+  mirrored = Bluez5Mirror(bus)
+  adapter = Bluez5(BusProvider(bus), 'hci0', mirror = mirrored)
+
+  assert repr(adapter) == '<Bluez5 (not started)>'
+
+  failed = adapter.start(None, '1234')
+  bus.reply('GetManagedObjects', objects())
+  bus.fail('RegisterAgent', Exception('Already exists'))
+  assert failed.exception() is not None
+  assert repr(adapter) == '<Bluez5 (not started)>'
+  assert mirrored.object_count() == 0
+  assert mirrored._on_properties_changed_listeners == []
+
+  retried = adapter.start(None, '1234')
+  assert retried is not failed
+  assert 'GetManagedObjects' in bus.pending()
+
+def test_Bluez5_reconnect_candidates():
+  bus = Bus()
+  cache = DeviceCache()
+  adapter = Bluez5(BusProvider(bus), 'hci0', mirror = mirror(), device_cache = cache)
+  adapter._adapter = Bluez5Utils.adapter('/org/bluez/hci0', bus)
+
+  newest = '/org/bluez/hci0/dev_00_11_22_33_44_77'
+  adapter._mirror._interfaces_added(newest, {DEVICE: {'Address': '00:11:22:33:44:77', 'Adapter': '/org/bluez/hci0'}})
+
+  adapter._device_connected(adapter.device('/org/bluez/hci0/dev_00_11_22_33_44_55'))
+  cache.remember('00:11:22:33:44:77', '/org/bluez/hci1/dev_00_11_22_33_44_77')
+  cache.remember('00:11:22:33:44:66', '/org/bluez/hci1/dev_00_11_22_33_44_66')
+
+  # Only the ones this adapter has, by address when their path changed
+  assert adapter._reconnect_candidates() == [newest, '/org/bluez/hci0/dev_00_11_22_33_44_55']
+
+  adapter.reconnect(since = 0)
+  adapter.stop_reconnecting()
+  assert adapter.reconnect_stats()['latency']['count'] == 1
+
+def test_Bluez5Adapters_share_and_assign():
+  bus = Bus()
+  policy = AllOf(OneDevicePerAdapter(), PinnedDevices({'00:11:22:33:44:77': 'hci1'}))
+  adapters = Bluez5Adapters(BusProvider(bus), ['hci0', 'hci1'], policy = policy)
+  hci0, hci1 = adapters
+
+  assert hci0._mirror is hci1._mirror and hci0._agent is hci1._agent
+
+  mirrored = hci0._mirror
+  mirrored.load(objects())
+  for adapter, path in [(hci0, '/org/bluez/hci0'), (hci1, '/org/bluez/hci1')]:
+    adapter._adapter = Bluez5Utils.adapter(path, bus)
+    mirrored.on_interfaces_added(adapter.interfaces_added)
+
+  connected = []
+  hci0.on_device_connected(lambda device: connected.append(('hci0', device.path())))
+  hci1.on_device_connected(lambda device: connected.append(('hci1', device.path())))
+
+  # hci0 already has 00:11:22:33:44:55, 00:11:22:33:44:77 is hci1's
+  second = '/org/bluez/hci0/dev_00_11_22_33_44_66'
+  pinned = '/org/bluez/hci0/dev_00_11_22_33_44_77'
+  for path, address in [(second, '00:11:22:33:44:66'), (pinned, '00:11:22:33:44:77')]:
+    mirrored._interfaces_added(path, {DEVICE: {'Address': address, 'Adapter': '/org/bluez/hci0', 'Paired': True, 'Connected': True}})
+
+  assert connected == []
+  assert bus.pending() == ['Disconnect', 'Disconnect']
+
+  hci1._device_connected(hci1.device('/org/bluez/hci1/dev_00_11_22_33_44_66'))
+  assert connected == [('hci1', '/org/bluez/hci1/dev_00_11_22_33_44_66')]
+  assert adapters.adapter_for('/org/bluez/hci1/dev_00_11_22_33_44_66') is hci1
+
+  hci0._agent.set_pincode('0000')
+  hci0._agent.set_pincode('1234', '/org/bluez/hci1')
+  assert hci0._agent.pincode(pinned) == '0000'
+  assert hci0._agent.pincode('/org/bluez/hci1/dev_00_11_22_33_44_66') == '1234'
+
+def test_Bluez5Utils_is_child_device():
+  bus = Bus()
+  hci1 = Bluez5Utils.adapter('/org/bluez/hci1', bus)
+
+  assert Bluez5Utils.is_child_device(hci1, '/org/bluez/hci1/dev_00_11_22_33_44_55')
+  assert not Bluez5Utils.is_child_device(hci1, '/org/bluez/hci10/dev_00_11_22_33_44_55')
+  assert not Bluez5Utils.is_child_device(hci1, '/org/bluez/hci1')
+
+def test_Bluez5_only_calls_back_cached_devices():
+  bus = Bus()
+  cache = DeviceCache()
+  adapter = Bluez5(BusProvider(bus), 'hci0', mirror = mirror(), device_cache = cache)
+  adapter._adapter = Bluez5Utils.adapter('/org/bluez/hci0', bus)
+
+  stranger = '/org/bluez/hci0/dev_00_11_22_33_44_77'
+  adapter._mirror._interfaces_added(stranger, {DEVICE: {'Address': '00:11:22:33:44:77', 'Adapter': '/org/bluez/hci0'}})
+
+  adapter.properties_changed(DEVICE, {'Connected': False}, [], stranger)
+  assert adapter._reconnect_began is None
+
+  phone = '/org/bluez/hci0/dev_00_11_22_33_44_55'
+  cache.remember('00:11:22:33:44:55', phone)
+  adapter.properties_changed(DEVICE, {'Connected': False}, [], phone)
+  assert adapter._reconnect_began is not None
+
+def test_Bluez5Device_never_blocks_for_a_property():
+  mirrored = mirror()
+  bus = Bus()
+  path = '/org/bluez/hci0/dev_00_11_22_33_44_55'
+
+  known = Bluez5Device(Bluez5Utils.device(path, bus), bus, mirror = mirrored)
+  assert known.connected() is True
+
+  mirrored._interfaces_removed(path, [DEVICE])
+  assert known.connected() is True
+  assert known.address() == '00:11:22:33:44:55'
+
+  unknown = Bluez5Device(Bluez5Utils.device(path + '_', bus), bus, mirror = mirrored)
+  assert unknown.connected() is None
+  assert bus.calls == []
+
+def test_Bluez5_reconnect_ends_once_connected():
+  bus = Bus()
+  cache = DeviceCache()
+  mirrored = mirror()
+  adapter = Bluez5(BusProvider(bus), 'hci1', mirror = mirrored, device_cache = cache)
+  adapter._adapter = Bluez5Utils.adapter('/org/bluez/hci1', bus)
+
+  cache.remember('00:11:22:33:44:66', '/org/bluez/hci1/dev_00_11_22_33_44_66')
+  adapter.reconnect(since = 0)
+  assert bus.pending() == ['Connect']
+
+  bus.reply('Connect')
+  assert adapter._reconnecting.done() and adapter._reconnecting.exception() is None
@@ -0,0 +1,120 @@
+import os
+import json
+import stat
+import socket
+import pytest
+
+from phony.base.control import ControlSocket, _Connection
+
+class Client(object):
+  def __init__(self, control):
+    server, self.socket = socket.socketpair()
+    server.setblocking(False)
+
+    self.control = control
+    self.connection = _Connection(server)
+    self.replies = self.socket.makefile('r')
+
+    control._connections[server.fileno()] = self.connection
+
+  def request(self, line):
+    self.socket.sendall(line + '\n')
+    self.control._readable(self.connection)
+    return self.receive()
+
+  def receive(self):
+    return json.loads(self.replies.readline())
+
+  def close(self):
+    self.replies.close()
+    self.socket.close()
+
+def test_ControlSocket_commands():
+  control = ControlSocket('/nonexistent')
+  control.register('status', lambda: {'state': 'idle'})
+  control.register('dial', lambda number: 'dialing %s' % number)
+
+  client = Client(control)
+
+  assert client.request('{"id": 1, "command": "status"}') == \
+    {'id': 1, 'result': {'state': 'idle'}}
+
+  assert client.request('{"id": 2, "command": "dial", "args": {"number": "555"}}') == \
+    {'id': 2, 'result': 'dialing 555'}
+
+  assert client.request('{"id": 3, "command": "commands"}')['result'] == \
+    ['commands', 'dial', 'status', 'subscribe', 'unsubscribe']
+
+def test_ControlSocket_errors():
+  control = ControlSocket('/nonexistent')
+  client = Client(control)
+
+  assert client.request('{"id": 1, "command": "missing"}') == \
+    {'id': 1, 'error': 'Unknown command: missing'}
+
+  assert 'error' in client.request('not json')
+  assert 'error' in client.request('[1, 2]')
+
+def test_ControlSocket_publishes_to_subscribers():
+  control = ControlSocket('/nonexistent')
+
+  everything = Client(control)
+  calls = Client(control)
+  nothing = Client(control)
+
+  everything.request('{"id": 1, "command": "subscribe"}')
+  calls.request('{"id": 1, "command": "subscribe", "args": {"events": ["call_began"]}}')
+
+  assert control.connection_count() == 3
+  assert control.subscriber_count() == 2
+
+  control.publish('state_changed', 'ringing')
+  control.publish('call_began', '/voicecall01')
+
+  assert everything.receive() == {'event': 'state_changed', 'data': 'ringing'}
+  assert everything.receive() == {'event': 'call_began', 'data': '/voicecall01'}
+  assert calls.receive() == {'event': 'call_began', 'data': '/voicecall01'}
+
+  assert nothing.connection.outgoing == ''
+
+def test_ControlSocket_bind_replaces_stale_socket(tmpdir):
+  path = str(tmpdir.join('control.socket'))
+
+  stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  stale.bind(path)
+  stale.close()
+
+  listening = ControlSocket.bind(path, 1)
+  try:
+    with pytest.raises(Exception):
+      ControlSocket.bind(path, 1)
+  finally:
+    listening.close()
+
+def test_ControlSocket_only_owner_connects(tmpdir):
+  path = str(tmpdir.join('control.socket'))
+
+  listening = ControlSocket.bind(path, 1)
+  try:
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0600
+
+    ours, theirs = socket.socketpair()
+    assert ControlSocket.peer_uid(ours) == os.getuid()
+    ours.close()
+    theirs.close()
+  finally:
+    listening.close()
+
+def test_ControlSocket_bind_replaces_stale_file(tmpdir):
+  path = tmpdir.join('control.socket')
+  path.write('unix:path=/tmp/dbus-stale')
+
+  ControlSocket.bind(str(path), 1).close()
+
+def test_ControlSocket_closes_on_disconnect():
+  control = ControlSocket('/nonexistent')
+  client = Client(control)
+
+  client.close()
+  assert control._readable(client.connection) is False
+  assert control.connection_count() == 0
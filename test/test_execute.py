@@ -0,0 +1,78 @@
+import json
+import select
+import socket
+import pytest
+
+from StringIO import StringIO
+
+from phony.base import privileged
+from phony.base.execute import PrivilegedHelper
+
+def test_privileged_check_allows_only_known_commands():
+  privileged.check(['rfkill', 'unblock', 'bluetooth'])
+  privileged.check(['hciconfig', 'hci0', 'sspmode', '1'])
+
+  for argv in [[], ['rm', '-rf', '/'], ['rfkill', 'unblock'],
+               ['rfkill', 'unblock', 'bluetooth; reboot'],
+               ['hciconfig', 'hci0', 'sspmode', '2'],
+               ['rfkill', 'unblock', 'bluetooth\n'],
+               ['hciconfig', 'hci0\n', 'up']]:
+    with pytest.raises(ValueError):
+      privileged.check(argv)
+
+def test_privileged_serve_answers_each_request():
+  ran = []
+
+  def runner(argv):
+    ran.append(argv)
+    return 0, 'ok\n'
+
+  incoming = StringIO(
+    '{"id": 1, "argv": ["rfkill", "block", "bluetooth"]}\n'
+    '\n'
+    '{"id": 2, "argv": ["sh", "-c", "reboot"]}\n'
+  )
+  outgoing = StringIO()
+
+  privileged.serve(incoming, outgoing, runner)
+
+  replies = [json.loads(line) for line in outgoing.getvalue().splitlines()]
+
+  assert ran == [['rfkill', 'block', 'bluetooth']]
+  assert replies[0] == {'id': 1, 'status': 0, 'output': 'ok\n'}
+  assert replies[1]['id'] == 2 and 'error' in replies[1]
+
+def test_PrivilegedHelper_rejects_without_starting():
+  helper = PrivilegedHelper(launcher = [])
+
+  assert isinstance(helper.run('rm', '-rf', '/').exception(), ValueError)
+  assert not helper.running()
+
+def test_PrivilegedHelper_survives_malformed_replies():
+  helper = PrivilegedHelper(launcher = [])
+  ours, theirs = socket.socketpair()
+  helper._socket = ours
+
+  future = helper.run('rfkill', 'list', 'bluetooth')
+  theirs.recv(4096)
+  theirs.sendall('not json\n[1]\n{"id": 1, "status": 0, "output": "ok"}\n')
+
+  assert helper._receive()
+  assert future.result() == 'ok'
+
+  helper.stop()
+  theirs.close()
+
+def test_PrivilegedHelper_round_trip():
+  with PrivilegedHelper(launcher = []) as helper:
+    first = helper.run('rfkill', 'list', 'bluetooth')
+    second = helper.run('rfkill', 'list', 'bluetooth')
+
+    # rfkill may not be installed, either way the helper answers
+    while not second.done():
+      readable, _, _ = select.select([helper._socket], [], [], 10.0)
+      assert readable and helper._receive()
+    assert first.done()
+    assert helper.running()
+
+  assert not helper.running()
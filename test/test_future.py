@@ -0,0 +1,117 @@
+import pytest
+
+from phony.base.future import CancelledError, Future, gather, settle
+
+def test_Future_callbacks_run_once_done():
+  future = Future()
+  seen = []
+  future.add_done_callback(lambda f: seen.append(f.result()))
+
+  assert not future.done()
+  assert seen == []
+
+  future.set_result(42)
+  future.set_result(43)
+
+  assert future.done()
+  assert seen == [42]
+
+  future.add_done_callback(lambda f: seen.append(f.result()))
+  assert seen == [42, 42]
+
+def test_Future_exception_is_raised_by_result():
+  future = Future.failed(ValueError('expected'))
+
+  assert isinstance(future.exception(), ValueError)
+  with pytest.raises(ValueError):
+    future.result()
+
+def test_Future_result_before_done_raises():
+  with pytest.raises(Exception):
+    Future().result()
+
+def test_Future_cancel():
+  future = Future()
+  assert future.cancel()
+  assert future.cancelled()
+  assert not future.cancel()
+
+  with pytest.raises(CancelledError):
+    future.result()
+
+def test_Future_then_chains_values_and_futures():
+  first = Future()
+  inner = Future()
+
+  chained = first.then(lambda value: value + 1).then(lambda value: inner)
+
+  first.set_result(1)
+  assert not chained.done()
+
+  inner.set_result('done')
+  assert chained.result() == 'done'
+
+def test_Future_then_skips_callback_on_failure():
+  seen = []
+  chained = Future.failed(ValueError('expected')).then(seen.append)
+
+  assert seen == []
+  assert isinstance(chained.exception(), ValueError)
+
+def test_Future_then_fails_when_callback_raises():
+  def fails(value):
+    raise ValueError('expected')
+
+  assert isinstance(Future.resolved(1).then(fails).exception(), ValueError)
+
+def test_gather():
+  futures = [Future(), Future(), Future()]
+  gathered = gather(futures)
+
+  futures[2].set_result(3)
+  futures[0].set_result(1)
+  assert not gathered.done()
+
+  futures[1].set_result(2)
+  assert gathered.result() == [1, 2, 3]
+
+  assert gather([]).result() == []
+
+def test_gather_fails_with_first_exception():
+  futures = [Future(), Future()]
+  gathered = gather(futures)
+
+  futures[1].set_exception(ValueError('expected'))
+  assert isinstance(gathered.exception(), ValueError)
+
+  futures[0].set_result(1)
+  assert isinstance(gathered.exception(), ValueError)
+
+def test_settle_waits_for_failures_too():
+  futures = [Future(), Future()]
+  settled = settle(futures)
+
+  futures[0].set_exception(ValueError('expected'))
+  assert not settled.done()
+
+  futures[1].set_result(2)
+  assert settled.result() == futures
+
+  assert settle([]).result() == []
+
+def test_Future_failing_callback_does_not_stop_others():
+  future = Future()
+  seen = []
+
+  def fail(f):
+    raise Exception('Broken listener')
+
+  future.add_done_callback(fail)
+  future.add_done_callback(lambda f: seen.append(f.result()))
+  future.set_result(42)
+
+  assert seen == [42]
+
+  future.add_done_callback(fail)
+  future.add_done_callback(lambda f: seen.append(f.result()))
+  assert seen == [42, 42]
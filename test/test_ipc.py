@@ -0,0 +1,129 @@
+from phony.base import ipc
+from phony.base.clock import monotonic
+from phony.base.ipc import ProxyCache
+
+class RemoteObject(object):
+  requested_bus_name = 'org.bluez'
+
+  def __init__(self, path):
+    self.object_path = path
+
+class Match(object):
+  def __init__(self, bus, signal_name):
+    self.bus = bus
+    self.signal_name = signal_name
+
+  def remove(self):
+    del self.bus.receivers[self.signal_name]
+
+class Bus(object):
+  def __init__(self):
+    self.receivers = {}
+    self.keywords = {}
+
+  def get_object(self, service, path, introspect = True):
+    return RemoteObject(path)
+
+  def add_signal_receiver(self, handler, signal_name = None, **keywords):
+    self.added = getattr(self, 'added', 0) + 1
+    self.receivers[signal_name] = handler
+    self.keywords[signal_name] = keywords
+    return Match(self, signal_name)
+
+def test_ProxyCache_remembers_removed_objects():
+  bus = Bus()
+  cache = ProxyCache()
+
+  device = '/org/bluez/hci0/dev_00_11_22_33_44_55'
+  cache.interface(bus, 'org.bluez', device, 'org.bluez.Device1')
+
+  assert not cache.gone(bus, 'org.bluez', device)
+
+  bus.receivers['InterfacesRemoved'](device, ['org.bluez.Device1'])
+
+  assert len(cache) == 0
+  assert cache.gone(bus, 'org.bluez', device)
+  assert cache.gone(bus, 'org.bluez', device + '/fd0')
+  assert not cache.gone(bus, 'org.bluez', '/org/bluez/hci0')
+  assert not cache.gone(Bus(), 'org.bluez', device)
+
+  bus.receivers['InterfacesAdded'](device, {})
+  assert not cache.gone(bus, 'org.bluez', device)
+
+def test_ProxyCache_partial_removal():
+  bus = Bus()
+  cache = ProxyCache()
+
+  device = '/org/bluez/hci0/dev_00_11_22_33_44_55'
+  cache.interface(bus, 'org.bluez', device, 'org.bluez.Device1')
+  cache.interface(bus, 'org.bluez', device, 'org.bluez.MediaControl1')
+
+  bus.receivers['InterfacesRemoved'](device, ['org.bluez.MediaControl1', 'org.bluez.Battery1'])
+
+  assert len(cache) == 1
+  assert not cache.gone(bus, 'org.bluez', device)
+
+  bus.receivers['CallRemoved']('/hfp/org/bluez/hci0/dev_00_11_22_33_44_55/voicecall01')
+  assert cache.gone(bus, 'org.bluez', '/hfp/org/bluez/hci0/dev_00_11_22_33_44_55/voicecall01')
+
+def test_ProxyCache_shares_receivers_between_services():
+  bus = Bus()
+  cache = ProxyCache()
+
+  cache.interface(bus, 'org.bluez', '/org/bluez/hci0', 'org.bluez.Adapter1')
+  receivers = bus.added
+
+  cache.interface(bus, 'org.ofono', '/hfp/org/bluez/hci0/dev_00_11_22_33_44_55', 'org.ofono.Modem')
+  assert bus.added == receivers
+  assert 'bus_name' not in bus.keywords['InterfacesRemoved']
+
+  bus.receivers['ModemRemoved']('/hfp/org/bluez/hci0/dev_00_11_22_33_44_55')
+  assert cache.gone(bus, 'org.ofono', '/hfp/org/bluez/hci0/dev_00_11_22_33_44_55')
+
+  cache.forget(bus)
+  assert bus.receivers == {}
+
+def test_timeout_until():
+  assert ipc.timeout_until(None, 5.0) == 5.0
+  assert ipc.timeout_until(monotonic() + 60, 5.0) == 5.0
+  assert 0.5 < ipc.timeout_until(monotonic() + 1, 5.0) <= 1.0
+  assert ipc.timeout_until(monotonic() - 1, 5.0) == ipc.MINIMUM_CALL_TIMEOUT
+
+def test_Subscriptions_remove_their_receivers():
+  bus = Bus()
+  subscriptions = ipc.Subscriptions('test_Subscriptions')
+
+  subscriptions.add(bus, lambda *args: None, 'org.ofono.VoiceCall', 'PropertyChanged')
+  removed = subscriptions.add(bus, lambda *args: None, 'org.ofono.VoiceCallManager', 'CallRemoved')
+
+  assert ipc.subscription_counts()['test_Subscriptions'] == 2
+
+  subscriptions.remove(removed)
+  assert bus.receivers.keys() == ['PropertyChanged']
+
+  subscriptions.remove_all()
+  assert bus.receivers == {}
+  assert 'test_Subscriptions' not in ipc.subscription_counts()
+
+def test_Subscriptions_path_namespace():
+  bus = Bus()
+  seen = []
+
+  subscriptions = ipc.Subscriptions('test_Subscriptions')
+  subscriptions.add(
+    bus,
+    lambda interface, changed, invalidated: seen.append(changed),
+    'org.freedesktop.DBus.Properties',
+    'PropertiesChanged',
+    path_namespace = '/org/bluez/hci0'
+  )
+
+  handler = bus.receivers['PropertiesChanged']
+  handler('org.bluez.Device1', 'ours', [], path = '/org/bluez/hci0/dev_00_11_22_33_44_55')
+  handler('org.bluez.Device1', 'theirs', [], path = '/org/bluez/hci1/dev_00_11_22_33_44_55')
+  handler('org.bluez.Device1', 'prefix', [], path = '/org/bluez/hci01')
+
+  assert seen == ['ours']
+  assert bus.keywords['PropertiesChanged']['path_keyword'] == 'path'
+
+  subscriptions.remove_all()
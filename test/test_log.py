@@ -0,0 +1,429 @@
+import logging
+import gc
+import time
+import weakref
+import StringIO
+import threading
+
+from phony.base import log
+from phony.base.log import ClassLogger, InstanceLogger, Levels
+
+class CapturingHandler(logging.Handler):
+  def __init__(self):
+    logging.Handler.__init__(self)
+    self.messages = []
+
+  def emit(self, record):
+    self.messages.append(record.getMessage())
+
+class Unprintable(object):
+  rendered = 0
+
+  def __str__(self):
+    Unprintable.rendered += 1
+    return 'unprintable'
+
+class Traced(ClassLogger):
+  def __init__(self):
+    ClassLogger.__init__(self)
+
+  @ClassLogger.TraceAs.call()
+  def debug_call(self, arg):
+    return arg
+
+  @ClassLogger.TraceAs.event()
+  def debug_event(self, arg):
+    return arg
+
+  @ClassLogger.TraceAs.call(log_level = Levels.INFO)
+  def info_call(self, arg):
+    return arg
+
+  def implicit_variable(self, arg):
+    self.log().variable('answer', 42)
+
+  def implicit_event(self, arg, other = 'x'):
+    self.log().event()
+
+  def implicit_call(self, arg):
+    with self.log().call():
+      pass
+
+def capture(traced, level):
+  handler = CapturingHandler()
+  logger = logging.getLogger(traced.log_name())
+  logger.handlers = [handler]
+  logger.propagate = False
+  logger.setLevel(level)
+  return handler
+
+def test_TraceAs_disabled_level_skips_label():
+  traced = Traced()
+  handler = capture(traced, Levels.WARNING)
+
+  Unprintable.rendered = 0
+  assert traced.debug_call(Unprintable()) is not None
+  assert traced.debug_event(Unprintable()) is not None
+  assert traced.info_call(Unprintable()) is not None
+
+  assert Unprintable.rendered == 0
+  assert handler.messages == []
+
+def test_TraceAs_enabled_level_logs_label():
+  traced = Traced()
+  handler = capture(traced, Levels.DEBUG)
+
+  assert traced.debug_call(5) == 5
+  assert traced.debug_event(6) == 6
+
+  assert handler.messages == [
+    '-> Traced.debug_call(5)',
+    '<- Traced.debug_call(5)',
+    '** Traced.debug_event(6)'
+  ]
+
+def test_TraceAs_level_is_checked_per_call():
+  traced = Traced()
+  handler = capture(traced, Levels.INFO)
+
+  traced.debug_call(1)
+  traced.info_call(2)
+
+  assert handler.messages == ['-> Traced.info_call(2)', '<- Traced.info_call(2)']
+
+def test_TraceAs_preserves_method_name():
+  assert Traced.debug_call.__name__ == 'debug_call'
+
+def test_implicit_labels():
+  traced = Traced()
+  handler = capture(traced, Levels.DEBUG)
+
+  traced.implicit_variable(1)
+  traced.implicit_event(2)
+  traced.implicit_call(3)
+
+  assert handler.messages == [
+    'Traced.implicit_variable(1) => answer = 42',
+    '** Traced.implicit_event(2, x)',
+    '-> Traced.implicit_call(3)',
+    '<- Traced.implicit_call(3)'
+  ]
+
+def test_implicit_labels_disabled_level():
+  traced = Traced()
+  handler = capture(traced, Levels.INFO)
+
+  Unprintable.rendered = 0
+  traced.implicit_variable(Unprintable())
+  traced.implicit_event(Unprintable())
+  traced.implicit_call(Unprintable())
+
+  assert Unprintable.rendered == 0
+  assert handler.messages == []
+
+def test_TraceAs_import_time_disabled():
+  log.disable_tracing()
+  try:
+    def method(self):
+      pass
+
+    assert ClassLogger.TraceAs.call()(method) is method
+    assert ClassLogger.TraceAs.event()(method) is method
+  finally:
+    log.enable_tracing()
+
+class Proxy(object):
+  calls = 0
+
+  def __getattr__(self, name):
+    def remote(*args):
+      Proxy.calls += 1
+    return remote
+
+  def __repr__(self):
+    Proxy.calls += 1
+    return 'proxy'
+
+class Labelled(object):
+  def trace_label(self):
+    return 'labelled'
+
+class ChattyLabel(object):
+  def trace_label(self):
+    log.note_io()
+    return 'chatty'
+
+def test_pretty_args_plain_values():
+  assert log.pretty_args([1, 'two', None, [3, (4, 5)], {'six': 6}], 100) == \
+    "1, two, None, [3, (4, 5)], {six: 6}"
+
+def test_pretty_args_truncates():
+  assert log.pretty_args(['abcdefghij'], 4) == 'abcd...'
+
+def test_pretty_args_uses_trace_label():
+  assert log.pretty_args([Labelled()], 100) == 'labelled'
+
+def test_pretty_args_does_not_call_into_unknown_objects():
+  Proxy.calls = 0
+  proxy = Proxy()
+
+  rendered = log.pretty_args([proxy], 100)
+
+  assert Proxy.calls == 0
+  assert rendered == '<Proxy@0x%x>' % id(proxy)
+
+def test_pretty_args_counts_traces_with_io():
+  before = log.traces_with_io()
+
+  log.pretty_args([Labelled(), 1], 100)
+  assert log.traces_with_io() == before
+
+  log.pretty_args([ChattyLabel(), ChattyLabel()], 100)
+  assert log.traces_with_io() == before + 1
+  assert 'ChattyLabel' in log.types_with_io()
+
+def test_note_io_outside_of_rendering_is_not_counted():
+  before = log.traces_with_io()
+  log.note_io()
+  log.pretty_args([1], 100)
+  assert log.traces_with_io() == before
+
+class BlockingStream(object):
+  def __init__(self):
+    self.lines = []
+    self.writing = threading.Event()
+    self.proceed = threading.Event()
+
+  def write(self, text):
+    self.writing.set()
+    self.proceed.wait()
+    self.lines.extend(text.splitlines())
+
+  def flush(self):
+    pass
+
+def queued_logger(name, handler):
+  logger = logging.getLogger(name)
+  logger.handlers = [handler]
+  logger.propagate = False
+  logger.setLevel(Levels.DEBUG)
+  return logger
+
+def test_QueuedStreamHandler_writes_in_order():
+  stream = StringIO.StringIO()
+  handler = log.QueuedStreamHandler(stream = stream)
+  logger = queued_logger('test.queued.order', handler)
+
+  for i in range(0, 1000):
+    logger.info('record %d' % i)
+
+  handler.close()
+
+  assert stream.getvalue().splitlines() == ['record %d' % i for i in range(0, 1000)]
+  assert handler.dropped() == 0
+
+def test_QueuedStreamHandler_drops_on_overflow():
+  stream = BlockingStream()
+  handler = log.QueuedStreamHandler(stream = stream, capacity = 10)
+  logger = queued_logger('test.queued.overflow', handler)
+
+  # Wait until the writer is stuck writing the first record
+  logger.info('first')
+  assert stream.writing.wait(5)
+
+  for i in range(0, 25):
+    logger.info('record %d' % i)
+
+  assert handler.queued() == 10
+  assert handler.dropped() == 15
+
+  stream.proceed.set()
+  handler.close()
+
+  assert stream.lines[0] == 'first'
+  assert stream.lines[1:11] == ['record %d' % i for i in range(0, 10)]
+  assert stream.lines[11] == '15 log record(s) dropped, queue is full'
+
+def test_ClassLogger_shares_one_logger_per_class():
+  first = Traced()
+  second = Traced()
+
+  assert first.log() is second.log()
+  assert first.log_name() == Traced.__module__ + '.Traced'
+
+class Renamed(log.TypeLabel):
+  __slots__ = ()
+
+  def name(self, instance):
+    return 'Renamed'
+
+class Relabelled(ClassLogger):
+  def __init__(self, label_maker = log.TypeLabel()):
+    ClassLogger.__init__(self, label_maker)
+
+  @ClassLogger.TraceAs.event()
+  def poke(self, arg):
+    pass
+
+def test_ClassLogger_shares_one_logger_per_label_maker():
+  plain = Relabelled()
+  renamed = Relabelled(Renamed())
+  handler = capture(plain, Levels.INFO)
+
+  assert plain.log() is Relabelled().log()
+  assert plain.log() is not renamed.log()
+
+  renamed.log_level(Levels.INFO)
+  plain.poke(1)
+  renamed.poke(2)
+
+  assert handler.messages == ['** Renamed.poke(2)']
+
+def test_ClassLogger_cache_does_not_grow_per_instance():
+  Relabelled(Renamed())
+  count = len(log._class_loggers)
+
+  instances = [Relabelled(Renamed()) for i in range(0, 100)]
+
+  assert len(log._class_loggers) == count
+  assert len(set(id(instance.log()) for instance in instances)) == 1
+
+def test_ClassLogger_holds_no_reference_to_instances():
+  traced = Traced()
+  traced.log().debug('touch')
+  reference = weakref.ref(traced)
+
+  del traced
+  gc.collect()
+
+  assert reference() is None
+  assert not hasattr(logging.getLogger(Traced.__module__ + '.Traced'), 'variable')
+
+class PerInstance(InstanceLogger):
+  def __init__(self):
+    InstanceLogger.__init__(self)
+
+  @InstanceLogger.TraceAs.event()
+  def poke(self, arg):
+    pass
+
+def test_InstanceLogger_labels_with_instance_id():
+  instance = PerInstance()
+  handler = capture(instance, Levels.DEBUG)
+
+  instance.poke(1)
+
+  assert instance.log_name().endswith('.PerInstance.%d' % id(instance))
+  assert handler.messages == ['** PerInstance.%d.poke(1)' % id(instance)]
+
+def test_ScopedLogger_accepts_name_or_instance():
+  traced = Traced()
+  handler = capture(traced, Levels.DEBUG)
+
+  with log.ScopedLogger(traced, 'scope'):
+    pass
+
+  with log.ScopedLogger(traced.log_name(), 'named'):
+    pass
+
+  assert handler.messages == ['-> scope', '<- scope', '-> named', '<- named']
+
+class Stormy(ClassLogger):
+  def __init__(self):
+    ClassLogger.__init__(self)
+
+  @ClassLogger.TraceAs.event(sample = 3)
+  def sampled(self, arg):
+    pass
+
+  @ClassLogger.TraceAs.call(rate_limit = log.RateLimit(per_second = 0.001, burst = 2))
+  def limited(self, arg):
+    return arg
+
+def test_Sampler_logs_one_in_n_with_summary():
+  stormy = Stormy()
+  handler = capture(stormy, Levels.DEBUG)
+
+  for i in range(0, 7):
+    stormy.sampled(i)
+
+  assert handler.messages == [
+    '** Stormy.sampled(0)',
+    '** Stormy.sampled: suppressed 2 similar message(s)',
+    '** Stormy.sampled(3)',
+    '** Stormy.sampled: suppressed 2 similar message(s)',
+    '** Stormy.sampled(6)'
+  ]
+
+def test_RateLimit_allows_burst_then_suppresses():
+  stormy = Stormy()
+  handler = capture(stormy, Levels.DEBUG)
+
+  results = [stormy.limited(i) for i in range(0, 5)]
+
+  # Suppression only affects logging, not the call
+  assert results == range(0, 5)
+  assert handler.messages == [
+    '-> Stormy.limited(0)', '<- Stormy.limited(0)',
+    '-> Stormy.limited(1)', '<- Stormy.limited(1)'
+  ]
+
+def test_RateLimit_refills():
+  limit = log.RateLimit(per_second = 1000, burst = 1)
+  assert limit.allow()
+  assert not limit.allow()
+
+  time.sleep(0.01)
+  assert limit.allow()
+
+def test_Limiter_log():
+  handler = CapturingHandler()
+  logger = logging.getLogger('test.limiter')
+  logger.handlers = [handler]
+  logger.propagate = False
+  logger.setLevel(Levels.DEBUG)
+
+  sampler = log.Sampler(2)
+  for i in range(0, 3):
+    sampler.log(logger, Levels.INFO, 'pulse')
+
+  assert handler.messages == ['pulse', '** pulse: suppressed 1 similar message(s)', 'pulse']
+
+  del handler.messages[:]
+  unlimited = log.Limiter()
+  for i in range(0, 3):
+    unlimited.log(logger, Levels.INFO, 'pulse')
+
+  assert handler.messages == ['pulse'] * 3
+
+def test_set_levels_by_prefix_at_runtime():
+  traced = Traced()
+  handler = capture(traced, Levels.NOTSET)
+
+  parent = Traced.__module__
+  logging.getLogger(parent).setLevel(Levels.WARNING)
+  try:
+    traced.debug_call(1)
+    assert handler.messages == []
+
+    log.set_levels('%s=DEBUG, some.other.subsystem=ERROR' % parent)
+    traced.debug_call(2)
+    assert handler.messages == ['-> Traced.debug_call(2)', '<- Traced.debug_call(2)']
+
+    assert log.levels()[parent] == 'DEBUG'
+    assert log.levels()['some.other.subsystem'] == 'ERROR'
+
+    log.set_level(parent, 'INFO')
+    traced.debug_call(3)
+    assert len(handler.messages) == 2
+  finally:
+    log.set_levels('%s=NOTSET, some.other.subsystem=NOTSET' % parent)
+
+  assert parent not in log.levels()
+
+def test_set_levels_rejects_unknown_level():
+  try:
+    log.set_levels('phony=LOUD')
+    assert False
+  except Exception, ex:
+    assert 'LOUD' in str(ex)
@@ -0,0 +1,63 @@
+from phony.bluetooth.reconnect import Backoff, DeviceCache
+
+def test_DeviceCache_most_recent_first(tmpdir):
+  path = str(tmpdir.join('devices.json'))
+
+  cache = DeviceCache(path, capacity = 2)
+  cache.remember('00:11:22:33:44:55', '/org/bluez/hci0/dev_00_11_22_33_44_55', when = 1)
+  cache.remember('00:11:22:33:44:66', '/org/bluez/hci0/dev_00_11_22_33_44_66', when = 2)
+  cache.remember('00:11:22:33:44:77', '/org/bluez/hci0/dev_00_11_22_33_44_77', when = 3)
+  cache.remember('00:11:22:33:44:66', '/org/bluez/hci0/dev_00_11_22_33_44_66', when = 4)
+
+  assert cache.addresses() == ['00:11:22:33:44:66', '00:11:22:33:44:77']
+
+  reloaded = DeviceCache(path, capacity = 2)
+  assert reloaded.devices() == cache.devices()
+
+  reloaded.forget('00:11:22:33:44:66')
+  assert DeviceCache(path).addresses() == ['00:11:22:33:44:77']
+
+def test_DeviceCache_saves_only_changes(tmpdir):
+  path = tmpdir.join('devices.json')
+
+  cache = DeviceCache(str(path))
+  cache.remember('00:11:22:33:44:55', '/org/bluez/hci0/dev_00_11_22_33_44_55', when = 1)
+  cache.remember('00:11:22:33:44:66', '/org/bluez/hci0/dev_00_11_22_33_44_66', when = 2)
+
+  path.remove()
+  cache.remember('00:11:22:33:44:66', '/org/bluez/hci0/dev_00_11_22_33_44_66', when = 3)
+  assert not path.exists()
+
+  cache.remember('00:11:22:33:44:55', '/org/bluez/hci0/dev_00_11_22_33_44_55', when = 4)
+  assert DeviceCache(str(path)).addresses() == ['00:11:22:33:44:55', '00:11:22:33:44:66']
+
+  cache.remember('00:11:22:33:44:55', '/org/bluez/hci1/dev_00_11_22_33_44_55', when = 5)
+  assert DeviceCache(str(path)).devices()[0]['path'] == '/org/bluez/hci1/dev_00_11_22_33_44_55'
+
+def test_DeviceCache_ignores_unreadable_file(tmpdir):
+  path = tmpdir.join('devices.json')
+  path.write('{"devices": [')
+
+  cache = DeviceCache(str(path))
+  assert len(cache) == 0
+
+  cache.remember('00:11:22:33:44:55', '/org/bluez/hci0/dev_00_11_22_33_44_55')
+  assert DeviceCache(str(path)).addresses() == ['00:11:22:33:44:55']
+
+def test_DeviceCache_without_file():
+  cache = DeviceCache()
+  cache.remember('00:11:22:33:44:55', '/org/bluez/hci0/dev_00_11_22_33_44_55')
+
+  assert cache.addresses() == ['00:11:22:33:44:55']
+
+def test_Backoff_grows_to_maximum_with_jitter():
+  backoff = Backoff(initial = 1.0, maximum = 8.0, jitter = 0.5, random = lambda: 0.0)
+  assert [backoff.next() for i in range(0, 6)] == [1.0, 2.0, 4.0, 8.0, 8.0, 8.0]
+
+  backoff.reset()
+  assert backoff.next() == 1.0
+
+  jittered = Backoff(initial = 1.0, maximum = 8.0, jitter = 0.5, random = lambda: 1.0)
+  assert [jittered.next() for i in range(0, 4)] == [0.5, 1.0, 2.0, 4.0]
+
+  assert Backoff(random = lambda: 0.0).next() == Backoff.INITIAL
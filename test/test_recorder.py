@@ -0,0 +1,116 @@
+import sys
+import json
+import logging
+import thread
+
+from phony.base import log
+from phony.base.log import ClassLogger, Levels
+from phony.base.recorder import FlightRecorder
+
+class Recorded(ClassLogger):
+  def __init__(self):
+    ClassLogger.__init__(self)
+    logging.getLogger(self.log_name()).setLevel(Levels.CRITICAL)
+
+  @ClassLogger.TraceAs.call()
+  def outer(self):
+    self.inner()
+
+  @ClassLogger.TraceAs.event()
+  def inner(self):
+    pass
+
+  @ClassLogger.TraceAs.call()
+  def fails(self):
+    raise ValueError('expected')
+
+def recording(capacity = FlightRecorder.DEFAULT_CAPACITY):
+  recorder = FlightRecorder(capacity)
+  log.record_to(recorder)
+  return recorder
+
+def phases_and_names(recorder):
+  return [(phase, '%s.%s' % (clazz.__name__, method))
+    for _, _, _, phase, clazz, method in recorder.events()]
+
+def test_FlightRecorder_records_calls_and_events_at_disabled_levels():
+  recorder = recording()
+  try:
+    Recorded().outer()
+  finally:
+    log.record_to(None)
+
+  assert phases_and_names(recorder) == [
+    ('B', 'Recorded.outer'),
+    ('i', 'Recorded.inner'),
+    ('E', 'Recorded.outer')
+  ]
+
+  events = recorder.events()
+  assert all(event[2] == thread.get_ident() for event in events)
+  assert events[0][1] <= events[1][1] <= events[2][1]
+
+def test_FlightRecorder_records_exit_on_exception():
+  recorder = recording()
+  try:
+    Recorded().fails()
+  except ValueError:
+    pass
+  finally:
+    log.record_to(None)
+
+  assert phases_and_names(recorder) == [
+    ('B', 'Recorded.fails'),
+    ('E', 'Recorded.fails')
+  ]
+
+def test_FlightRecorder_keeps_most_recent():
+  recorder = recording(capacity = 4)
+  try:
+    recorded = Recorded()
+    for i in range(0, 10):
+      recorded.inner()
+    recorded.outer()
+  finally:
+    log.record_to(None)
+
+  assert [event[0] for event in recorder.events()] == [9, 10, 11, 12]
+  assert phases_and_names(recorder)[1:] == [
+    ('B', 'Recorded.outer'),
+    ('i', 'Recorded.inner'),
+    ('E', 'Recorded.outer')
+  ]
+
+def test_FlightRecorder_chrome_trace():
+  recorder = recording()
+  try:
+    Recorded().outer()
+  finally:
+    log.record_to(None)
+
+  trace = json.loads(recorder.chrome_trace())
+  events = trace['traceEvents']
+
+  assert [e['ph'] for e in events] == ['B', 'i', 'E']
+  assert events[0]['name'] == 'Recorded.outer'
+  assert events[0]['cat'] == Recorded.__module__
+  assert events[1]['s'] == 't'
+  assert events[0]['ts'] <= events[2]['ts']
+
+def test_FlightRecorder_dump_on_unhandled_exception(tmpdir):
+  path = str(tmpdir.join('trace.json'))
+
+  recorder = FlightRecorder()
+  recorder.record(recorder.EVENT, recorder, 'something')
+
+  previous_hook = sys.excepthook
+  seen = []
+  sys.excepthook = lambda *args: seen.append(args)
+  try:
+    recorder.dump_on_unhandled_exception(path)
+    sys.excepthook(ValueError, ValueError('unhandled'), None)
+  finally:
+    sys.excepthook = previous_hook
+
+  assert len(seen) == 1
+  assert json.load(open(path))['traceEvents'][0]['name'] == 'FlightRecorder.something'
@@ -0,0 +1,62 @@
+import socket
+
+from phony.bluetooth import rfkill
+from phony.bluetooth.rfkill import Rfkill, RfkillEvent
+
+def fake_device():
+  # Datagrams keep event boundaries, like /dev/rfkill does
+  ours, kernel = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+  ours.setblocking(False)
+  return ours, kernel
+
+def event(index, op, soft = False, hard = False, rfkill_type = rfkill.TYPE_BLUETOOTH):
+  return RfkillEvent(index, rfkill_type, op, soft, hard).encode()
+
+def test_RfkillEvent_round_trip():
+  decoded = RfkillEvent.decode(event(3, rfkill.OP_CHANGE, soft = True) + '\x01')
+
+  assert RfkillEvent.SIZE == 8
+  assert (decoded.index, decoded.type, decoded.op, decoded.soft, decoded.hard) == \
+    (3, rfkill.TYPE_BLUETOOTH, rfkill.OP_CHANGE, True, False)
+
+def test_Rfkill_reads_devices_on_open():
+  ours, kernel = fake_device()
+  kernel.send(event(0, rfkill.OP_ADD, soft = True))
+  kernel.send(event(1, rfkill.OP_ADD, rfkill_type = rfkill.TYPE_WLAN))
+
+  with Rfkill(ours.fileno()) as radio:
+    assert radio.device_count() == 1
+    assert radio.soft_blocked()
+    assert not radio.hard_blocked()
+
+def test_Rfkill_unblock_writes_change_all():
+  ours, kernel = fake_device()
+
+  with Rfkill(ours.fileno()) as radio:
+    radio.unblock()
+    radio.block()
+
+  unblock = RfkillEvent.decode(kernel.recv(64))
+  block = RfkillEvent.decode(kernel.recv(64))
+
+  assert (unblock.type, unblock.op, unblock.soft) == (rfkill.TYPE_BLUETOOTH, rfkill.OP_CHANGE_ALL, False)
+  assert block.soft
+
+def test_Rfkill_reports_external_changes():
+  ours, kernel = fake_device()
+  kernel.send(event(0, rfkill.OP_ADD))
+
+  changes = []
+
+  with Rfkill(ours.fileno()) as radio:
+    radio.on_change(lambda soft, hard: changes.append((soft, hard)))
+
+    kernel.send(event(0, rfkill.OP_CHANGE, hard = True))
+    kernel.send(event(0, rfkill.OP_CHANGE, hard = True))
+    radio._readable()
+    assert changes == [(False, True)]
+
+    kernel.send(event(0, rfkill.OP_DEL))
+    radio._readable()
+    assert changes == [(False, True), (False, False)]
+    assert radio.device_count() == 0
@@ -0,0 +1,126 @@
+import logging
+
+from phony.base import log
+from phony.base.log import ClassLogger, Levels
+from phony.base.stats import CallStats, LogLinearHistogram, MethodStats
+
+class Timed(ClassLogger):
+  def __init__(self):
+    ClassLogger.__init__(self)
+    logging.getLogger(self.log_name()).setLevel(Levels.CRITICAL)
+
+  @ClassLogger.TraceAs.call()
+  def answer_call(self):
+    pass
+
+  @ClassLogger.TraceAs.call()
+  def fails(self):
+    raise ValueError('expected')
+
+def test_LogLinearHistogram_small_values_are_exact():
+  histogram = LogLinearHistogram()
+  for value in range(1, 21):
+    histogram.record_microseconds(value)
+
+  assert histogram.count() == 20
+  assert histogram.percentile(50) == 10
+  assert histogram.percentile(100) == 20
+  assert histogram.maximum() == 20
+
+def test_LogLinearHistogram_relative_error_is_bounded():
+  for value in [33, 100, 1000, 12345, 999999, 35000000]:
+    histogram = LogLinearHistogram()
+    histogram.record_microseconds(value)
+    histogram.record_microseconds(value * 10)
+
+    p50 = histogram.percentile(50)
+    assert value <= p50 <= value * (1 + 1.0 / LogLinearHistogram.SUB_BUCKETS)
+
+def test_LogLinearHistogram_percentiles():
+  histogram = LogLinearHistogram()
+  for value in range(1, 1001):
+    histogram.record(value / 1e6)
+
+  def close_to(actual, expected):
+    return abs(actual - expected) <= expected / float(LogLinearHistogram.SUB_BUCKETS)
+
+  assert close_to(histogram.percentile(50), 500)
+  assert close_to(histogram.percentile(95), 950)
+  assert close_to(histogram.percentile(99), 990)
+  assert histogram.percentile(100) == 1000
+
+def test_LogLinearHistogram_memory_is_fixed():
+  histogram = LogLinearHistogram()
+  for value in [0, 1, 2 ** 20, 2 ** 40, 2 ** 60]:
+    histogram.record_microseconds(value)
+
+  assert len(histogram._counts) == LogLinearHistogram.BUCKET_COUNT
+  assert histogram.count() == 5
+  assert histogram.maximum() == 2 ** 60
+
+def test_LogLinearHistogram_empty():
+  histogram = LogLinearHistogram()
+  assert histogram.summary() == {'count': 0, 'p50': 0, 'p95': 0, 'p99': 0, 'max': 0}
+
+def test_MethodStats_collected_from_TraceAs_call():
+  stats = MethodStats()
+  log.collect_method_stats(stats)
+  try:
+    timed = Timed()
+    for i in range(0, 10):
+      timed.answer_call()
+
+    try:
+      timed.fails()
+    except ValueError:
+      pass
+  finally:
+    log.collect_method_stats(None)
+
+  summary = stats.summary()
+  assert sorted(summary.keys()) == ['Timed.answer_call', 'Timed.fails']
+  assert summary['Timed.answer_call']['count'] == 10
+  assert summary['Timed.fails']['count'] == 1
+
+  assert stats.summary(prefix = 'Timed.ans').keys() == ['Timed.answer_call']
+  assert stats.histogram('Timed.fails').count() == 1
+
+def test_CallStats_summary():
+  stats = CallStats(slow_call_threshold = 10)
+  for i in range(0, 4):
+    stats.record_call('org.bluez', 'org.freedesktop.DBus.Properties', 'Get', 0.001, reply = True)
+  stats.record_call('org.bluez', 'org.freedesktop.DBus.Properties', 'Get', 0.002, error = ValueError('failed'))
+  stats.record_call('org.ofono', 'org.ofono.Manager', 'GetModems', 0.003, reply = [('/hfp/modem', {'Online': True})])
+
+  summary = stats.summary()
+  assert sorted(summary.keys()) == ['org.freedesktop.DBus.Properties.Get', 'org.ofono.Manager.GetModems']
+
+  get = summary['org.freedesktop.DBus.Properties.Get']
+  assert get['count'] == 5
+  assert get['errors'] == 1
+  assert get['reply_size'] == 1
+
+  assert summary['org.ofono.Manager.GetModems']['reply_size'] == 6
+  assert stats.summary(prefix = 'org.ofono').keys() == ['org.ofono.Manager.GetModems']
+  assert stats.slow_calls() == []
+
+def test_CallStats_keeps_recent_slow_calls():
+  stats = CallStats(slow_call_threshold = 0.1)
+  logging.getLogger(stats.log_name()).setLevel(Levels.CRITICAL)
+
+  for i in range(0, CallStats.SLOW_CALLS_KEPT + 10):
+    stats.record_call('org.ofono', 'org.ofono.VoiceCallManager', 'Dial', 0.2 + i / 1000.0)
+  stats.record_call('org.ofono', 'org.ofono.VoiceCallManager', 'Dial', 0.05)
+
+  slow = stats.slow_calls()
+  assert len(slow) == CallStats.SLOW_CALLS_KEPT
+  assert slow[-1]['member'] == 'org.ofono.VoiceCallManager.Dial'
+  assert slow[-1]['destination'] == 'org.ofono'
+  assert slow[-1]['milliseconds'] > slow[0]['milliseconds']
+
+def test_CallStats_signals():
+  stats = CallStats()
+  stats.record_signal('org.ofono.VoiceCall', 'PropertyChanged', 0.0001)
+
+  assert stats.signal_summary()['org.ofono.VoiceCall.PropertyChanged']['count'] == 1
+  assert stats.summary() == {}
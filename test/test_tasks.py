@@ -0,0 +1,127 @@
+import pytest
+
+from phony.base.future import CancelledError, Future
+from phony.base.tasks import Return, Task, coroutine
+
+@coroutine
+def add(first, second):
+  a = yield first
+  b = yield second
+  raise Return(a + b)
+
+def test_Task_resumes_with_results():
+  first = Future()
+  second = Future()
+
+  task = add(first, second)
+  assert not task.done()
+
+  first.set_result(1)
+  assert not task.done()
+
+  second.set_result(2)
+  assert task.result() == 3
+
+def test_Task_runs_through_completed_futures():
+  @coroutine
+  def count():
+    total = 0
+    for i in range(0, 5000):
+      total += yield Future.resolved(1)
+    raise Return(total)
+
+  assert count().result() == 5000
+
+def test_Task_without_Return_results_in_None():
+  @coroutine
+  def nothing():
+    yield Future.resolved()
+
+  assert nothing().result() is None
+
+def test_Task_raises_exceptions_at_the_yield():
+  seen = []
+
+  @coroutine
+  def recovers(future):
+    try:
+      yield future
+    except ValueError, ex:
+      seen.append(ex)
+    raise Return('recovered')
+
+  future = Future()
+  task = recovers(future)
+  future.set_exception(ValueError('expected'))
+
+  assert task.result() == 'recovered'
+  assert len(seen) == 1
+
+def test_Task_fails_with_unhandled_exception():
+  future = Future()
+  task = add(future, Future())
+  future.set_exception(ValueError('expected'))
+
+  assert isinstance(task.exception(), ValueError)
+
+def test_Task_gathers_lists():
+  @coroutine
+  def both(futures):
+    results = yield futures
+    raise Return(results)
+
+  futures = [Future(), Future()]
+  task = both(futures)
+  futures[1].set_result('b')
+  futures[0].set_result('a')
+
+  assert task.result() == ['a', 'b']
+
+def test_Task_rejects_other_values():
+  @coroutine
+  def wrong():
+    yield 42
+
+  assert isinstance(wrong().exception(), TypeError)
+
+def test_Task_cancel_runs_finally_blocks():
+  cleaned_up = []
+
+  @coroutine
+  def cadence(future):
+    try:
+      yield future
+    finally:
+      cleaned_up.append(True)
+
+  waiting = Future()
+  task = cadence(waiting)
+
+  assert task.cancel()
+  assert waiting.cancelled()
+  assert task.cancelled()
+  assert cleaned_up == [True]
+  assert not task.cancel()
+
+  with pytest.raises(CancelledError):
+    task.result()
+
+def test_Task_cancel_cancels_each_of_a_list():
+  @coroutine
+  def both(first, second):
+    yield [first, second]
+
+  first = Future()
+  second = Future()
+  task = both(first, second)
+
+  assert task.cancel()
+  assert first.cancelled() and second.cancelled()
+  assert task.cancelled()
+
+def test_Task_is_a_future():
+  inner = add(Future.resolved(1), Future.resolved(2))
+  outer = add(inner, Future.resolved(3))
+
+  assert isinstance(outer, Task)
+  assert outer.result() == 6